@@ -0,0 +1,265 @@
+"""
+People detector backends, selected by name.
+"""
+# coding: utf-8
+
+import cv2
+import detect
+import imgutils
+import tiling
+
+# Backend classes by name, filled by register()
+BACKENDS = {}
+
+
+def register(cls):
+    """Class decorator adding a Backend subclass to BACKENDS, under its name."""
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def create(name, **options):
+    """Build a backend by name.
+
+        Args:
+            name: a name in BACKENDS, like haar, hog or dnn.
+            options: keyword arguments of the backend constructor.
+
+        Returns:
+            A Backend object.
+
+        Raises:
+            ValueError: if there is no backend with this name.
+
+    """
+
+    if name not in BACKENDS:
+        raise ValueError("Unknown detector: " + str(name) + ". Available: " + ", ".join(sorted(BACKENDS)))
+    return BACKENDS[name](**options)
+
+
+class Backend(object):
+    """A people detector.
+
+        Backends find people in a frame and return the same result as
+        detect.old_detection() with return_rects=True, so the turret
+        can use any of them. New backends subclass Backend, set name,
+        implement _detect() and are added with @register. Usage
+        example below:
+
+        >>> import backends;
+        >>> backend = backends.create("hog");
+        >>> frame, decision, rects = backend.detect(frame, context);
+
+    """
+
+    name = None
+
+    def detect(self, frame, context, regions=None, **settings):
+        """Find people in a frame and draw them.
+
+            Args:
+                frame: a cv2 image. It is drawn on.
+                context: a preprocess.FrameContext of the frame.
+                regions: rectangles where motion was found, or the
+                         regions of a camera's zones. If given and
+                         empty, nothing is searched. Backends may
+                         restrict their search to these regions.
+                settings: speed settings chosen by a
+                          schedule.BudgetScheduler. Backends ignore
+                          the ones they don't use.
+
+            Returns:
+                A tuple (frame, decision, rects).
+
+            Raises:
+                No information.
+
+        """
+
+        if regions is not None and not regions:
+            return frame, False, []
+        rects = self._detect(context, **settings);
+        frame = imgutils.box(rects, frame, (0, 0, 255));
+        return frame, len(rects) > 0, rects
+
+
+    def _detect(self, context, **settings):
+        """Rectangles of the people in a frame, given its context."""
+        raise NotImplementedError
+
+
+    def quit(self):
+        """Release the threads or resources of the backend, if any."""
+        pass
+
+
+@register
+class HaarBackend(Backend):
+    """The upperbody cascade, confirmed by a face cascade in each upperbody.
+
+        Rectangles are the confirmed faces. With regions, only the
+        regions are searched, see detect.gated_detection().
+
+    """
+
+    name = "haar"
+
+    def __init__(self, upperbody_path, face_path, scale=1.0, tiles=None):
+        """HaarBackend constructor.
+
+            Args:
+                upperbody_path: path to the upperbody cascade file.
+                face_path: path to the face cascade file.
+                scale: resize factor of the upperbody search.
+                tiles: number of threads the upperbody search of
+                       each frame is split on, see tiling.TiledSearch.
+                       Default is a single search.
+
+            Returns:
+                A HaarBackend object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.cascade_upperbody = cv2.CascadeClassifier(upperbody_path);
+        self.cascade_face = cv2.CascadeClassifier(face_path);
+        self.scale = scale;
+        self.tiler = tiling.TiledSearch(tiles, upperbody_path) if tiles and tiles > 1 else None;
+
+
+    def detect(self, frame, context, regions=None, **settings):
+        settings.setdefault("scale", self.scale);
+        settings.setdefault("tiler", self.tiler);
+        if regions is not None:
+            return detect.gated_detection(frame, regions, self.cascade_upperbody, self.cascade_face, return_rects=True, context=context, **settings)
+        return detect.old_detection(frame, self.cascade_upperbody, self.cascade_face, return_rects=True, context=context, **settings)
+
+
+    def quit(self):
+        if self.tiler:
+            self.tiler.quit();
+
+
+@register
+class HogBackend(Backend):
+    """OpenCV's HOG people detector, trained on whole standing people.
+
+        It finds people further away and from behind, where the face
+        cascade fails, but needs people at least 64x128 pixels large
+        in the searched image.
+
+    """
+
+    name = "hog"
+
+    # Frames wider than this are searched on a resized copy, by default
+    max_width = 640
+
+    def __init__(self, scale=None, hit_threshold=0.0):
+        """HogBackend constructor.
+
+            Args:
+                scale: resize factor of the searched grayscale copy.
+                       HOG is slow, but people shrink with the frame:
+                       the searched copy is never made smaller than
+                       the detection window. None searches frames up
+                       to max_width wide at full resolution, and
+                       resizes larger ones to max_width.
+                hit_threshold: minimum SVM score of a detection.
+                               Higher values mean fewer false
+                               positives.
+
+            Returns:
+                A HogBackend object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.scale = scale;
+        self.hit_threshold = hit_threshold;
+        self._hog = cv2.HOGDescriptor();
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector());
+
+
+    def _scale(self, width, height):
+        """Resize factor of the searched copy of a width x height frame."""
+        (win_w, win_h) = self._hog.winSize;
+        scale = self.scale if self.scale else self.max_width / float(width);
+        # Nobody fits in an image smaller than the detection window
+        return min(max(scale, float(win_w) / width, float(win_h) / height), 1.0)
+
+
+    def _detect(self, context, **settings):
+        (h, w) = context.gray.shape[:2];
+        scale = self._scale(w, h);
+        small = context.scaled_gray(scale);
+        (win_w, win_h) = self._hog.winSize;
+        if small.shape[0] < win_h or small.shape[1] < win_w:
+            return []
+        (found, weights) = self._hog.detectMultiScale(small, hitThreshold=self.hit_threshold, winStride=(8, 8), padding=(8, 8), scale=1.05);
+        return [[max(int(x / scale), 0), max(int(y / scale), 0), min(int((x + fw) / scale), w), min(int((y + fh) / scale), h)]
+                for (x, y, fw, fh) in found]
+
+
+@register
+class DnnBackend(Backend):
+    """A single shot detector network, run on the CPU with OpenCV's dnn module.
+
+        The network is loaded from local Caffe files, like the
+        MobileNet-SSD model trained on PASCAL VOC, where people are
+        class 15. Only that class is reported.
+
+    """
+
+    name = "dnn"
+
+    def __init__(self, model, config, confidence=0.5, person_class=15, size=300, mean=127.5, factor=0.007843):
+        """DnnBackend constructor.
+
+            Args:
+                model: path to the .caffemodel weights.
+                config: path to the .prototxt network description.
+                confidence: minimum confidence of a detection.
+                person_class: class index of people in the model.
+                size: width and height of the network input.
+                mean: value subtracted from every pixel.
+                factor: multiplier applied after subtracting mean.
+
+            Returns:
+                A DnnBackend object.
+
+            Raises:
+                ValueError: if model or config are missing.
+
+        """
+
+        if not model or not config:
+            raise ValueError("The dnn detector needs a model and a config file.")
+        self.confidence = confidence;
+        self.person_class = person_class;
+        self._size = size;
+        self._mean = mean;
+        self._factor = factor;
+        self._net = cv2.dnn.readNetFromCaffe(config, model);
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU);
+
+
+    def _detect(self, context, **settings):
+        frame = context.masked_frame;
+        (h, w) = frame.shape[:2];
+        blob = cv2.dnn.blobFromImage(cv2.resize(frame, (self._size, self._size)), self._factor,
+                                     (self._size, self._size), self._mean);
+        self._net.setInput(blob);
+        # One row per detection: image id, class, confidence, then corners relative to the frame size
+        detections = self._net.forward().reshape(-1, 7);
+        rects = [];
+        for image, label, confidence, x1, y1, x2, y2 in detections:
+            if int(label) != self.person_class or confidence < self.confidence:
+                continue
+            rects.append([max(int(x1 * w), 0), max(int(y1 * h), 0), min(int(x2 * w), w), min(int(y2 * h), h)]);
+        return rects
@@ -0,0 +1,137 @@
+"""
+Adaptive background models for motion detection.
+"""
+# coding: utf-8
+
+import cv2
+import numpy
+
+# Background models offered by BackgroundModel
+METHODS = ("average", "mog2")
+
+
+class BackgroundModel(object):
+    """A background that slowly follows the scene, to find what moved.
+
+        A BackgroundModel object keeps a model of a camera's background
+        on a small grayscale copy of each frame, and updates it with
+        every frame, so slow lighting changes are absorbed instead of
+        being reported as motion forever. Two models are offered: a
+        running average of past frames, and OpenCV's MOG2 mixture of
+        gaussians, which also copes with flickering backgrounds but
+        costs more. Usage example below:
+
+        >>> import background, preprocess;
+        >>> model = background.BackgroundModel("average", 0.002);
+        >>> context = preprocess.FrameContext(frame);
+        >>> rects = model.apply(context);
+
+        A learning rate of 0 freezes the background at the first
+        frame.
+
+        Attributes:
+            method: average or mog2.
+            learning_rate: weight of each new frame in the background,
+                           between 0 and 1.
+            scale: resize factor of the frames the model works on.
+
+    """
+
+    def __init__(self, method="average", learning_rate=0.002, scale=0.25, threshold=25):
+        """BackgroundModel constructor.
+
+            Args:
+                method: average or mog2.
+                learning_rate: weight of each new frame in the
+                               background, between 0 and 1.
+                scale: resize factor of the frames the model works on,
+                       like 0.25. Motion needs no detail, and small
+                       frames make every step cheaper.
+                threshold: minimum gray level difference of a
+                           foreground pixel, for the average model.
+
+            Returns:
+                A BackgroundModel object.
+
+            Raises:
+                ValueError: if method is unknown.
+
+        """
+
+        if method not in METHODS:
+            raise ValueError("Unknown background model: " + str(method));
+
+        self.method = method;
+        self.learning_rate = learning_rate;
+        self.scale = scale;
+        self._threshold = threshold;
+        self._average = None;
+        self._mog2 = None;
+        self._learned = False;
+        if method == "mog2":
+            self._mog2 = cv2.createBackgroundSubtractorMOG2(detectShadows=True);
+
+
+    def apply(self, context, min_area=200):
+        """Find the foreground of a frame, then learn the frame.
+
+            Args:
+                context: a preprocess.FrameContext of the frame.
+                min_area: minimum area of a foreground region, in
+                          full-resolution pixels.
+
+            Returns:
+                A list of [x1, y1, x2, y2] bounding rectangles of the
+                foreground regions, in full-resolution pixels. Empty
+                on the first frame.
+
+            Raises:
+                No information.
+
+        """
+
+        small = cv2.GaussianBlur(context.scaled_gray(self.scale), (5, 5), 0);
+
+        if not self._learned:
+            # The first frame is the background, nothing moved yet
+            self._learned = True;
+            if self._mog2 is not None:
+                self._mog2.apply(small, learningRate=1.0);
+            else:
+                self._average = small.astype(numpy.float32);
+            return []
+
+        if self._mog2 is not None:
+            mask = self._mog2.apply(small, learningRate=self.learning_rate);
+            # Shadows are marked 127, only keep certain foreground
+            mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)[1];
+        else:
+            delta = cv2.absdiff(cv2.convertScaleAbs(self._average), small);
+            mask = cv2.threshold(delta, self._threshold, 255, cv2.THRESH_BINARY)[1];
+            cv2.accumulateWeighted(small, self._average, self.learning_rate);
+
+        # Nothing moves in excluded zones, even where the blur spread motion next to them
+        zones = context.scaled_mask(self.scale);
+        if zones is not None:
+            mask = cv2.bitwise_and(mask, zones);
+
+        return self._regions(mask, context.gray.shape[:2], min_area)
+
+
+    def _regions(self, mask, shape, min_area):
+        """Bounding rectangles of a foreground mask, in full-resolution pixels."""
+
+        # dilate the mask to fill in holes, then find contours on it
+        mask = cv2.dilate(mask, None, iterations=2);
+        (cnts, _) = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE);
+
+        scale = min(self.scale, 1.0);
+        (h, w) = shape;
+        rects = [];
+        for c in cnts:
+            if cv2.contourArea(c) < min_area * scale * scale:
+                continue
+            (x, y, cw, ch) = cv2.boundingRect(c);
+            rects.append([int(x / scale), int(y / scale),
+                          min(int(numpy.ceil((x + cw) / scale)), w), min(int(numpy.ceil((y + ch) / scale)), h)]);
+        return rects
@@ -0,0 +1,591 @@
+#!/usr/bin/python
+"""
+Benchmark the per-frame hot path of the turret.
+
+Times the image utilities, detectors, face recognizer and image saving
+at each frame size the GUI offers, and prints per-call latency
+percentiles and frames per second as JSON, and how many frames each
+people detector backend finds someone in. Given frames with known
+results, also reports the accuracy of each people detector backend next
+to its speed. Run with:
+
+        $ python bench.py
+        $ python bench.py --frames detected/ --output bench.json
+        $ python bench.py --frames detected/ --truth truth.jsonl
+        $ python bench.py --frames vtest.avi --case backend_hog
+"""
+# coding: utf-8
+
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+import cv2
+import numpy
+import imgutils
+import background
+import backends
+import detect
+import facerec
+import replay
+import preprocess
+import save
+import tiling
+
+# Frame sizes offered by the GUI
+SIZES = [(160, 120), (320, 240), (640, 480)]
+
+UPPERBODY_CASCADE = "haarcascades/haarcascade_mcs_upperbody.xml"
+FACE_CASCADE = "haarcascades/haarcascade_frontalface_alt.xml"
+
+
+def synthetic_frames(width, height, count=10, seed=0):
+    """Generate reproducible test frames.
+
+        Each frame has a smooth background, sensor-like noise and a few
+        bright blobs that move between frames, so motion detection has
+        something to find.
+
+        Args:
+            width: frame width.
+            height: frame height.
+            count: number of frames.
+            seed: random seed.
+
+        Returns:
+            A list of cv2 images.
+
+        Raises:
+            No information.
+
+    """
+
+    rng = numpy.random.RandomState(seed)
+    gradient = numpy.linspace(40, 200, width).astype(numpy.uint8)
+    background = numpy.dstack([numpy.tile(gradient, (height, 1))] * 3)
+    frames = []
+    for i in range(count):
+        frame = background.copy()
+        noise = rng.randint(-8, 9, frame.shape)
+        frame = numpy.clip(frame + noise, 0, 255).astype(numpy.uint8)
+        for j in range(3):
+            center = (int((j + 1) * width / 4 + i * width / 50), int(height / 2))
+            axes = (int(width / 16), int(height / 6))
+            cv2.ellipse(frame, center, axes, 0, 0, 360, (220, 200, 180), -1)
+        frames.append(frame)
+    return frames
+
+
+def recorded_frames(path, width, height, count=10):
+    """Load recorded frames and resize them to a benchmark size.
+
+        Args:
+            path: a video file path, or a directory of images.
+            width: frame width.
+            height: frame height.
+            count: maximum number of frames.
+
+        Returns:
+            A list of cv2 images.
+
+        Raises:
+            No information.
+
+    """
+
+    frames = []
+    for frame_id, frame in replay.read_frames(path):
+        frames.append(imgutils.resize(frame, width, height))
+        if len(frames) >= count:
+            break
+    return frames
+
+
+def build_recognizer(algorithm, modelpath=None):
+    """Build a FaceRecognizer for the benchmark.
+
+        Args:
+            algorithm: eigen, fisher or lbph.
+            modelpath: directory of a trained model. If None, a tiny
+                       model is trained on random faces, which is
+                       enough to time recognize().
+
+        Returns:
+            A facerec.FaceRecognizer object.
+
+        Raises:
+            No information.
+
+    """
+
+    mrfaces = facerec.FaceRecognizer(algorithm, 500)
+    if modelpath:
+        mrfaces.load_model(modelpath)
+    else:
+        rng = numpy.random.RandomState(0)
+        faces = [rng.randint(0, 256, (64, 64)).astype(numpy.uint8) for i in range(4)]
+        mrfaces.recognizer.train(faces, numpy.array([0, 0, 1, 1]))
+        mrfaces.names = ['first', 'second']
+    return mrfaces
+
+
+def build_backends(dnn_model=None, dnn_config=None):
+    """Build every people detector backend that can run here.
+
+        Args:
+            dnn_model: Caffe weights of the dnn backend. If None, the
+                       dnn backend is left out.
+            dnn_config: Caffe network description of the dnn backend.
+
+        Returns:
+            A list of (name, backend) tuples.
+
+        Raises:
+            No information.
+
+    """
+
+    detectors = [
+        ("haar", backends.create("haar", upperbody_path=UPPERBODY_CASCADE, face_path=FACE_CASCADE)),
+        ("hog", backends.create("hog")),
+    ]
+    if dnn_model:
+        detectors.append(("dnn", backends.create("dnn", model=dnn_model, config=dnn_config)))
+    return detectors
+
+
+def backend_function(backend):
+    """A function taking a single frame and running a backend on it."""
+    return lambda frame: backend.detect(frame, preprocess.FrameContext(frame))
+
+
+def load_truth(path, truth_path):
+    """Load recorded frames along with their expected results.
+
+        Args:
+            path: a video file path, or a directory of images.
+            truth_path: a JSON lines file in the format written by
+                        turret.py --replay, checked by hand: one line
+                        per frame with its frame id, decision and
+                        rectangles.
+
+        Returns:
+            A list of (frame, decision, rects) tuples, for the frames
+            that have an expected result.
+
+        Raises:
+            No information.
+
+    """
+
+    expected = {}
+    with open(truth_path) as truth:
+        for line in truth:
+            if line.strip():
+                result = json.loads(line)
+                expected[str(result["frame"])] = (result["decision"], result["rects"])
+    samples = []
+    for frame_id, frame in replay.read_frames(path):
+        if str(frame_id) in expected:
+            decision, rects = expected[str(frame_id)]
+            samples.append((frame, decision, rects))
+    return samples
+
+
+def accuracy(function, samples, min_overlap=0.5):
+    """Measure the speed and accuracy of a detector on known frames.
+
+        Args:
+            function: a function taking a frame, returning a tuple
+                      (frame, decision, rects).
+            samples: a list of (frame, decision, rects) tuples.
+            min_overlap: minimum intersection over union of a match.
+
+        Returns:
+            A dictionary with the decision precision and recall, the
+            recall of expected rectangles, and the call latencies as
+            in summarize().
+
+        Raises:
+            No information.
+
+    """
+
+    times = []
+    true_positives = false_positives = false_negatives = 0
+    expected_rects = found_rects = 0
+    for frame, decision, rects in samples:
+        frame = frame.copy()
+        start = timeit.default_timer()
+        result = function(frame)
+        times.append(timeit.default_timer() - start)
+        got_decision, got_rects = result[1], result[2]
+        true_positives += bool(got_decision and decision)
+        false_positives += bool(got_decision and not decision)
+        false_negatives += bool(decision and not got_decision)
+        expected_rects += len(rects)
+        found_rects += sum(1 for e in rects if any(overlap(e, g) >= min_overlap for g in got_rects))
+    result = summarize(times)
+    result.update({
+        "precision": round(float(true_positives) / (true_positives + false_positives), 4) if true_positives + false_positives else None,
+        "recall": round(float(true_positives) / (true_positives + false_negatives), 4) if true_positives + false_negatives else None,
+        "rect_recall": round(float(found_rects) / expected_rects, 4) if expected_rects else None,
+    })
+    return result
+
+
+def build_cases(frames, mrfaces, savedir, scale=None, detectors=(), tiler=None):
+    """Build the functions to time, each taking a single frame.
+
+        Args:
+            frames: the frames the cases will run on, the first
+                    one used to start the background models.
+            mrfaces: a facerec.FaceRecognizer object.
+            savedir: a scratch directory for save.save().
+            scale: if given, also time the upperbody search on frames
+                   resized by this factor.
+            detectors: (name, backend) tuples of people detector
+                       backends to time.
+            tiler: if given, a tiling.TiledSearch object; also time
+                   the upperbody search split in tiles.
+
+        Returns:
+            A list of (name, function) tuples.
+
+        Raises:
+            No information.
+
+    """
+
+    cascade_upperbody = cv2.CascadeClassifier(UPPERBODY_CASCADE)
+    cascade_face = cv2.CascadeClassifier(FACE_CASCADE)
+
+    # Background models learn the first frame, then keep learning as in the turret
+    backgrounds = {}
+    for method in background.METHODS:
+        backgrounds[method] = background.BackgroundModel(method)
+        backgrounds[method].apply(preprocess.FrameContext(frames[0]))
+
+    (h, w) = frames[0].shape[:2]
+    now = datetime.datetime(2016, 1, 1)
+
+    def save_frame(frame):
+        # save.save() writes to detected/ under the current directory
+        cwd = os.getcwd()
+        os.chdir(savedir)
+        try:
+            save.save(frame, now)
+        finally:
+            os.chdir(cwd)
+
+    cases = [
+        ("detect_pattern", lambda frame: imgutils.detect_pattern(frame, cascade_upperbody, (60, 60))),
+        ("old_detection", lambda frame: detect.old_detection(frame, cascade_upperbody, cascade_face)),
+        ("motion_detection", lambda frame: detect.motion_detection(frame, backgrounds["average"])),
+        ("motion_detection_mog2", lambda frame: detect.motion_detection(frame, backgrounds["mog2"])),
+        ("rotate", lambda frame: imgutils.rotate(frame, 90)),
+        ("resize", lambda frame: imgutils.resize(frame, w / 2, h / 2)),
+        ("recognize", lambda frame: mrfaces.recognize(frame)),
+        ("save", save_frame),
+    ]
+    cases += [("backend_" + name, backend_function(backend)) for name, backend in detectors]
+    if tiler:
+        cases += [
+            ("detect_pattern_tiled", lambda frame: imgutils.detect_pattern(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cascade_upperbody, (60, 60), tiler=tiler)),
+            ("detect_pattern_gray", lambda frame: imgutils.detect_pattern(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), cascade_upperbody, (60, 60))),
+        ]
+    if scale:
+        cases += [
+            ("detect_pattern_scaled", lambda frame: imgutils.detect_pattern_scaled(frame, cascade_upperbody, (60, 60), scale)),
+            ("old_detection_scaled", lambda frame: detect.old_detection(frame, cascade_upperbody, cascade_face, scale=scale)),
+        ]
+    return cases
+
+
+def build_comparisons(scale=None, detectors=(), tiler=None):
+    """Build pairs of detectors whose results should agree.
+
+        Args:
+            scale: if given, compare the upperbody search on resized
+                   frames against the full-resolution search.
+            detectors: (name, backend) tuples of people detector
+                       backends, compared against the haar backend.
+            tiler: if given, a tiling.TiledSearch object; compare the
+                   upperbody search split in tiles against a single
+                   search.
+
+        Returns:
+            A list of (name, reference, candidate) tuples. reference
+            and candidate are functions taking a single frame and
+            returning rectangles.
+
+        Raises:
+            No information.
+
+    """
+
+    cascade_upperbody = cv2.CascadeClassifier(UPPERBODY_CASCADE)
+
+    comparisons = []
+    if scale:
+        comparisons.append(("upperbody_scaled",
+                            lambda frame: imgutils.detect_pattern(frame, cascade_upperbody, (60, 60))[0],
+                            lambda frame: imgutils.detect_pattern_scaled(frame, cascade_upperbody, (60, 60), scale)[0]))
+    if tiler:
+        comparisons.append(("upperbody_tiled",
+                            lambda frame: imgutils.detect_pattern(frame, cascade_upperbody, (60, 60))[0],
+                            lambda frame: imgutils.detect_pattern(frame, cascade_upperbody, (60, 60), tiler=tiler)[0]))
+    # Backends find different things, faces or whole bodies; decisions are what should agree
+    reference = dict(detectors).get("haar")
+    for name, backend in detectors:
+        if reference and name != "haar":
+            comparisons.append(("backend_" + name,
+                                lambda frame, backend=reference: backend_function(backend)(frame)[2],
+                                lambda frame, backend=backend: backend_function(backend)(frame)[2]))
+    return comparisons
+
+
+def overlap(a, b):
+    """Intersection over union of two rectangles given by their corners."""
+    iw = min(a[2], b[2]) - max(a[0], b[0])
+    ih = min(a[3], b[3]) - max(a[1], b[1])
+    if iw <= 0 or ih <= 0:
+        return 0.0
+    intersection = float(iw * ih)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union
+
+
+def agreement(reference, candidate, frames, min_overlap=0.5):
+    """Measure how many reference detections a candidate detector finds.
+
+        A reference rectangle counts as found when a candidate
+        rectangle overlaps it by at least min_overlap (intersection
+        over union).
+
+        Args:
+            reference: a function taking a frame, returning rectangles.
+            candidate: a function taking a frame, returning rectangles.
+            frames: a list of cv2 images.
+            min_overlap: minimum intersection over union of a match.
+
+        Returns:
+            A dictionary with the number of reference and candidate
+            rectangles, the recall of the candidate, and the fraction
+            of frames where both agree on whether anything was found.
+
+        Raises:
+            No information.
+
+    """
+
+    total = 0
+    found = 0
+    candidates = 0
+    same_decision = 0
+    for frame in frames:
+        expected = reference(frame.copy())
+        got = candidate(frame.copy())
+        total += len(expected)
+        candidates += len(got)
+        found += sum(1 for e in expected if any(overlap(e, g) >= min_overlap for g in got))
+        same_decision += (len(expected) > 0) == (len(got) > 0)
+    return {
+        "reference_rects": total,
+        "candidate_rects": candidates,
+        "recall": round(float(found) / total, 4) if total else None,
+        "decision_agreement": round(float(same_decision) / len(frames), 4),
+    }
+
+
+def detections(function, frames):
+    """Count what a detector finds on a set of frames.
+
+        Args:
+            function: a function taking a frame, returning a tuple
+                      (frame, decision, rects), like a backend.
+            frames: a list of cv2 images.
+
+        Returns:
+            A dictionary with the number of frames where something
+            was found, and the number of rectangles found.
+
+        Raises:
+            No information.
+
+    """
+
+    fired = 0
+    rects = 0
+    for frame in frames:
+        (frame, decision, found) = function(frame.copy())
+        fired += bool(decision)
+        rects += len(found)
+    return {"fired_frames": fired, "searched_frames": len(frames), "rects": rects}
+
+
+def measure(function, frames, repeat):
+    """Time a function over a set of frames.
+
+        Every call gets a fresh copy of the frame, made outside the
+        timed region, since most functions draw on their input.
+
+        Args:
+            function: a function taking a single frame.
+            frames: a list of cv2 images.
+            repeat: number of passes over the frames.
+
+        Returns:
+            A list with the duration of each call, in seconds.
+
+        Raises:
+            No information.
+
+    """
+
+    times = []
+    for i in range(repeat):
+        for frame in frames:
+            frame = frame.copy()
+            start = timeit.default_timer()
+            function(frame)
+            times.append(timeit.default_timer() - start)
+    return times
+
+
+def summarize(times):
+    """Summarize call durations.
+
+        Args:
+            times: a list of durations, in seconds.
+
+        Returns:
+            A dictionary with the number of calls, mean and p50, p90
+            and p99 latencies in milliseconds, and the frames per
+            second a single core sustains.
+
+        Raises:
+            No information.
+
+    """
+
+    times = numpy.array(times) * 1000.0
+    mean = float(times.mean())
+    return {
+        "calls": len(times),
+        "mean_ms": round(mean, 3),
+        "p50_ms": round(float(numpy.percentile(times, 50)), 3),
+        "p90_ms": round(float(numpy.percentile(times, 90)), 3),
+        "p99_ms": round(float(numpy.percentile(times, 99)), 3),
+        "fps": round(1000.0 / mean, 2) if mean > 0 else None,
+    }
+
+
+def run(frame_sets, mrfaces, repeat, selected=None, scale=None, detectors=(), samples=None, tiler=None):
+    """Run every benchmark case and comparison on every frame set.
+
+        Args:
+            frame_sets: a list of (kind, width, height, frames) tuples.
+            mrfaces: a facerec.FaceRecognizer object.
+            repeat: number of passes over the frames.
+            selected: names of the cases to run. None runs all.
+            scale: resize factor of the scaled upperbody search. None
+                   skips the scaled cases.
+            detectors: (name, backend) tuples of people detector
+                       backends.
+            samples: (frame, decision, rects) tuples with known
+                     results, to measure the accuracy of each backend.
+            tiler: a tiling.TiledSearch object. None skips the tiled
+                   cases.
+
+        Returns:
+            A list of result dictionaries.
+
+        Raises:
+            No information.
+
+    """
+
+    results = []
+    savedir = tempfile.mkdtemp()
+    try:
+        for kind, width, height, frames in frame_sets:
+            for name, function in build_cases(frames, mrfaces, savedir, scale, detectors, tiler):
+                if selected and name not in selected:
+                    continue
+                result = {"case": name, "frames": kind, "width": width, "height": height}
+                result.update(summarize(measure(function, frames, repeat)))
+                results.append(result)
+                print >> sys.stderr, "{case} {frames} {width}x{height}: p50 {p50_ms} ms, {fps} frames/s".format(**result)
+            for name, reference, candidate in build_comparisons(scale, detectors, tiler):
+                if selected and name not in selected:
+                    continue
+                result = {"comparison": name, "frames": kind, "width": width, "height": height}
+                result.update(agreement(reference, candidate, frames))
+                results.append(result)
+                print >> sys.stderr, "{comparison} {frames} {width}x{height}: recall {recall}".format(**result)
+            # A backend that never fires at a frame size is fast for nothing: report what each one finds
+            for name, backend in detectors:
+                if selected and "backend_" + name not in selected:
+                    continue
+                result = {"detections": "backend_" + name, "frames": kind, "width": width, "height": height}
+                result.update(detections(backend_function(backend), frames))
+                results.append(result)
+                print >> sys.stderr, "{detections} {frames} {width}x{height}: found people in {fired_frames} of {searched_frames} frames".format(**result)
+        for name, backend in detectors:
+            if not samples or (selected and "backend_" + name not in selected):
+                continue
+            result = {"accuracy": "backend_" + name, "frames": "truth", "samples": len(samples)}
+            result.update(accuracy(backend_function(backend), samples))
+            results.append(result)
+            print >> sys.stderr, "{accuracy}: precision {precision}, recall {recall}, p50 {p50_ms} ms".format(**result)
+    finally:
+        shutil.rmtree(savedir)
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Benchmark the turret's per-frame hot path.")
+    parser.add_argument("--frames", type=str, help="Also benchmark on recorded frames, from a video file or a directory of images.")
+    parser.add_argument("--count", type=int, default=10, help="Number of frames per frame set. Standard is 10.")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of passes over each frame set. Standard is 5.")
+    parser.add_argument("--case", type=str, action="append", help="Run only this case. Repeat to run several.")
+    parser.add_argument("-f", "--facerecognition", type=str, default="fisher", help="Face recognition algorithm: eigen, fisher or lbph. Standard is fisher.")
+    parser.add_argument("--model", type=str, help="Directory of a trained face recognition model. Standard is a tiny random model.")
+    parser.add_argument("--scale", type=float, help="Also benchmark the upperbody search on frames resized by this factor, like 0.5, and its recall against full resolution.")
+    parser.add_argument("--tiles", type=int, help="Also benchmark the upperbody search split in tiles on this many threads, and its recall against a single search.")
+    parser.add_argument("--dnn-model", type=str, help="Caffe weights of the dnn detector backend. Standard is to leave it out.")
+    parser.add_argument("--dnn-config", type=str, help="Caffe network description of the dnn detector backend.")
+    parser.add_argument("--truth", type=str, help="Expected results of the --frames frames, as JSON lines written by turret.py --replay and checked by hand. Reports the accuracy of each detector backend.")
+    parser.add_argument("-o", "--output", type=str, help="Write results to this file instead of standard output.")
+    args = parser.parse_args()
+
+    frame_sets = []
+    for width, height in SIZES:
+        frame_sets.append(("synthetic", width, height, synthetic_frames(width, height, args.count)))
+        if args.frames:
+            frames = recorded_frames(args.frames, width, height, args.count)
+            if frames:
+                frame_sets.append(("recorded", width, height, frames))
+
+    mrfaces = build_recognizer(args.facerecognition, args.model)
+    detectors = build_backends(args.dnn_model, args.dnn_config)
+    samples = load_truth(args.frames, args.truth) if args.frames and args.truth else None
+    tiler = tiling.TiledSearch(args.tiles, UPPERBODY_CASCADE) if args.tiles else None
+    results = run(frame_sets, mrfaces, args.repeat, args.case, args.scale, detectors, samples, tiler)
+    if tiler:
+        tiler.quit()
+    for name, backend in detectors:
+        backend.quit()
+
+    report = json.dumps({"opencv": cv2.__version__, "results": results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + "\n")
+    else:
+        print report
@@ -0,0 +1,245 @@
+"""
+Capture camera frames in a background thread.
+"""
+# coding: utf-8
+
+import threading
+import time
+import cv2
+import numpy
+
+# Capture property ids, as in OpenCV's C API
+CV_CAP_PROP_FRAME_WIDTH  = 3;
+CV_CAP_PROP_FRAME_HEIGHT = 4;
+
+def open_source(source):
+    """Open a video source.
+
+        Args:
+            source: a string, either a camera device index, like "0",
+                    or a video file path or stream URL, like
+                    "rtsp://192.168.0.10/stream".
+
+        Returns:
+            A cv2.VideoCapture object.
+
+        Raises:
+            No information.
+
+    """
+
+    if source.isdigit():
+        return cv2.VideoCapture(int(source))
+    return cv2.VideoCapture(source)
+
+
+class FrameGrabber(object):
+    """Capture frames continuously, always hand out the newest one.
+
+        A FrameGrabber object reads frames from a cv2.VideoCapture in
+        a dedicated thread, into a small ring of preallocated frame
+        buffers. Slow consumers never stall capture: when a frame is
+        not read before the next one arrives, it is dropped and the
+        drop is counted. To use it, do the following:
+
+        >>> import capture;
+        >>> camera = cv2.VideoCapture(0);
+        >>> grabber = capture.FrameGrabber(camera, 320, 240);
+
+        Get the newest frame, as you would do with camera.read():
+
+        >>> ret, frame = grabber.read();
+
+        The returned frame is a buffer owned by the grabber. It stays
+        valid until the next call to read(); copy it if you need to
+        keep it longer (for example, to save it in another thread).
+
+        Attributes:
+            grabbed: number of frames captured since start.
+            dropped: number of captured frames that were never read.
+
+    """
+
+    def __init__(self, camera, width, height, slots=3, event=None):
+        """FrameGrabber constructor.
+
+            Args:
+                camera: a cv2.VideoCapture object.
+                width: initial frame width.
+                height: initial frame height.
+                slots: number of frame buffers in the ring. At least
+                       three are needed, so the capture thread always
+                       has a free buffer to write to.
+                event: a threading.Event set on every new frame. Share
+                       it between grabbers to wait for a frame from
+                       any of them.
+
+            Returns:
+                A FrameGrabber object.
+
+            Raises:
+                ValueError: if less than three slots are requested.
+
+        """
+
+        if slots < 3:
+            raise ValueError("FrameGrabber needs at least three slots")
+
+        self.camera = camera;
+        self.grabbed = 0;
+        self.dropped = 0;
+
+        # Preallocate the frame ring
+        self._buffers = [numpy.zeros((height, width, 3), numpy.uint8) for i in range(slots)];
+        self._newest = -1;      # Slot holding the newest captured frame
+        self._reading = -1;     # Slot currently lent to the consumer
+        self._writing = -1;     # Last slot written by the capture thread
+        self._fresh = False;    # Whether the newest frame was not read yet
+
+        self._ring_lock = threading.Condition();
+        self._camera_lock = threading.Lock();
+        self._event = event;
+
+        self._running = True;
+        self._thread = threading.Thread(target=self._grabloop);
+        self._thread.daemon = True;
+        self._thread.start();
+
+
+    def quit(self):
+        """Stop the capture thread.
+
+            This method should be called before releasing the camera.
+
+            Args:
+                None.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        self._running = False;
+        with self._ring_lock:
+            self._ring_lock.notify_all();
+        self._thread.join(1);
+
+
+    def set(self, prop, value):
+        """Set a camera property without racing the capture thread.
+
+            Args:
+                prop: a cv2 capture property id.
+                value: new value of the property.
+
+            Returns:
+                Whatever camera.set() returns.
+
+            Raises:
+                No information.
+
+        """
+
+        with self._camera_lock:
+            return self.camera.set(prop, value);
+
+
+    def read(self, timeout=1.0):
+        """Get the newest captured frame.
+
+            Blocks until a frame that was not read before is available.
+
+            Args:
+                timeout: maximum time to wait for a frame, in seconds.
+                         0 returns at once.
+
+            Returns:
+                A tuple (ret, frame), as camera.read() does. ret is
+                False if no new frame arrived before the timeout.
+
+            Raises:
+                No information.
+
+        """
+
+        deadline = time.time() + timeout;
+        with self._ring_lock:
+            while not self._fresh and self._running:
+                remaining = deadline - time.time();
+                if remaining <= 0:
+                    return False, None
+                self._ring_lock.wait(remaining);
+            if not self._fresh:
+                return False, None
+            # Lend the newest slot to the consumer; the previous one goes back to the ring
+            self._reading = self._newest;
+            self._fresh = False;
+            return True, self._buffers[self._reading]
+
+
+    def _next_slot(self):
+        """Choose the slot the capture thread will write next.
+
+            Never returns the slot with the newest frame or the slot
+            lent to the consumer. Must be called with the ring lock held.
+
+            Args:
+                None.
+
+            Returns:
+                Index of a free slot.
+
+            Raises:
+                No information.
+
+        """
+
+        slot = self._writing;
+        while True:
+            slot = (slot + 1) % len(self._buffers);
+            if slot != self._newest and slot != self._reading:
+                return slot
+
+
+    def _grabloop(self):
+        """Capture thread main method. Continuously fills the ring.
+
+            Args:
+                None.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        while self._running:
+            with self._ring_lock:
+                slot = self._next_slot();
+                self._writing = slot;
+                buf = self._buffers[slot];
+
+            # Read straight into the preallocated buffer, out of the ring lock
+            with self._camera_lock:
+                ret, frame = self.camera.read(buf);
+            if not ret:
+                time.sleep(0.01);
+                continue
+
+            with self._ring_lock:
+                # The camera allocates a new array when the frame size changes
+                if frame is not buf:
+                    self._buffers[slot] = frame;
+                if self._fresh:
+                    self.dropped += 1;
+                self._newest = slot;
+                self._fresh = True;
+                self.grabbed += 1;
+                self._ring_lock.notify();
+            if self._event:
+                self._event.set();
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""
+Compare two face cascades on the same recorded frames.
+
+Runs the upperbody verification stage and the face recognizer's face
+finder with each cascade over a replay set, and prints as JSON how long
+each one takes and how often they agree, so a site can switch to a
+faster cascade knowing what changes. Run with:
+
+        $ python compare_cascades.py detected/
+        $ python compare_cascades.py detected/ --reference haar --candidate lbp_improved
+"""
+# coding: utf-8
+
+import argparse
+import json
+import sys
+import cv2
+import bench
+import detect
+import facerec
+import imgutils
+import preprocess
+import replay
+
+
+def stages(cascade_upperbody, cascade_face):
+    """Build the face cascade stages to compare.
+
+        Args:
+            cascade_upperbody: upperbody CascadeClassifier.
+            cascade_face: face CascadeClassifier.
+
+        Returns:
+            A list of (name, function) tuples. Each function takes a
+            single frame and returns face rectangles.
+
+        Raises:
+            No information.
+
+    """
+
+    return [
+        # Faces confirming upperbodies, as in detect.old_detection()
+        ("verification", lambda frame: detect.old_detection(frame, cascade_upperbody, cascade_face, return_rects=True)[2]),
+        # Faces to recognize, as in facerec.FaceRecognizer.recognize()
+        ("recognizer", lambda frame: imgutils.detect_pattern(preprocess.FrameContext(frame).gray, cascade_face, (64, 64))[0]),
+    ]
+
+
+def compare(frames, upperbody_path, reference_path, candidate_path, repeat=1):
+    """Time both face cascades and measure their agreement on each stage.
+
+        Args:
+            frames: a list of cv2 images.
+            upperbody_path: path to the upperbody cascade file.
+            reference_path: path to the face cascade in use.
+            candidate_path: path to the face cascade to switch to.
+            repeat: number of timed passes over the frames.
+
+        Returns:
+            A list of result dictionaries, one per stage.
+
+        Raises:
+            No information.
+
+    """
+
+    cascade_upperbody = cv2.CascadeClassifier(upperbody_path)
+    reference = stages(cascade_upperbody, cv2.CascadeClassifier(reference_path))
+    candidate = stages(cascade_upperbody, cv2.CascadeClassifier(candidate_path))
+
+    results = []
+    for (name, reference_function), (name, candidate_function) in zip(reference, candidate):
+        result = {"stage": name, "frames": len(frames)}
+        reference_times = bench.summarize(bench.measure(reference_function, frames, repeat))
+        candidate_times = bench.summarize(bench.measure(candidate_function, frames, repeat))
+        result["reference"] = reference_times
+        result["candidate"] = candidate_times
+        result["speedup"] = round(reference_times["mean_ms"] / candidate_times["mean_ms"], 2) if candidate_times["mean_ms"] else None
+        result.update(bench.agreement(reference_function, candidate_function, frames))
+        results.append(result)
+        print >> sys.stderr, "{stage}: {speedup}x faster, recall {recall}, decision agreement {decision_agreement}".format(**result)
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Compare two face cascades on the same recorded frames.")
+    parser.add_argument("frames", type=str, help="A video file or a directory of images, like detected/.")
+    parser.add_argument("--reference", type=str, default="haar", help="Face cascade in use: " + ", ".join(sorted(facerec.FACE_CASCADES)) + ", or a file path. Standard is haar.")
+    parser.add_argument("--candidate", type=str, default="lbp", help="Face cascade to switch to, as --reference. Standard is lbp.")
+    parser.add_argument("--count", type=int, help="Maximum number of frames. Standard is all.")
+    parser.add_argument("--repeat", type=int, default=1, help="Number of timed passes over the frames. Standard is 1.")
+    parser.add_argument("-o", "--output", type=str, help="Write results to this file instead of standard output.")
+    args = parser.parse_args()
+
+    frames = []
+    for frame_id, frame in replay.read_frames(args.frames):
+        frames.append(frame)
+        if args.count and len(frames) >= args.count:
+            break
+    if not frames:
+        print >> sys.stderr, "No frames found in", args.frames
+        sys.exit(1)
+
+    reference_path = facerec.FACE_CASCADES.get(args.reference, args.reference)
+    candidate_path = facerec.FACE_CASCADES.get(args.candidate, args.candidate)
+    results = compare(frames, bench.UPPERBODY_CASCADE, reference_path, candidate_path, args.repeat)
+
+    report = json.dumps({"opencv": cv2.__version__, "reference": reference_path, "candidate": candidate_path, "results": results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + "\n")
+    else:
+        print report
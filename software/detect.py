@@ -1,68 +1,94 @@
 import cv2
 import imgutils
+import preprocess
 
-def old_detection(frame, cascade_upperbody, cascade_face):
-        
-    # Detect upperbodies in the frame and draw a green rectangle around it, if found
-    (rects_upperbody, frame) = imgutils.detect_pattern(frame, cascade_upperbody, (60,60))
-    frame = imgutils.box(rects_upperbody, frame)
-    rects_face = [];
-    decision = False;
+def old_detection(frame, cascade_upperbody, cascade_face, return_rects=False, scale=1.0, context=None, scale_factor=1.2, min_upperbody=(60,60), tiler=None):
+    
+    # Share one grayscale conversion between the upperbody search and every face search
+    if context is None:
+        context = preprocess.FrameContext(frame)
+    gray = context.gray
+    
+    # With scale below 1, the upperbody search runs on a smaller grayscale copy of the frame
+    (frame, rects) = _search(frame, gray, cascade_upperbody, cascade_face, scale, context.scaled_gray(scale), 0, 0, scale_factor, min_upperbody, tiler)
+    decision = len(rects) > 0
+    
+    if return_rects:
+        return frame, decision, rects
+    return frame, decision
+
+
+def _search(frame, gray, cascade_upperbody, cascade_face, scale, small=None, x0=0, y0=0, scale_factor=1.2, min_upperbody=(60,60), tiler=None):
+    
+    # Detect upperbodies in gray, a region of the frame starting at (x0, y0), and draw a green rectangle around it, if found
+    # scale_factor and min_upperbody trade accuracy for speed, see schedule.BudgetScheduler; a tiler spreads the search on threads
+    (rects_upperbody, gray) = imgutils.detect_pattern_scaled(gray, cascade_upperbody, min_upperbody, scale, small, scale_factor, tiler)
+    frame = imgutils.box([[x + x0, y + y0, w + x0, h + y0] for x, y, w, h in rects_upperbody], frame)
+    rects = [];
     # Search for upperbodies!
     if len(rects_upperbody) > 0:
     
-        # For each upperbody detected, search for faces! (Removes false positives)
-        for x, y, w, h in rects_upperbody:
-            frame_crop = frame[y:h, x:w];
-            (rects_face, frame_crop) = imgutils.detect_pattern(frame_crop, cascade_face, (25,25))
+        # Overlapping upperbodies are often the same person: search faces once in their union
+        # For each group of upperbodies detected, search for faces! (Removes false positives)
+        for x, y, w, h in imgutils.group_rects(rects_upperbody):
+            # Faces are always verified on full-resolution crops
+            gray_crop = gray[y:h, x:w];
+            (rects_face, gray_crop) = imgutils.detect_pattern(gray_crop, cascade_face, (25,25))
             
             # For each face detected, make some drawings around it
             for xf, yf, wf, hf in rects_face:
             
-                xf += x;
-                yf += y;
-                wf += x;
-                hf += y;
+                xf += x + x0;
+                yf += y + y0;
+                wf += x + x0;
+                hf += y + y0;
                 
                 #cv2.circle(frame, ((w+x)/2, (h+y)/2), 10, (255,0,0), thickness=1, lineType=8, shift=0)
                 #cv2.circle(frame, (wf, hf), 10, (0,0,255), thickness=1, lineType=8, shift=0)
                 
                 frame = imgutils.box([[xf, yf, wf, hf]], frame, (0, 0, 255))
+                rects.append([xf, yf, wf, hf])
+    
+    return frame, rects
+
+
+def gated_detection(frame, regions, cascade_upperbody, cascade_face, padding=30, return_rects=False, scale=1.0, context=None, scale_factor=1.2, min_upperbody=(60,60), tiler=None):
+    
+    if context is None:
+        context = preprocess.FrameContext(frame)
+    gray = context.gray
+    (h, w) = gray.shape[:2]
+    
+    # Only search regions that moved, as found by a background.BackgroundModel; pad them so people cut by their edges are found
+    regions = imgutils.merge_rects(imgutils.pad_rects(regions, padding, w, h))
     
-    if len(rects_face) > 0:
-        decision = True;
+    rects = [];
+    for x1, y1, x2, y2 in regions:
+        (frame, region_rects) = _search(frame, gray[y1:y2, x1:x2], cascade_upperbody, cascade_face, scale, None, x1, y1, scale_factor, min_upperbody, tiler)
+        rects += region_rects
+    decision = len(rects) > 0
     
+    if return_rects:
+        return frame, decision, rects
     return frame, decision
 
 
 # based on a tutorial from http://www.pyimagesearch.com/
-def motion_detection(frame, first_frame, min_area=200):
+def motion_detection(frame, background, min_area=200, return_rects=False, context=None):
  
     decision = False
+    rects = []
 
-    # resize the frame, convert it to grayscale, and blur it
-    #frame = imgutils.resize(frame, width=500)
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    gray = cv2.GaussianBlur(gray, (21, 21), 0)
+    # the background model works on a small grayscale copy, shared with other detectors
+    if context is None:
+        context = preprocess.FrameContext(frame)
 
-    # compute the absolute difference between the current frame and first frame
-    frameDelta = cv2.absdiff(first_frame, gray)
-    thresh = cv2.threshold(frameDelta, 25, 255, cv2.THRESH_BINARY)[1]
- 
-    # dilate the thresholded image to fill in holes, then find contours on thresholded image
-    thresh = cv2.dilate(thresh, None, iterations=2)
-    (cnts, _) = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL,
-        cv2.CHAIN_APPROX_SIMPLE)
- 
-    # loop over the contours
-    for c in cnts:
-        # if the contour is too small, ignore it
-        if cv2.contourArea(c) < min_area:
-            continue
- 
-        # compute the bounding box for the contour, draw it on the frame and update the text
-        (x, y, w, h) = cv2.boundingRect(c)
-        cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+    # draw the bounding box of every region that differs from the background on the frame
+    for (x1, y1, x2, y2) in background.apply(context, min_area):
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        rects.append([x1, y1, x2, y2])
         decision = True
 
-    return frame, decision
\ No newline at end of file
+    if return_rects:
+        return frame, decision, rects
+    return frame, decision
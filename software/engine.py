@@ -0,0 +1,103 @@
+"""
+A plain run loop for the turret, without any GUI toolkit.
+"""
+# coding: utf-8
+
+import time
+
+class Engine(object):
+    """Call a frame processing function repeatedly, at a target FPS.
+
+        An Engine object drives the capture -> detect -> act cycle
+        when there is no GUI main loop to do it. Usage example below:
+
+        >>> import engine;
+        >>> turret_engine = engine.Engine(process_frame, 10);
+        >>> signal.signal(signal.SIGINT, turret_engine.stop);
+        >>> turret_engine.run();
+
+        run() returns after stop() is called, so the caller can
+        release cameras and other resources in order.
+
+        Attributes:
+            fps: target frames per second. None or 0 runs as fast
+                 as possible.
+            running: whether the loop is running.
+
+    """
+
+    def __init__(self, step, fps=None):
+        """Engine constructor.
+
+            Args:
+                step: a function without arguments, called once per
+                      frame.
+                fps: target frames per second. None or 0 means no
+                     pacing.
+
+            Returns:
+                An Engine object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.fps = fps;
+        self.running = False;
+        self._step = step;
+
+
+    def stop(self, signum=None, instant=None):
+        """Ask the loop to finish after the current frame.
+
+            Has the signature of a signal handler, so it can be passed
+            directly to signal.signal().
+
+            Args:
+                signum: signal number, if called as a signal handler.
+                instant: current stack frame, if called as a signal
+                         handler.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        self.running = False;
+
+
+    def run(self):
+        """Run the loop until stop() is called.
+
+            Frames are paced against a fixed schedule, so the average
+            rate matches the target even when single frames are slow.
+            When a frame takes longer than its period, the schedule is
+            reset instead of running late frames in a burst.
+
+            Args:
+                None.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        self.running = True;
+        next_time = time.time();
+        while self.running:
+            self._step();
+            if not self.fps:
+                continue
+            next_time += 1.0 / self.fps;
+            delay = next_time - time.time();
+            if delay > 0:
+                time.sleep(delay);
+            else:
+                next_time = time.time();
@@ -1,13 +1,55 @@
 import cv2
 import os
+import multiprocessing
+import threading
 import imgutils
 import numpy
+import preprocess
+import projection
+import gallery
+import modelfile
+
+# Face cascades by name. LBP cascades use integer features and evaluate several times faster than Haar ones
+FACE_CASCADES = {
+    "haar": "haarcascades/haarcascade_frontalface_alt.xml",
+    "lbp": "lbpcascades/lbpcascade_frontalface.xml",
+    "lbp_improved": "lbpcascades/lbpcascade_frontalface_improved.xml",
+}
+
+# Face crops of a database, kept inside it by get_database() so unchanged images are not processed again.
+# Crops depend on the face cascade that found them: the cache is dropped when the cascade changes
+DATABASE_CACHE = 'cache.npz'
+
+# Face cascade of each database loading process, set by _init_loader()
+_loader_cascade = None
+
+
+def _init_loader(face_cascade):
+    global _loader_cascade
+    _loader_cascade = cv2.CascadeClassifier(face_cascade)
+
+
+def _crop_faces(path, cascade=None):
+    """64x64 grayscale crops of the faces found in an image file."""
+    image = cv2.imread(path)
+    if image is None:
+        return []
+    (face, image) = imgutils.detect_pattern(image, cascade or _loader_cascade, (50,50))
+    crops = []
+    for (x,y,w,h) in face:
+        image_crop = image[y:h, x:w]
+        image_crop = imgutils.resize(image_crop, 64, 64)
+        image_crop = cv2.cvtColor(image_crop, cv2.COLOR_BGR2GRAY)
+        crops.append(image_crop)
+    return crops
+
 
 class FaceRecognizer(object):
 
-    def __init__(self, algorithm, confidence_threshold):
+    def __init__(self, algorithm, confidence_threshold, face_cascade=FACE_CASCADES["haar"]):
 
-        self.cascade_face = cv2.CascadeClassifier("haarcascades/haarcascade_frontalface_alt.xml")
+        self.face_cascade = face_cascade
+        self.cascade_face = cv2.CascadeClassifier(face_cascade)
 
         if algorithm == 'eigen' or algorithm == 'fisher' or algorithm == 'lbph':
             self.algorithm = algorithm;
@@ -15,15 +57,27 @@ class FaceRecognizer(object):
             self.algorithm = 'fisher'
 
         self.threshold = confidence_threshold;
+        self.recognizer = self.create_recognizer()
+        # Eigen and fisher models, copied to numpy to recognize all faces of a frame at once
+        self.engine = None
+
+        self.names = []
+        # Labels whose pictures were added, changed or deleted since the previous get_database()
+        self.changed_labels = set()
+
+        # predict() and an in place model update never run at once; a retrain only holds the lock to swap models
+        self._lock = threading.Lock()
+        self._training = threading.Lock()
+
+
+    def create_recognizer(self):
 
         if self.algorithm == 'eigen':
-            self.recognizer = cv2.face.createEigenFaceRecognizer(threshold=self.threshold);
+            return cv2.face.createEigenFaceRecognizer(threshold=self.threshold);
         elif self.algorithm == 'fisher':
-            self.recognizer = cv2.face.createFisherFaceRecognizer(threshold=self.threshold);
+            return cv2.face.createFisherFaceRecognizer(threshold=self.threshold);
         elif self.algorithm == 'lbph':
-            self.recognizer = cv2.face.createLBPHFaceRecognizer(threshold=self.threshold);
-
-        self.names = []
+            return cv2.face.createLBPHFaceRecognizer(threshold=self.threshold);
 
 
     def add(self, name, number_of_captures):
@@ -71,8 +125,6 @@ class FaceRecognizer(object):
                 print "ERROR: Cannot update a face for a name not in database"
                 return -1
             names[face_id] = new_name
-            with open('faces/names', 'w') as namefile:
-               namefile.write("\n".join(names))
 
             count = len([name for name in os.listdir('faces/') if os.path.isdir(os.path.join('faces/', name))])
             if face_id < count:
@@ -94,11 +146,15 @@ class FaceRecognizer(object):
                 for i in range(len(images)):
                     cv2.imwrite('faces/s'+str(current)+'/'+str(i)+'.jpg', images[i])
             else: print "ERROR: The face id does not exist in database"
+
+            # Written once the pictures are saved: a running turret refreshes its model when this file changes
+            with open('faces/names', 'w') as namefile:
+               namefile.write("\n".join(names))
         else:
             print "ERROR: There are no faces in database"
 
 
-    def get_database(self, path):
+    def get_database(self, path, workers=None):
 
         if not path.endswith('/'): path = path + '/'
 
@@ -110,22 +166,90 @@ class FaceRecognizer(object):
         names = namefile.read().splitlines()
         namefile.close()
 
+        # Every picture of the database, with its label and modification time
+        pictures = []
         for id in ids:
             if os.path.isdir(path+id):
                 pics = os.listdir(path+id)
                 for pic in pics:
                     if pic.endswith('jpg'):
-                        image = cv2.imread(path+id+'/'+pic)
-                        (face, image) = imgutils.detect_pattern(image, self.cascade_face, (50,50))
-                        for (x,y,w,h) in face:
-                            image_crop = image[y:h, x:w]
-                            image_crop = imgutils.resize(image_crop, 64, 64)
-                            image_crop = cv2.cvtColor(image_crop, cv2.COLOR_BGR2GRAY)
-                            images.append(image_crop)
-                            labels.append(int(id[1:]))
+                        picture = id+'/'+pic
+                        pictures.append((picture, int(id[1:]), os.path.getmtime(path+picture)))
+
+        # Only pictures added or changed since the cache was written need the face detector
+        cache = self.load_database_cache(path)
+        missing = [picture for (picture, label, mtime) in pictures if cache.get(picture, (None,))[0] != mtime]
+        current = set(picture for (picture, label, mtime) in pictures)
+        self.changed_labels = set(label for (picture, label, mtime) in pictures if picture in missing)
+        self.changed_labels.update(int(picture.split('/')[0][1:]) for picture in cache if picture not in current)
+        if missing:
+            print "Searching faces in", len(missing), "new or changed images..."
+            crops = self.crop_database(path, missing, workers)
+            mtimes = dict((picture, mtime) for (picture, label, mtime) in pictures)
+            for picture, picture_crops in zip(missing, crops):
+                cache[picture] = (mtimes[picture], picture_crops)
+
+        for (picture, label, mtime) in pictures:
+            for image_crop in cache[picture][1]:
+                images.append(image_crop)
+                labels.append(label)
+
+        # Pictures deleted from the database are dropped from the cache too
+        if missing or len(cache) != len(pictures):
+            self.save_database_cache(path, dict((picture, cache[picture]) for (picture, label, mtime) in pictures))
         return images, labels, names
 
 
+    def crop_database(self, path, pictures, workers=None):
+
+        paths = [path+picture for picture in pictures]
+        if len(paths) < 2 or workers == 1:
+            return [_crop_faces(p, self.cascade_face) for p in paths]
+        # Decoding and face detection are independent for every image, spread them on all cores
+        loader = multiprocessing.Pool(workers, _init_loader, (self.face_cascade,))
+        try:
+            return loader.map(_crop_faces, paths, chunksize=max(len(paths) / (4 * (workers or multiprocessing.cpu_count())), 1))
+        finally:
+            loader.close()
+            loader.join()
+
+
+    def load_database_cache(self, path):
+
+        cache = {}
+        if not os.path.exists(path+DATABASE_CACHE):
+            return cache
+        try:
+            stored = numpy.load(path+DATABASE_CACHE)
+            if 'cascade' not in stored.files or str(stored['cascade']) != os.path.abspath(self.face_cascade):
+                print "Face cascade changed since the face database cache was written, searching faces again"
+                return {}
+            crops = stored['crops']
+            offsets = numpy.concatenate([[0], numpy.cumsum(stored['counts'])])
+            for i, (picture, mtime) in enumerate(zip(stored['pictures'], stored['mtimes'])):
+                cache[str(picture)] = (float(mtime), list(crops[offsets[i]:offsets[i+1]]))
+        except (IOError, KeyError, ValueError):
+            print "WARNING: Ignoring unreadable face database cache", path+DATABASE_CACHE
+            return {}
+        return cache
+
+
+    def save_database_cache(self, path, cache):
+
+        pictures = sorted(cache)
+        crops = [image_crop for picture in pictures for image_crop in cache[picture][1]]
+        # Written aside, then renamed, so an interrupted training never leaves a broken cache
+        temporary = path+DATABASE_CACHE+'.tmp'
+        with open(temporary, 'wb') as cachefile:
+            numpy.savez(cachefile,
+                        cascade=numpy.array(os.path.abspath(self.face_cascade)),
+                        pictures=numpy.array(pictures, dtype=str),
+                        mtimes=numpy.array([cache[picture][0] for picture in pictures], dtype=numpy.float64),
+                        counts=numpy.array([len(cache[picture][1]) for picture in pictures], dtype=numpy.int32),
+                        crops=numpy.array(crops, dtype=numpy.uint8).reshape(-1, 64, 64))
+        os.rename(temporary, path+DATABASE_CACHE)
+
+
     def train_model(self, databasepath, modelpath):
 
         if not modelpath.endswith('/'): modelpath = modelpath + '/'
@@ -154,7 +278,9 @@ class FaceRecognizer(object):
             namefile = open(modelpath+'names-'+self.algorithm, 'w')
             namefile.write('\n'.join(names))
             namefile.close()
+            self._save_binary(modelpath)
             self.names = names;
+            self.engine = self.create_engine(self.recognizer, modelpath)
 
             print "Finished training", self.algorithm, "model."
 
@@ -167,6 +293,10 @@ class FaceRecognizer(object):
 
         if not modelpath.endswith('/'): modelpath = modelpath + '/'
 
+        # Eigen and fisher models saved in the binary format are mapped in memory, OpenCV doesn't parse them
+        if self.algorithm != 'lbph' and self.load_binary_model(modelpath):
+            return
+
         namefile = open(modelpath+'names-'+self.algorithm, 'r')
         names = namefile.read().splitlines()
         namefile.close()
@@ -190,33 +320,190 @@ class FaceRecognizer(object):
             else: print "ERROR: No model found"
 
         self.names = names;
+        self.engine = self.create_engine(self.recognizer, modelpath, reuse=True)
+
+
+    def load_binary_model(self, modelpath):
+
+        binary = modelpath+'model-'+self.algorithm+'.bin'
+        text = modelpath+'model-'+self.algorithm
+        # A model converted back to OpenCV's format, or trained by an older version, is newer than its binary file
+        if not os.path.exists(binary) or (os.path.exists(text) and os.path.getmtime(text) > os.path.getmtime(binary)):
+            return False
+        try:
+            model = modelfile.load(binary)
+        except (IOError, ValueError) as error:
+            print "WARNING: Ignoring binary model:", error
+            return False
+
+        arrays = model.arrays
+        index = gallery.GalleryIndex(arrays['projections'], arrays['labels'], norms=arrays['norms'])
+        # Renaming people only rewrites the names file, which stays the reference
+        if os.path.exists(modelpath+'names-'+self.algorithm):
+            namefile = open(modelpath+'names-'+self.algorithm, 'r')
+            self.names = namefile.read().splitlines()
+            namefile.close()
+        else:
+            self.names = model.names
+        self.engine = projection.SubspaceModel(arrays['mean'], arrays['eigenvectors'], None, None, model.threshold, index)
+        return True
+
 
+    def update_model(self, databasepath, modelpath, wait=False):
 
-    def update_model(self):
+        if not modelpath.endswith('/'): modelpath = modelpath + '/'
+
+        # Only one update at a time; a later call will see whatever this one missed
+        if not self._training.acquire(False):
+            return False
+
+        try:
+            # This runs on a thread of the running turret: forking a loader pool here would copy every thread's state
+            images, labels, names = self.get_database(databasepath, workers=1)
+        except:
+            self._training.release()
+            raise
+        known = len(self.names)
+
+        if not self.changed_labels:
+            # No picture changed: at most, people were renamed
+            try:
+                if names != self.names:
+                    with self._lock:
+                        self.names = names
+                    self._save_names(modelpath, names)
+            finally:
+                self._training.release()
+            return False
+
+        new = [i for i in range(len(labels)) if labels[i] >= known]
+
+        if self.algorithm == 'lbph' and new and self.changed_labels and min(self.changed_labels) >= known:
+            # LBPH keeps one histogram per sample: new people are simply appended to the model
+            print "Adding", len(set(labels[i] for i in new)), "new faces to the lbph model..."
+            try:
+                with self._lock:
+                    self.recognizer.update([images[i] for i in new], numpy.array([labels[i] for i in new]))
+                    self.names = names
+                self._save(self.recognizer, modelpath, names)
+            finally:
+                self._training.release()
+            return True
+
+        # Eigen and fisher models project on the whole database, and changed pictures can't be taken
+        # out of an lbph model: train a new model aside, then swap it in
+        def retrain():
+            try:
+                print "Retraining", self.algorithm, "model with", len(images), "faces..."
+                recognizer = self.create_recognizer()
+                recognizer.train(images, numpy.array(labels))
+                self._save(recognizer, modelpath, names)
+                engine = self.create_engine(recognizer, modelpath)
+                with self._lock:
+                    self.names = names
+                    self.recognizer = recognizer
+                    self.engine = engine
+                print "Finished retraining", self.algorithm, "model."
+            finally:
+                self._training.release()
+
+        if wait:
+            retrain()
+        else:
+            worker = threading.Thread(target=retrain)
+            worker.daemon = True
+            worker.start()
+        return True
+
+
+    def create_engine(self, recognizer, modelpath=None, reuse=False):
+
+        if self.algorithm == 'lbph':
+            return None
+        if modelpath is None:
+            return projection.SubspaceModel.from_recognizer(recognizer)
+
+        # When loading a model, the gallery index saved with it is reused while it is not older than the model
+        # and matches it; a model just trained always gets a new index
+        indexpath = modelpath+'gallery-'+self.algorithm+'.npz'
+        textpath = modelpath+'model-'+self.algorithm
+        if reuse and os.path.exists(indexpath) and os.path.exists(textpath) and os.path.getmtime(indexpath) >= os.path.getmtime(textpath):
+            try:
+                index = gallery.GalleryIndex.load(indexpath)
+                if (hasattr(recognizer, 'getLabels') and numpy.array_equal(index.labels, numpy.asarray(recognizer.getLabels()).ravel())
+                        and index.vectors.shape[1] == recognizer.getEigenVectors().shape[1]):
+                    return projection.SubspaceModel.from_recognizer(recognizer, index)
+            except (IOError, KeyError, ValueError):
+                print "WARNING: Ignoring unreadable gallery index", indexpath
+        engine = projection.SubspaceModel.from_recognizer(recognizer)
+        if engine is not None and os.path.exists(modelpath):
+            engine.gallery.save(indexpath)
+        return engine
+
+
+    def _save(self, recognizer, modelpath, names):
+
+        recognizer.save(modelpath+'model-'+self.algorithm)
+        self._save_names(modelpath, names)
+        self._save_binary(modelpath)
 
-        pass
 
+    def _save_binary(self, modelpath):
 
-    def recognize(self, image, search_for_faces=True, write_names_on_image=True):
+        # The binary copy is converted from the files just saved, so both formats always hold the same model
+        try:
+            modelfile.save(modelfile.from_opencv(modelpath, self.algorithm), modelpath+'model-'+self.algorithm+'.bin')
+        except IOError as error:
+            print "WARNING: Could not write the binary model:", error
+
+
+    def _save_names(self, modelpath, names):
+
+        namefile = open(modelpath+'names-'+self.algorithm, 'w')
+        namefile.write('\n'.join(names))
+        namefile.close()
+
+
+    def recognize(self, image, search_for_faces=True, write_names_on_image=True, context=None, identities=None):
 
         faces = []
         found = []
         confs = []
 
+        # Search and crop faces on the grayscale frame, converted once
+        if context is None:
+            context = preprocess.FrameContext(image)
+        gray = context.gray
+
         if search_for_faces:
-            (faces, image) = imgutils.detect_pattern(image, self.cascade_face, (64,64))
+            (faces, gray) = imgutils.detect_pattern(gray, self.cascade_face, (64,64))
             if len(faces) > 0:
-                for (x, y, w, h) in faces:
+
+                def predict(indices):
+                    crops = []
+                    for (x, y, w, h) in (faces[i] for i in indices):
+                        image_crop = gray[y:h, x:w]
+                        image_crop = imgutils.resize(image_crop, 64, 64)
+                        crops.append(image_crop)
+                    with self._lock:
+                        if self.engine is not None:
+                            return self.engine.predict(crops)
+                        return [self.recognizer.predict(image_crop) for image_crop in crops]
+
+                # With an identity cache, faces already known from previous frames are not predicted again
+                if identities is None:
+                    predictions = predict(range(len(faces)))
+                else:
+                    predictions = identities.identify(faces, predict)
+                names = self.names
+
+                for (x, y, w, h), (id_predicted, conf) in zip(faces, predictions):
                     name = ""
-                    image_crop = image[y:h, x:w]
-                    image_crop = imgutils.resize(image_crop, 64, 64)
-                    image_crop = cv2.cvtColor(image_crop, cv2.COLOR_BGR2GRAY)
-                    id_predicted, conf = self.recognizer.predict(image_crop)
                     confs.append(conf)
                     cv2.putText(image, str(conf)[:5], (w-25, h+12), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255,255,255))
-                    if id_predicted > -1 and write_names_on_image:
-                        cv2.putText(image, self.names[id_predicted], (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
-                        found.append(self.names[id_predicted])
+                    if -1 < id_predicted < len(names) and write_names_on_image:
+                        cv2.putText(image, names[id_predicted], (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
+                        found.append(names[id_predicted])
                     else:
                         cv2.putText(image, 'Unknown', (x, y-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
                         found.append('Unknown')
@@ -3,7 +3,9 @@ Calculate frames per second.
 """
 # coding: utf-8
 
+import time
 import threading
+from collections import deque
 
 class FpsCounter(object):
     """Calculate frames per second.
@@ -28,8 +30,9 @@ class FpsCounter(object):
 
         
         Attributes:
-            current_fps: actually, the last calculated FPS. This
-                         variable is updated every second.
+            current_fps: number of frames set during the last second.
+                         Computed from frame timestamps when read, so
+                         no timer thread is needed.
             
     """
 
@@ -47,16 +50,15 @@ class FpsCounter(object):
             
         """
         
-        self._frame_counter = 0;
-        self.current_fps = 0;
-        self._update_fps_timer = threading.Timer(1, self._update_fps);
-        self._update_fps_timer.start();
+        self._frame_times = deque();
+        # The frame loop counts frames while the metrics server reads current_fps from its own thread
+        self._lock = threading.Lock();
     
     
     def quit(self):
         """Quit safely.
         
-            This method should be called before ending the program.
+            Kept for compatibility; there is nothing left to stop.
             
             Args:
                 None.
@@ -69,7 +71,7 @@ class FpsCounter(object):
             
         """
         
-        self._update_fps_timer.cancel();
+        pass
     
     
     def update_frame_counter(self):
@@ -86,14 +88,27 @@ class FpsCounter(object):
             
         """
         
-        self._frame_counter+=1;
+        now = time.time();
+        with self._lock:
+            self._frame_times.append(now);
+            self._forget(now);
     
     
-    def _update_fps(self):
-        """Update FPS, clear frame count, schedule new run every second.
+    @property
+    def current_fps(self):
+        """Number of frames set during the last second."""
+        with self._lock:
+            self._forget(time.time());
+            return len(self._frame_times)
+    
+    
+    def _forget(self, now):
+        """Drop frame timestamps older than one second.
+            
+            Must be called with the lock held.
             
             Args:
-                None.
+                now: current time, in seconds.
             
             Returns:
                 Nothing.
@@ -103,8 +118,6 @@ class FpsCounter(object):
             
         """
         
-        self.current_fps = self._frame_counter;
-        self._frame_counter = 0;
-        self._update_fps_timer = threading.Timer(1, self._update_fps);
-        self._update_fps_timer.start();
+        while self._frame_times and self._frame_times[0] <= now - 1:
+            self._frame_times.popleft();
     
@@ -0,0 +1,137 @@
+"""
+Find the nearest enrolled faces in large galleries.
+"""
+# coding: utf-8
+
+import os
+import numpy
+
+
+class GalleryIndex(object):
+    """An exact nearest neighbour index over the projections of enrolled faces.
+
+        Eigen and fisher subspaces have about as many dimensions as
+        there are people or faces enrolled, far too many for KD or
+        ball trees to prune anything, so a GalleryIndex object does
+        an exact brute force search, but a cheap one: squared norms of
+        the gallery are computed once, and distances to a chunk of the
+        gallery come from a single matrix product, so memory stays
+        bounded whatever the gallery size, and each chunk runs at
+        memory speed. The index is saved next to the model files, so
+        it isn't rebuilt on startup. Usage example below:
+
+        >>> import gallery;
+        >>> index = gallery.GalleryIndex(projections, labels);
+        >>> nearest, distances = index.nearest(queries);
+        >>> index.save("models/gallery-fisher.npz");
+
+        Attributes:
+            vectors: one row per enrolled face.
+            labels: label of each enrolled face.
+            chunk: number of gallery rows compared at once.
+
+    """
+
+    def __init__(self, vectors, labels, chunk=4096, norms=None):
+        """GalleryIndex constructor.
+
+            Args:
+                vectors: a faces x dimensions array, like the
+                         projections of a subspace model.
+                labels: the label of each face.
+                chunk: number of gallery rows compared at once.
+                norms: squared norms of vectors, if already known.
+
+            Returns:
+                A GalleryIndex object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.vectors = numpy.asarray(vectors, dtype=numpy.float64);
+        self.labels = numpy.asarray(labels, dtype=numpy.int32).ravel();
+        self.chunk = chunk;
+        self._norms = (self.vectors ** 2).sum(axis=1) if norms is None else numpy.asarray(norms);
+
+
+    def __len__(self):
+        return len(self.vectors)
+
+
+    def nearest(self, queries):
+        """Nearest gallery face of each query.
+
+            Args:
+                queries: a queries x dimensions array.
+
+            Returns:
+                A tuple (indices, distances) of arrays: the row of the
+                nearest gallery face of each query, and its euclidean
+                distance.
+
+            Raises:
+                No information.
+
+        """
+
+        queries = numpy.asarray(queries, dtype=numpy.float64);
+        best = numpy.zeros(len(queries), numpy.int64);
+        best_squared = numpy.full(len(queries), numpy.inf);
+        query_norms = (queries ** 2).sum(axis=1)[:, None];
+        for start in range(0, len(self.vectors), self.chunk):
+            block = self.vectors[start:start + self.chunk];
+            squared = query_norms + self._norms[None, start:start + self.chunk] - 2 * numpy.dot(queries, block.T);
+            found = squared.argmin(axis=1);
+            values = squared[numpy.arange(len(queries)), found];
+            better = values < best_squared;
+            best[better] = found[better] + start;
+            best_squared[better] = values[better];
+        # Distances of the chosen faces are computed again directly, so they don't lose precision
+        distances = numpy.sqrt(((self.vectors[best] - queries) ** 2).sum(axis=1));
+        return best, distances
+
+
+    def save(self, path):
+        """Write the index to a file.
+
+            It is written aside, then renamed, so readers never see a
+            half written index.
+
+            Args:
+                path: path to the file, like models/gallery-fisher.npz.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        temporary = path + ".tmp";
+        with open(temporary, "wb") as indexfile:
+            numpy.savez(indexfile, vectors=self.vectors, labels=self.labels, norms=self._norms);
+        os.rename(temporary, path);
+
+
+    @classmethod
+    def load(cls, path, chunk=4096):
+        """Read an index written by save().
+
+            Args:
+                path: path to the file.
+                chunk: number of gallery rows compared at once.
+
+            Returns:
+                A GalleryIndex object.
+
+            Raises:
+                IOError: if the file can't be read.
+                KeyError: if the file is not a gallery index.
+
+        """
+
+        stored = numpy.load(path);
+        return cls(stored["vectors"], stored["labels"], chunk, stored["norms"])
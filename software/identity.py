@@ -0,0 +1,168 @@
+"""
+Remember who each tracked face is, so faces aren't recognized every frame.
+"""
+# coding: utf-8
+
+import numpy
+import imgutils
+
+
+class IdentityCache(object):
+    """Keep the identity of faces from frame to frame.
+
+        An IdentityCache object follows the faces found in successive
+        frames of one video source: a face belongs to the track of the
+        previous frame it overlaps the most. Each track keeps the
+        label predicted for it and a running average of the prediction
+        distances. The face recognizer only predicts again for new
+        faces, every reverify frames for known ones, or sooner when a
+        track's running distance gets close to the recognizer
+        threshold, meaning its identity is uncertain. Recognition cost
+        then follows the people arriving rather than the frame rate.
+        Usage example below:
+
+        >>> import identity;
+        >>> identities = identity.IdentityCache(10, 500);
+        >>> predictions = identities.identify(faces, lambda indices: [recognizer.predict(crops[i]) for i in indices]);
+
+        Attributes:
+            reverify: maximum number of frames between two predictions
+                      for the same track.
+            predicted: number of faces given to the recognizer.
+            reused: number of faces identified from their track.
+
+    """
+
+    def __init__(self, reverify=10, threshold=None, min_overlap=0.3, smoothing=0.5, margin=0.8, patience=2):
+        """IdentityCache constructor.
+
+            Args:
+                reverify: maximum number of frames between two
+                          predictions for the same track.
+                threshold: prediction distance above which the
+                           recognizer answers unknown. None never
+                           reverifies early.
+                min_overlap: minimum intersection over union of a face
+                             and a track to associate them.
+                smoothing: weight of each new prediction distance in
+                           the running distance of a track.
+                margin: fraction of threshold the running distance
+                        must stay under for a track to be trusted
+                        between two reverifications.
+                patience: number of frames a track survives without
+                          its face, so a missed detection doesn't
+                          cost a prediction.
+
+            Returns:
+                An IdentityCache object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.reverify = reverify;
+        self.predicted = 0;
+        self.reused = 0;
+        self._threshold = threshold;
+        self._min_overlap = min_overlap;
+        self._smoothing = smoothing;
+        self._margin = margin;
+        self._patience = patience;
+        self._tracks = [];      # A list of dictionaries: rect, label, distance, age, missed
+
+
+    def identify(self, rects, predict):
+        """Identify the faces of a frame.
+
+            Args:
+                rects: a list of [x1, y1, x2, y2] face rectangles.
+                predict: a function taking a list of indices of
+                         faces in rects and returning a (label,
+                         distance) tuple for each, like a face
+                         recognizer's predict(). It is called once,
+                         with the faces that need a prediction.
+
+            Returns:
+                A list of (label, distance) tuples, one per face; the
+                distance is the running distance of its track.
+
+            Raises:
+                No information.
+
+        """
+
+        matches = self._associate(rects);
+        due = [i for i in range(len(rects)) if i not in matches or self._due(matches[i])];
+        predictions = dict(zip(due, predict(due) if due else []));
+        tracks = [];
+        results = [];
+        for i, rect in enumerate(rects):
+            track = matches.get(i);
+            if i in predictions:
+                (label, distance) = predictions[i];
+                self.predicted += 1;
+                if track is None or track["label"] != label:
+                    # A new face, or someone else than the track thought: start over
+                    track = {"label": label, "distance": float(distance)};
+                else:
+                    track["distance"] += self._smoothing * (distance - track["distance"]);
+                track["age"] = 0;
+            else:
+                self.reused += 1;
+                track["age"] += 1;
+            track["rect"] = list(rect);
+            track["missed"] = 0;
+            tracks.append(track);
+            results.append((track["label"], track["distance"]));
+
+        # Faces missed in this frame keep their track for a while
+        for track in self._tracks:
+            if not any(track is match for match in matches.values()) and track["missed"] < self._patience:
+                track["missed"] += 1;
+                tracks.append(track);
+        self._tracks = tracks;
+        return results
+
+
+    def _due(self, track):
+        """Whether a track must be predicted again."""
+        if track["age"] + 1 >= self.reverify:
+            return True
+        return self._threshold is not None and track["distance"] > self._threshold * self._margin
+
+
+    def _associate(self, rects):
+        """Match faces with the tracks they overlap the most.
+
+            Args:
+                rects: a list of [x1, y1, x2, y2] face rectangles.
+
+            Returns:
+                A dictionary of tracks, by index in rects, for faces
+                that belong to a track.
+
+            Raises:
+                No information.
+
+        """
+
+        if not self._tracks or len(rects) == 0:
+            return {}
+        faces = numpy.asarray(rects, dtype=numpy.float64).reshape(-1, 4);
+        tracked = numpy.array([track["rect"] for track in self._tracks], dtype=numpy.float64);
+        shared = imgutils.intersections(faces, tracked);
+        areas = lambda r: (r[:, 2] - r[:, 0]) * (r[:, 3] - r[:, 1]);
+        iou = shared / (areas(faces)[:, None] + areas(tracked)[None, :] - shared);
+        # Greedy matching, best overlaps first; each face and each track is used once
+        matches = {};
+        used = set();
+        for flat in numpy.argsort(-iou, axis=None):
+            (i, j) = numpy.unravel_index(flat, iou.shape);
+            if iou[i, j] < self._min_overlap:
+                break
+            if i in matches or j in used:
+                continue
+            matches[i] = self._tracks[j];
+            used.add(j);
+        return matches
@@ -4,12 +4,13 @@ Some utility functions for image processing.
 # coding: utf-8
 
 import cv2
+import numpy
 import time
 import datetime
 import os
 
 
-def detect_pattern(img, cascade, min_rectangle):
+def detect_pattern(img, cascade, min_rectangle, scale_factor=1.2, tiler=None):
     """Pattern detection function.
     
         Args:
@@ -19,6 +20,14 @@ def detect_pattern(img, cascade, min_rectangle):
                            height of the smaller search window; small 
                            values rise the range of vision of our 
                            turret, but processing may become slower.
+            scale_factor: how much the search window grows between 
+                          two passes. Higher values are faster, but 
+                          may miss patterns between two window sizes.
+                          Default is 1.2.
+            tiler: a tiling.TiledSearch object of the same cascade 
+                   file, to search tiles of the image on several 
+                   threads. Default is a single search of the whole 
+                   image.
         
         Returns:
             Coordinates of the rectangle that contains the pattern 
@@ -28,7 +37,10 @@ def detect_pattern(img, cascade, min_rectangle):
         
     """
 
-    rects = cascade.detectMultiScale(img, 1.2, 3, 1, min_rectangle)
+    if tiler is not None:
+        return tiler.detect(img, min_rectangle, scale_factor), img
+
+    rects = cascade.detectMultiScale(img, scale_factor, 3, 1, min_rectangle)
 
     if len(rects) == 0:
         return [], img
@@ -36,6 +48,60 @@ def detect_pattern(img, cascade, min_rectangle):
     return rects, img
 
 
+def detect_pattern_scaled(img, cascade, min_rectangle, scale, small=None, scale_factor=1.2, tiler=None):
+    """Pattern detection on a reduced-resolution grayscale copy.
+    
+        Most of the search detect_pattern() does on a full-resolution 
+        frame happens at window sizes a smaller image can find just as 
+        well. This function searches a grayscale copy of the image, 
+        resized by scale, and maps the rectangles back to full-frame 
+        coordinates.
+    
+        Args:
+            img: a cv2 image.
+            cascade: a CascadeClassifier object.
+            min_rectangle: a two element tuple containing width and 
+                           height of the smaller search window, in 
+                           full-frame pixels.
+            scale: resize factor of the searched copy, like 0.5. A 
+                   value of 1 or more searches the image as it is.
+            small: the grayscale copy, already resized by scale. If 
+                   None, it is computed here.
+            scale_factor: window growth between two passes, as in 
+                          detect_pattern().
+            tiler: a tiling.TiledSearch object, as in detect_pattern().
+        
+        Returns:
+            Coordinates of the rectangles that contain the pattern, in 
+            full-frame pixels, and the input image.
+        
+        Raises:
+        
+    """
+
+    if scale >= 1:
+        return detect_pattern(img, cascade, min_rectangle, scale_factor, tiler)
+
+    if small is None:
+        if len(img.shape) == 3:
+            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = img
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    min_small = (max(1, int(min_rectangle[0] * scale)), max(1, int(min_rectangle[1] * scale)))
+
+    (rects, small) = detect_pattern(small, cascade, min_small, scale_factor, tiler)
+    if len(rects) == 0:
+        return [], img
+
+    # Map back to full-frame coordinates, never outside the frame
+    (h, w) = img.shape[:2]
+    rects = (rects / scale).round().astype(rects.dtype)
+    rects[:, [0, 2]] = rects[:, [0, 2]].clip(0, w)
+    rects[:, [1, 3]] = rects[:, [1, 3]].clip(0, h)
+    return rects, img
+
+
 def box(coords, img, color=(127,255,0)):
     """Draw a rectangle in an image.
     
@@ -134,3 +200,156 @@ def crop(img, startx, endx, starty, endy):
 
     """
     return img[starty:endy, startx:endx]
+
+
+def pad_rects(rects, padding, width, height):
+    """Grow rectangles on every side, without leaving the image.
+
+        Args:
+            rects: a list of [x1, y1, x2, y2] rectangles.
+            padding: number of pixels added on each side.
+            width: image width.
+            height: image height.
+
+        Returns:
+            A list of padded rectangles.
+
+        Raises:
+
+    """
+    return [[max(x1 - padding, 0), max(y1 - padding, 0), min(x2 + padding, width), min(y2 + padding, height)]
+            for x1, y1, x2, y2 in rects]
+
+
+def merge_rects(rects):
+    """Merge overlapping rectangles into their bounding rectangle.
+
+        Merging repeats until no two rectangles overlap, so the
+        result covers every input pixel exactly once, at most.
+
+        Args:
+            rects: a list of [x1, y1, x2, y2] rectangles.
+
+        Returns:
+            A list of rectangles that don't overlap.
+
+        Raises:
+
+    """
+    return group_rects(rects).tolist()
+
+
+def intersections(rects, others):
+    """Intersection areas of every pair of rectangles.
+
+        Args:
+            rects: an array or list of N [x1, y1, x2, y2] rectangles.
+            others: an array or list of M [x1, y1, x2, y2] rectangles.
+
+        Returns:
+            An N x M array; element (i, j) is the area rects[i] and 
+            others[j] have in common, 0 if they don't overlap.
+
+        Raises:
+
+    """
+    a = numpy.asarray(rects).reshape(-1, 1, 4)
+    b = numpy.asarray(others).reshape(1, -1, 4)
+    iw = (numpy.minimum(a[..., 2], b[..., 2]) - numpy.maximum(a[..., 0], b[..., 0])).clip(0)
+    ih = (numpy.minimum(a[..., 3], b[..., 3]) - numpy.maximum(a[..., 1], b[..., 1])).clip(0)
+    return iw * ih
+
+
+def union_rect(rects):
+    """Smallest rectangle containing all the given rectangles.
+
+        Args:
+            rects: a non empty array or list of [x1, y1, x2, y2] 
+                   rectangles.
+
+        Returns:
+            An [x1, y1, x2, y2] array.
+
+        Raises:
+
+    """
+    rects = numpy.asarray(rects)
+    return numpy.concatenate([rects[:, :2].min(axis=0), rects[:, 2:].max(axis=0)])
+
+
+def group_rects(rects, overlap=0.0):
+    """Replace groups of overlapping rectangles by their union.
+
+        Two rectangles are linked when their intersection is larger 
+        than overlap times the area of the smaller one; groups are 
+        the rectangles linked directly or through others. Unions can 
+        overlap rectangles of other groups, so grouping repeats until 
+        no union is linked to another. Overlaps of all pairs are 
+        computed at once with numpy.
+
+        Args:
+            rects: an array or list of [x1, y1, x2, y2] rectangles.
+            overlap: fraction of the smaller rectangle two rectangles 
+                     must share to be grouped. Default is 0, any 
+                     overlap.
+
+        Returns:
+            An array of the group unions.
+
+        Raises:
+
+    """
+    rects = numpy.asarray(rects).reshape(-1, 4)
+    while len(rects) > 1:
+        areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+        shared = intersections(rects, rects)
+        linked = (shared > 0) & (shared >= overlap * numpy.minimum(areas[:, None], areas[None, :]))
+        # Each rectangle takes the lowest label among its links, until labels settle
+        labels = numpy.arange(len(rects))
+        while True:
+            spread = numpy.where(linked, labels[None, :], len(rects)).min(axis=1)
+            spread = numpy.minimum(spread, labels)
+            if (spread == labels).all():
+                break
+            labels = spread[spread]
+        if len(numpy.unique(labels)) == len(rects):
+            break
+        rects = numpy.array([union_rect(rects[labels == label]) for label in numpy.unique(labels)])
+    return rects
+
+
+def non_max_suppression(rects, overlap=0.5):
+    """Drop rectangles that mostly cover a larger one.
+
+        Rectangles are kept from the largest to the smallest; each one 
+        is dropped if its intersection over union with a rectangle 
+        already kept is above overlap. All overlaps with a kept 
+        rectangle are computed at once.
+
+        Args:
+            rects: an array or list of [x1, y1, x2, y2] rectangles.
+            overlap: maximum intersection over union of two kept 
+                     rectangles.
+
+        Returns:
+            An array of the kept rectangles, largest first.
+
+        Raises:
+
+    """
+    rects = numpy.asarray(rects)
+    if len(rects) == 0:
+        return rects.reshape(0, 4)
+    areas = (rects[:, 2] - rects[:, 0]) * (rects[:, 3] - rects[:, 1])
+    order = numpy.argsort(-areas, kind='mergesort')
+    keep = []
+    while len(order) > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        iw = (numpy.minimum(rects[i, 2], rects[rest, 2]) - numpy.maximum(rects[i, 0], rects[rest, 0])).clip(0)
+        ih = (numpy.minimum(rects[i, 3], rects[rest, 3]) - numpy.maximum(rects[i, 1], rects[rest, 1])).clip(0)
+        intersection = (iw * ih).astype(numpy.float64)
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+        order = rest[iou <= overlap]
+    return rects[keep]
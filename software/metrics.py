@@ -0,0 +1,323 @@
+"""
+Collect turret metrics and serve them in Prometheus text format.
+"""
+# coding: utf-8
+
+import math
+import threading
+import time
+import BaseHTTPServer
+from collections import deque
+from contextlib import contextmanager
+
+# Quantiles reported for every summary
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, v) for k, v in sorted(labels.items())) + "}"
+
+
+class Summary(object):
+    """Count, sum and sliding window quantiles of observed values.
+
+        Quantiles are computed over the most recent observations only,
+        so they follow the current behaviour of the turret instead of
+        its whole history.
+
+        Attributes:
+            name: metric name.
+            labels: a dictionary of label names and values.
+            count: number of observations since start.
+            total: sum of observations since start.
+
+    """
+
+    kind = "summary"
+
+    def __init__(self, name, labels=None, window=1024):
+        """Summary constructor.
+
+            Args:
+                name: metric name.
+                labels: a dictionary of label names and values.
+                window: number of recent observations kept for
+                        quantiles.
+
+            Returns:
+                A Summary object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.name = name;
+        self.labels = labels or {};
+        self.count = 0;
+        self.total = 0.0;
+        self._window = deque(maxlen=window);
+        self._lock = threading.Lock();
+
+
+    def observe(self, value):
+        """Record a value."""
+        with self._lock:
+            self.count += 1;
+            self.total += value;
+            self._window.append(value);
+
+
+    def quantile(self, q):
+        """Value below which a fraction q of the recent observations fall.
+
+            Args:
+                q: a number between 0 and 1.
+
+            Returns:
+                The quantile, or None if nothing was observed yet.
+
+            Raises:
+                No information.
+
+        """
+
+        with self._lock:
+            values = sorted(self._window);
+        if not values:
+            return None
+        # Nearest rank
+        return values[max(int(math.ceil(q * len(values))) - 1, 0)]
+
+
+    def samples(self):
+        """Prometheus samples, as (name, labels, value) tuples."""
+        samples = [];
+        for q in QUANTILES:
+            value = self.quantile(q);
+            if value is not None:
+                labels = dict(self.labels, quantile=str(q));
+                samples.append((self.name, labels, value));
+        samples.append((self.name + "_sum", self.labels, self.total));
+        samples.append((self.name + "_count", self.labels, self.count));
+        return samples
+
+
+class Counter(object):
+    """A value that only goes up.
+
+        Attributes:
+            name: metric name.
+            labels: a dictionary of label names and values.
+            value: current value.
+
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, labels=None, function=None):
+        """Counter constructor.
+
+            Args:
+                name: metric name.
+                labels: a dictionary of label names and values.
+                function: a function without arguments returning the
+                          current value, for counts kept elsewhere. If
+                          given, inc() must not be used.
+
+            Returns:
+                A Counter object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.name = name;
+        self.labels = labels or {};
+        self.value = 0;
+        self._function = function;
+        self._lock = threading.Lock();
+
+
+    def inc(self, amount=1):
+        """Increase the counter."""
+        with self._lock:
+            self.value += amount;
+
+
+    def samples(self):
+        """Prometheus samples, as (name, labels, value) tuples."""
+        if self._function:
+            return [(self.name, self.labels, self._function())]
+        return [(self.name, self.labels, self.value)]
+
+
+class Gauge(Counter):
+    """A value that goes up and down, read from a function or set directly."""
+
+    kind = "gauge"
+
+    def set(self, value):
+        """Set the gauge."""
+        self.value = value;
+
+
+class Registry(object):
+    """A set of metrics, rendered together in Prometheus text format.
+
+        Metrics are created on first use and shared afterwards, so any
+        module can record into them by name. Usage example below:
+
+        >>> import metrics;
+        >>> with metrics.timed("detect"):
+        ...     frame, decision = detect.old_detection(frame, upperbody, face);
+        >>> metrics.counter("turret_decisions_total", "Frames with a detection.").inc();
+
+    """
+
+    def __init__(self):
+        self._metrics = [];
+        self._index = {};
+        self._help = {};
+        self._lock = threading.Lock();
+
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())));
+        with self._lock:
+            if key not in self._index:
+                metric = cls(name, labels, **kwargs);
+                self._index[key] = metric;
+                self._metrics.append(metric);
+                self._help.setdefault(name, help);
+            return self._index[key]
+
+
+    def summary(self, name, help="", labels=None):
+        """Get or create a Summary."""
+        return self._get(Summary, name, help, labels)
+
+
+    def counter(self, name, help="", labels=None, function=None):
+        """Get or create a Counter."""
+        return self._get(Counter, name, help, labels, function=function)
+
+
+    def gauge(self, name, help="", labels=None, function=None):
+        """Get or create a Gauge."""
+        return self._get(Gauge, name, help, labels, function=function)
+
+
+    def render(self):
+        """Render every metric in Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics);
+        # Samples of a metric family must be contiguous, whatever the creation order
+        names = [];
+        for metric in metrics:
+            if metric.name not in names:
+                names.append(metric.name);
+        lines = [];
+        for family in names:
+            members = [m for m in metrics if m.name == family];
+            lines.append("# HELP {} {}".format(family, self._help[family]));
+            lines.append("# TYPE {} {}".format(family, members[0].kind));
+            for metric in members:
+                for name, labels, value in metric.samples():
+                    lines.append("{}{} {}".format(name, _format_labels(labels), repr(float(value))));
+        return "\n".join(lines) + "\n"
+
+
+# The registry used by the turret
+REGISTRY = Registry()
+
+def summary(name, help="", labels=None):
+    """Get or create a Summary in the turret registry."""
+    return REGISTRY.summary(name, help, labels)
+
+def counter(name, help="", labels=None, function=None):
+    """Get or create a Counter in the turret registry."""
+    return REGISTRY.counter(name, help, labels, function)
+
+def gauge(name, help="", labels=None, function=None):
+    """Get or create a Gauge in the turret registry."""
+    return REGISTRY.gauge(name, help, labels, function)
+
+
+def stage(name):
+    """Latency Summary of a frame processing stage, in seconds.
+
+        Stages are capture, rotate, skip, detect, recognize,
+        annotate, display and save.
+
+    """
+
+    return summary("turret_stage_seconds", "Time spent in each frame processing stage.", {"stage": name})
+
+
+@contextmanager
+def timed(name):
+    """Time the enclosed block as a frame processing stage."""
+    start = time.time();
+    try:
+        yield
+    finally:
+        stage(name).observe(time.time() - start);
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404);
+            return
+        body = REGISTRY.render();
+        self.send_response(200);
+        self.send_header("Content-Type", "text/plain; version=0.0.4");
+        self.send_header("Content-Length", str(len(body)));
+        self.end_headers();
+        self.wfile.write(body);
+
+    def log_message(self, format, *args):
+        # Scrapes would otherwise be logged to stderr every few seconds
+        pass
+
+
+class MetricsServer(object):
+    """Serve the turret registry over HTTP, on a background thread.
+
+        >>> import metrics;
+        >>> server = metrics.MetricsServer(9100);
+        >>> # curl http://127.0.0.1:9100/metrics
+        >>> server.quit();
+
+    """
+
+    def __init__(self, port, address="127.0.0.1"):
+        """MetricsServer constructor.
+
+            Args:
+                port: TCP port to listen on.
+                address: address to bind. Standard is local only.
+
+            Returns:
+                A MetricsServer object, already serving.
+
+            Raises:
+                socket.error: if the port can't be bound.
+
+        """
+
+        self._server = BaseHTTPServer.HTTPServer((address, port), _MetricsHandler);
+        self._thread = threading.Thread(target=self._server.serve_forever);
+        self._thread.daemon = True;
+        self._thread.start();
+
+
+    def quit(self):
+        """Stop serving."""
+        self._server.shutdown();
+        self._server.server_close();
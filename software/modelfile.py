@@ -0,0 +1,320 @@
+#!/usr/bin/python
+"""
+A compact binary format for face recognition models, loaded with numpy.memmap.
+
+OpenCV saves face recognizers as YAML text, several megabytes for eigen
+models, and parsing it dominates startup with -f. A binary model file
+holds a small header, then the model arrays, aligned so they can be
+mapped in memory instead of read: loading takes milliseconds, and turret
+processes on one host share the same pages. Convert existing models,
+or go back to OpenCV's format, with:
+
+        $ python modelfile.py to-binary models/ fisher
+        $ python modelfile.py to-opencv models/ fisher
+"""
+# coding: utf-8
+
+import argparse
+import json
+import os
+import struct
+import sys
+import cv2
+import numpy
+
+# First bytes of every binary model file
+MAGIC = "TURRETFR"
+VERSION = 1
+
+# Arrays start on multiples of this many bytes
+ALIGNMENT = 64
+
+# Name of the YAML node OpenCV writes each model under
+OPENCV_NODES = {"eigen": "opencv_eigenfaces", "fisher": "opencv_fisherfaces", "lbph": "opencv_lbphfaces"}
+
+# Arrays and parameters of each kind of model
+ARRAYS = {
+    "eigen": ("mean", "eigenvalues", "eigenvectors", "projections", "labels"),
+    "fisher": ("mean", "eigenvalues", "eigenvectors", "projections", "labels"),
+    "lbph": ("histograms", "labels"),
+}
+PARAMETERS = {
+    "eigen": ("num_components",),
+    "fisher": ("num_components",),
+    "lbph": ("radius", "neighbors", "grid_x", "grid_y"),
+}
+
+# Element types of OpenCV matrices in YAML files
+_DT = {numpy.dtype(numpy.float64): "d", numpy.dtype(numpy.float32): "f", numpy.dtype(numpy.int32): "i", numpy.dtype(numpy.uint8): "u"}
+
+
+class Model(object):
+    """A face recognition model, as plain numpy arrays.
+
+        Attributes:
+            algorithm: eigen, fisher or lbph.
+            threshold: prediction distance from which faces are
+                       unknown.
+            names: the name of each label.
+            parameters: a dictionary of the algorithm's integer
+                        parameters, like num_components or radius.
+            arrays: a dictionary of arrays, by name. Eigen and fisher
+                    models have mean, eigenvalues, eigenvectors,
+                    projections, one row per training face, labels
+                    and norms, the squared norm of each projection.
+                    lbph models have histograms and labels.
+
+    """
+
+    def __init__(self, algorithm, threshold, names, parameters, arrays):
+        """Model constructor.
+
+            Args:
+                algorithm: eigen, fisher or lbph.
+                threshold: prediction distance from which faces are
+                           unknown.
+                names: the name of each label.
+                parameters: the algorithm's integer parameters.
+                arrays: the model arrays, by name.
+
+            Returns:
+                A Model object.
+
+            Raises:
+                ValueError: if the algorithm is unknown.
+
+        """
+
+        if algorithm not in ARRAYS:
+            raise ValueError("Unknown face recognition algorithm: " + str(algorithm));
+        self.algorithm = algorithm;
+        self.threshold = threshold;
+        self.names = list(names);
+        self.parameters = dict(parameters);
+        self.arrays = dict(arrays);
+        if algorithm != "lbph" and "norms" not in self.arrays:
+            self.arrays["norms"] = (numpy.asarray(self.arrays["projections"], dtype=numpy.float64) ** 2).sum(axis=1);
+
+
+def save(model, path):
+    """Write a model in the binary format.
+
+        The file starts with MAGIC, the format version and the length
+        of a JSON header holding the algorithm, threshold, parameters,
+        names and, for each array, its type, shape and offset. Arrays
+        follow, each one starting on a multiple of ALIGNMENT bytes.
+        The file is written aside, then renamed, so a running turret
+        never maps a half written model.
+
+        Args:
+            model: a Model object.
+            path: path to the file, like models/model-fisher.bin.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            No information.
+
+    """
+
+    arrays = [(name, numpy.ascontiguousarray(array)) for name, array in sorted(model.arrays.items())];
+    header = {"algorithm": model.algorithm, "threshold": model.threshold, "names": model.names,
+              "parameters": model.parameters, "arrays": {}};
+    # Offsets depend on the header length, which depends on the offsets: grow the room left for it until it fits
+    room = 4096;
+    while True:
+        offset = _aligned(len(MAGIC) + 8 + room);
+        for name, array in arrays:
+            header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset};
+            offset = _aligned(offset + array.nbytes);
+        encoded = json.dumps(header, sort_keys=True);
+        if len(encoded) <= room:
+            break
+        room = 2 * len(encoded);
+
+    temporary = path + ".tmp";
+    with open(temporary, "wb") as modelfile:
+        modelfile.write(MAGIC + struct.pack("<II", VERSION, room));
+        modelfile.write(encoded + " " * (room - len(encoded)));
+        for name, array in arrays:
+            modelfile.seek(header["arrays"][name]["offset"]);
+            modelfile.write(array.tobytes());
+    os.rename(temporary, path);
+
+
+def load(path):
+    """Map a binary model file in memory.
+
+        Arrays are read-only numpy.memmap objects: pages are only read
+        from disk when used, and shared by every process mapping the
+        same file.
+
+        Args:
+            path: path to the file.
+
+        Returns:
+            A Model object.
+
+        Raises:
+            IOError: if the file can't be read.
+            ValueError: if the file is not a binary model of a known
+                        version.
+
+    """
+
+    with open(path, "rb") as modelfile:
+        start = modelfile.read(len(MAGIC) + 8);
+        if len(start) < len(MAGIC) + 8 or start[:len(MAGIC)] != MAGIC:
+            raise ValueError("Not a binary face model: " + path);
+        (version, room) = struct.unpack("<II", start[len(MAGIC):]);
+        if version != VERSION:
+            raise ValueError("Unsupported binary face model version " + str(version) + ": " + path);
+        header = json.loads(modelfile.read(room));
+    arrays = {};
+    for name, array in header["arrays"].items():
+        shape = tuple(array["shape"]);
+        if numpy.prod(shape) == 0:
+            arrays[str(name)] = numpy.zeros(shape, numpy.dtype(str(array["dtype"])));
+        else:
+            arrays[str(name)] = numpy.memmap(path, numpy.dtype(str(array["dtype"])), "r", array["offset"], shape);
+    return Model(str(header["algorithm"]), header["threshold"], [name.encode("utf-8") for name in header["names"]],
+                 header["parameters"], arrays)
+
+
+def _aligned(offset):
+    """The first multiple of ALIGNMENT from offset."""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def from_opencv(modelpath, algorithm):
+    """Read a model saved by an OpenCV recognizer and its names file.
+
+        Args:
+            modelpath: the models directory, holding model-<algorithm>
+                       and names-<algorithm>.
+            algorithm: eigen, fisher or lbph.
+
+        Returns:
+            A Model object.
+
+        Raises:
+            IOError: if a file is missing or not an OpenCV model.
+
+    """
+
+    if not modelpath.endswith('/'): modelpath = modelpath + '/'
+    path = modelpath + 'model-' + algorithm;
+    if not os.path.exists(path):
+        raise IOError("No model found: " + path);
+    storage = cv2.FileStorage(path, cv2.FILE_STORAGE_READ);
+    # OpenCV 3.0 wrote the model fields at the top level, later versions under a named node
+    node = storage.getNode(OPENCV_NODES[algorithm]);
+    if node.empty():
+        node = storage.root();
+    arrays = {};
+    for name in ARRAYS[algorithm]:
+        field = node.getNode(name);
+        if field.empty():
+            raise IOError("Not an OpenCV " + algorithm + " model, " + name + " is missing: " + path);
+        if field.isSeq():
+            rows = [field.at(i).mat() for i in range(field.size())];
+            arrays[name] = numpy.vstack(rows) if rows else numpy.zeros((0, 0));
+        else:
+            arrays[name] = field.mat();
+    arrays["labels"] = arrays["labels"].astype(numpy.int32).ravel();
+    parameters = dict((name, int(node.getNode(name).real())) for name in PARAMETERS[algorithm]);
+    threshold = node.getNode("threshold").real();
+    storage.release();
+
+    with open(modelpath + 'names-' + algorithm) as namefile:
+        names = namefile.read().splitlines();
+    return Model(algorithm, threshold, names, parameters, arrays)
+
+
+def to_opencv(model, modelpath):
+    """Write a model in OpenCV's YAML format, with its names file.
+
+        The result loads with the recognizer's load(), as if it had
+        been saved by it.
+
+        Args:
+            model: a Model object.
+            modelpath: the models directory.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            No information.
+
+    """
+
+    if not modelpath.endswith('/'): modelpath = modelpath + '/'
+    lines = ["%YAML:1.0", "---", OPENCV_NODES[model.algorithm] + ":",
+             "   threshold: " + _number(model.threshold)];
+    for name in PARAMETERS[model.algorithm]:
+        lines.append("   " + name + ": " + str(model.parameters[name]));
+    for name in ARRAYS[model.algorithm]:
+        array = numpy.asarray(model.arrays[name]);
+        if name in ("projections", "histograms"):
+            # One matrix per training face
+            lines.append("   " + name + ":");
+            for row in array:
+                lines += _matrix("      - ", "         ", row.reshape(1, -1));
+        elif name == "labels":
+            lines += _matrix("   labels: ", "      ", array.reshape(-1, 1).astype(numpy.int32));
+        else:
+            lines += _matrix("   " + name + ": ", "      ", array if array.ndim == 2 else array.reshape(-1, 1));
+    lines.append("   labelsInfo:");
+    lines.append("      []");
+
+    temporary = modelpath + 'model-' + model.algorithm + '.tmp';
+    with open(temporary, 'w') as modelfile:
+        modelfile.write("\n".join(lines) + "\n");
+    os.rename(temporary, modelpath + 'model-' + model.algorithm);
+    with open(modelpath + 'names-' + model.algorithm, 'w') as namefile:
+        namefile.write('\n'.join(model.names));
+
+
+def _number(value):
+    """A number as OpenCV writes it, exactly."""
+    return repr(float(value))
+
+
+def _matrix(first, indent, array):
+    """YAML lines of an OpenCV matrix; first starts the first line, indent the others."""
+    values = [repr(float(v)) if array.dtype.kind == "f" else str(int(v)) for v in array.ravel()];
+    # OpenCV reads lines of limited length: a few values per line, as it writes them
+    data = [", ".join(values[i:i + 4]) for i in range(0, len(values), 4)];
+    lines = [first + "!!opencv-matrix",
+             indent + "rows: " + str(array.shape[0]),
+             indent + "cols: " + str(array.shape[1]),
+             indent + "dt: " + _DT[array.dtype]];
+    if not data:
+        return lines + [indent + "data: []"]
+    lines.append(indent + "data: [ " + data[0] + ("," if len(data) > 1 else " ]"));
+    for i, chunk in enumerate(data[1:]):
+        lines.append(indent + "    " + chunk + ("," if i < len(data) - 2 else " ]"));
+    return lines
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description="Convert face recognition models between OpenCV's YAML format and the binary format.")
+    parser.add_argument("direction", type=str, choices=["to-binary", "to-opencv"], help="to-binary reads model-<algorithm> and names-<algorithm> and writes model-<algorithm>.bin; to-opencv does the opposite.")
+    parser.add_argument("modelpath", type=str, help="The models directory, like models/.")
+    parser.add_argument("algorithm", type=str, choices=sorted(ARRAYS), help="The recognition algorithm of the model.")
+    args = parser.parse_args()
+
+    modelpath = args.modelpath if args.modelpath.endswith('/') else args.modelpath + '/'
+    binary = modelpath + 'model-' + args.algorithm + '.bin'
+    if args.direction == "to-binary":
+        save(from_opencv(modelpath, args.algorithm), binary)
+        print "Wrote", binary
+    else:
+        if not os.path.exists(binary):
+            print >> sys.stderr, "No binary model found:", binary
+            sys.exit(1)
+        to_opencv(load(binary), modelpath)
+        print "Wrote", modelpath + 'model-' + args.algorithm, "and", modelpath + 'names-' + args.algorithm
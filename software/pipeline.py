@@ -0,0 +1,419 @@
+"""
+Per video source processing: capture, rotate and detect.
+"""
+# coding: utf-8
+
+import time
+import capture
+import backends
+import detect
+import imgutils
+import metrics
+import pool
+import preprocess
+import background
+import schedule
+import skip
+import track
+import identity
+
+class Detectors(object):
+    """Classifiers and workers shared by every video source.
+
+        A Detectors object loads the people detector once and, optionally,
+        starts a single worker pool, so several Pipeline objects can
+        run in one process without duplicating them.
+
+        Attributes:
+            backend: the people detector, a backends.Backend.
+            motion: whether motion detection replaces the detector.
+            gate: whether the detector only searches regions that
+                  changed.
+            recognizer: a facerec.FaceRecognizer, or None.
+            pool: a pool.DetectionPool, or None.
+            scale: resize factor of the upperbody search.
+            track: maximum number of frames between two full
+                   searches when tracking, or None.
+            background_method: background model of motion detection,
+                               average or mog2.
+            learning_rate: learning rate of the background model.
+            skip: change score below which detection is skipped, or
+                  None.
+            budget: detection time budget per frame, in seconds, or
+                    None.
+            reverify: maximum number of frames between two face
+                      recognitions of the same tracked face, or None
+                      to recognize every face of every frame.
+
+    """
+
+    def __init__(self, upperbody_path, face_path, motion=False, recognizer=None, workers=None, scale=1.0, track=None, gate=False, background_method="average", learning_rate=0.002, skip=None, budget=None, detector="haar", detector_options=None, tiles=None, reverify=None):
+        """Detectors constructor.
+
+            Args:
+                upperbody_path: path to the upperbody cascade file.
+                face_path: path to the face cascade file.
+                motion: use motion detection instead of the detector.
+                recognizer: a facerec.FaceRecognizer. If given, face
+                            recognition is used to decide.
+                workers: number of detection worker processes. The
+                         pool is not used with face recognition or
+                         motion detection alone.
+                scale: run the upperbody search on a grayscale copy
+                       of each frame resized by this factor, like 0.5.
+                track: run the detector every track frames only, and
+                       follow what it found in between. Not used
+                       with motion detection, face recognition or
+                       the worker pool.
+                gate: run the detector only inside padded regions
+                      where motion was detected, and skip them when
+                      nothing moved.
+                background_method: background model of motion
+                                   detection, average or mog2.
+                learning_rate: weight of each new frame in the
+                               background model. 0 freezes the
+                               background at the first frame.
+                skip: reuse the last result for frames whose
+                      thumbnail differs from the last analyzed one by
+                      less than this mean number of gray levels. Not
+                      used with the worker pool.
+                budget: adapt the cascade settings and the number of
+                        frames detection runs on to spend about this
+                        many seconds per frame and source. Not used
+                        with motion detection alone, face recognition
+                        or the worker pool.
+                detector: name of the people detector backend, in
+                          backends.BACKENDS.
+                detector_options: keyword arguments of the backend
+                                  constructor, other than the cascade
+                                  paths, scale and tiles of the haar
+                                  backend.
+                tiles: split the upperbody search of each frame on
+                       this many threads, with the haar backend.
+                reverify: with face recognition, remember who each
+                          tracked face is and recognize it again every
+                          reverify frames only.
+
+            Returns:
+                A Detectors object.
+
+            Raises:
+                ValueError: if the detector is unknown or misses
+                            options.
+
+        """
+
+        options = dict(detector_options or {});
+        if detector == "haar":
+            options.update(upperbody_path=upperbody_path, face_path=face_path, scale=scale, tiles=tiles);
+        self.pool = None;
+        if workers and not recognizer and not motion:
+            # Workers are forked first, so they don't inherit the threads of this process' backend
+            self.pool = pool.DetectionPool(workers, detector, options);
+        self.backend = backends.create(detector, **options);
+        self.motion = motion;
+        self.recognizer = recognizer;
+        self.scale = scale;
+        self.track = track;
+        self.gate = gate and not motion;
+        self.background_method = background_method;
+        self.learning_rate = learning_rate;
+        self.skip = skip;
+        self.budget = budget;
+        self.reverify = reverify;
+
+
+    def quit(self):
+        """Stop the worker pool, if any, and the detector's threads."""
+        if self.pool:
+            self.pool.quit();
+        self.backend.quit();
+
+
+class Pipeline(object):
+    """Capture and detection state of a single video source.
+
+        Each Pipeline object owns its camera, capture thread, rotation,
+        frame counters and background model, and shares the detector
+        of a Detectors object with other pipelines. Usage example:
+
+        >>> import pipeline;
+        >>> detectors = pipeline.Detectors(upperbody_path, face_path);
+        >>> pipe = pipeline.Pipeline("cam0", "0", detectors, 320, 240);
+        >>> result = pipe.process();
+        >>> if result:
+        ...     frame, decision, rects = result;
+
+        A pipeline without a source does not capture; frames are given
+        to detect() instead, as when replaying recorded video.
+
+        Attributes:
+            name: a short name for the source, like "cam0".
+            source: the source string, a device index or an URL.
+            camera: a cv2.VideoCapture object, or None.
+            grabber: a capture.FrameGrabber reading from camera, or None.
+            rotation: counterclockwise rotation applied to frames.
+            counter: total number of frames processed.
+            dcounter: number of the last frame that triggered an action.
+            background: a background.BackgroundModel for motion
+                        detection and gating, or None.
+            tracker: a track.TrackingDetector, or None.
+            skipper: a skip.FrameSkipper, or None.
+            identities: an identity.IdentityCache, or None.
+            scheduler: a schedule.BudgetScheduler, or None.
+            zones: a zones.Zones object restricting where people are
+                   searched, or None.
+
+    """
+
+    def __init__(self, name, source, detectors, width=None, height=None, rotation=None, zones=None, event=None):
+        """Pipeline constructor.
+
+            Opens the source, if any, and starts capturing.
+
+            Args:
+                name: a short name for the source.
+                source: a device index, like "0", or a video file path
+                        or stream URL. None for no capture.
+                detectors: a Detectors object.
+                width: frame width, required with a source.
+                height: frame height, required with a source.
+                rotation: counterclockwise rotation, in degrees.
+                zones: a zones.Zones object, in the coordinates of
+                       rotated frames. Default is to search the whole
+                       frame.
+                event: a threading.Event set whenever a new frame is
+                       captured, shared by several pipelines, see
+                       capture.FrameGrabber.
+
+            Returns:
+                A Pipeline object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.name = name;
+        self.source = source;
+        self.rotation = rotation;
+        self.zones = zones;
+        self.counter = 0;
+        self.dcounter = 0;
+        self.background = None;
+        self._detectors = detectors;
+        self._buffers = {};
+        self.camera = None;
+        self.grabber = None;
+        self.tracker = None;
+        self.skipper = None;
+        self.identities = None;
+        self.scheduler = None;
+        self._last_result = None;
+
+        if (detectors.motion or detectors.gate) and not detectors.recognizer:
+            self.background = background.BackgroundModel(detectors.background_method, detectors.learning_rate);
+
+        if detectors.track and not (detectors.motion or detectors.recognizer or detectors.pool):
+            self.tracker = track.TrackingDetector(self._backend_detection, detectors.track);
+
+        # Results from the pool come later, there is no last result to reuse
+        if detectors.skip and not detectors.pool:
+            self.skipper = skip.FrameSkipper(detectors.skip);
+
+        if detectors.reverify and detectors.recognizer:
+            self.identities = identity.IdentityCache(detectors.reverify, detectors.recognizer.threshold);
+
+        if detectors.budget and not (detectors.motion or detectors.recognizer or detectors.pool):
+            self.scheduler = schedule.BudgetScheduler(detectors.budget, name);
+            metrics.gauge("turret_scheduler_level", "Detection settings level chosen to meet the time budget, 0 is the most accurate.",
+                          {"source": name}, function=lambda: self.scheduler.level);
+
+        if source is None:
+            return
+
+        self.camera = capture.open_source(source);
+        self.camera.set(capture.CV_CAP_PROP_FRAME_WIDTH, width);
+        self.camera.set(capture.CV_CAP_PROP_FRAME_HEIGHT, height);
+        self.grabber = capture.FrameGrabber(self.camera, width, height, event=event);
+
+
+    def quit(self):
+        """Stop capturing and release the camera."""
+        if self.grabber:
+            self.grabber.quit();
+            self.camera.release();
+
+
+    def set_size(self, width, height):
+        """Change the capture frame size."""
+        self.grabber.set(capture.CV_CAP_PROP_FRAME_WIDTH, width);
+        self.grabber.set(capture.CV_CAP_PROP_FRAME_HEIGHT, height);
+
+
+    def process(self, timeout=1.0):
+        """Read the newest frame, rotate it and search for humans.
+
+            Args:
+                timeout: maximum time to wait for a new frame, in
+                         seconds. Use 0 when several sources share a
+                         loop, so a stalled one doesn't hold the
+                         others.
+
+            Returns:
+                A tuple (frame, decision, rects), with the annotated
+                frame, whether something was detected, and the
+                detected rectangles. None if no frame is ready yet.
+
+            Raises:
+                No information.
+
+        """
+
+        with metrics.timed("capture"):
+            ret, frame = self.grabber.read(timeout);
+        if not ret:
+            return None
+
+        if self.rotation:
+            with metrics.timed("rotate"):
+                frame = imgutils.rotate(frame, self.rotation);
+
+        return self.detect(frame)
+
+
+    def detect(self, frame):
+        """Search for humans in a frame.
+
+            Args:
+                frame: a cv2 image. It is drawn on.
+
+            Returns:
+                A tuple (frame, decision, rects), or None when the
+                frame went to the worker pool and no result for this
+                source is ready yet.
+
+            Raises:
+                No information.
+
+        """
+
+        detectors = self._detectors;
+
+        # Grayscale variants are computed once, shared by every detector, and hide excluded zones
+        mask = None;
+        if self.zones:
+            (h, w) = frame.shape[:2];
+            mask = self.zones.mask(w, h);
+        context = preprocess.FrameContext(frame, self._buffers, mask);
+
+        if self.skipper:
+            with metrics.timed("skip"):
+                result = self.skipper.reuse(frame, context);
+            if self.skipper.score is not None:
+                metrics.summary("turret_change_score", "Change score of each frame against the last analyzed one.", {"source": self.name}).observe(self.skipper.score);
+            if result:
+                return result
+
+        if self.scheduler and not self.scheduler.due() and self._last_result:
+            # Frame stride: keep showing the last result until detection runs again
+            decision, rects = self._last_result;
+            return imgutils.box(rects, frame, (0, 0, 255)), decision, rects
+
+        start = time.time();
+        with metrics.timed("recognize" if detectors.recognizer else "detect"):
+            result = self._detect(frame, context);
+
+        if self.scheduler:
+            self.scheduler.observe(time.time() - start);
+            self._last_result = result[1:];
+        if self.skipper:
+            self.skipper.remember(result);
+        return result
+
+
+    def _detect(self, frame, context):
+        detectors = self._detectors;
+
+        if detectors.recognizer:
+            frame, faces, found, confs, decision = detectors.recognizer.recognize(frame, context=context, identities=self.identities);
+            return frame, decision, faces
+        elif detectors.motion:
+            return detect.motion_detection(frame, self.background, return_rects=True, context=context)
+        elif detectors.pool:
+            # Keep the workers busy; results come back in capture order
+            # The background model learns every frame in order, so it stays in this process
+            regions = self._regions(context);
+            detectors.pool.submit(frame.copy(), regions, self.name, context.mask);
+            if not detectors.pool.full(self.name):
+                return None
+            return detectors.pool.get(self.name)
+        elif self.tracker:
+            return self.tracker.detect(frame, context)
+        else:
+            return self._backend_detection(frame, context)
+
+
+    def _backend_detection(self, frame, context):
+        detectors = self._detectors;
+        if self.scheduler:
+            settings = self.scheduler.detection_settings(detectors.scale);
+        else:
+            settings = {"scale": detectors.scale};
+        return detectors.backend.detect(frame, context, self._regions(context), **settings)
+
+
+    def _regions(self, context):
+        """Regions the detector searches: what moved when gating, else the included zones; None for the whole frame."""
+        if self._detectors.gate:
+            # Motion is already masked out of excluded zones
+            return self.background.apply(context)
+        if self.zones:
+            (h, w) = context.frame.shape[:2];
+            return self.zones.regions(w, h)
+        return None
+
+
+    def drain(self):
+        """Wait for every frame of this source still in the worker pool.
+
+            Args:
+                None.
+
+            Returns:
+                A list of (frame, decision, rects) tuples, in capture
+                order. Empty if there is no worker pool.
+
+            Raises:
+                No information.
+
+        """
+
+        results = [];
+        detection_pool = self._detectors.pool;
+        while detection_pool and detection_pool.pending(self.name):
+            results.append(detection_pool.get(self.name));
+        return results
+
+
+    def action_due(self, decision, limit):
+        """Count a processed frame and tell if it's time to speak and save.
+
+            Args:
+                decision: whether the frame had a detection.
+                limit: minimum number of frames between two actions.
+
+            Returns:
+                True if the turret should act on this frame.
+
+            Raises:
+                No information.
+
+        """
+
+        due = False;
+        if decision and self.counter - self.dcounter > limit:
+            self.dcounter = self.counter;
+            due = True;
+        self.counter += 1;
+        return due
@@ -0,0 +1,169 @@
+"""
+Run people detection on a pool of worker processes.
+"""
+# coding: utf-8
+
+import multiprocessing
+import signal
+from collections import deque
+import cv2
+import backends
+import preprocess
+
+# Detector owned by each worker process, built once by _init_worker()
+_backend = None
+
+
+def _init_worker(backend, options):
+    """Build the detector of a worker process.
+
+        Args:
+            backend: a name in backends.BACKENDS.
+            options: keyword arguments of the backend constructor.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            No information.
+
+    """
+
+    global _backend
+
+    # Ctrl-C is handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Parallelism comes from the pool; don't let every worker spawn its own threads
+    cv2.setNumThreads(1)
+
+    _backend = backends.create(backend, **options)
+
+
+def _detection(frame, regions, mask):
+    return _backend.detect(frame, preprocess.FrameContext(frame, mask=mask), regions)
+
+
+class DetectionPool(object):
+    """Farm frames out to detection worker processes.
+
+        A DetectionPool object runs a detector backend on several
+        processes at once, each one with its own copy of the
+        detector. Results come back
+        in the order frames were submitted. Several video sources can
+        share a pool by submitting with different keys; each key keeps
+        its own order. Usage example below:
+
+        >>> import pool;
+        >>> detection_pool = pool.DetectionPool(4, "haar", {"upperbody_path": upperbody_path, "face_path": face_path});
+        >>> detection_pool.submit(frame);
+        >>> if detection_pool.full():
+        ...     frame, decision, rects = detection_pool.get();
+
+        Attributes:
+            workers: number of worker processes.
+
+    """
+
+    def __init__(self, workers, backend, options, depth=None):
+        """DetectionPool constructor.
+
+            Args:
+                workers: number of worker processes.
+                backend: a name in backends.BACKENDS.
+                options: keyword arguments of the backend constructor.
+                depth: number of frames in flight before full() is
+                       True. Default is one more than the number of
+                       workers, so no worker waits while the caller
+                       handles a result.
+
+            Returns:
+                A DetectionPool object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.workers = workers;
+        self._depth = depth or workers + 1;
+        self._pending = {};
+        self._pool = multiprocessing.Pool(workers, _init_worker, (backend, options));
+
+
+    def quit(self):
+        """Stop all worker processes.
+
+            This method should be called before ending the program.
+
+            Args:
+                None.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        self._pending.clear();
+        self._pool.terminate();
+        self._pool.join();
+
+
+    def submit(self, frame, regions=None, key=None, mask=None):
+        """Queue a frame for detection.
+
+            The frame is pickled asynchronously, so it must not be
+            modified by the caller after submission.
+
+            Args:
+                frame: a cv2 image.
+                regions: rectangles where motion was found, as
+                         returned by background.BackgroundModel. If
+                         given, the detector only searches these
+                         regions.
+                key: identifies the video source of the frame.
+                mask: hides pixels from the detector, as in
+                      preprocess.FrameContext.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        result = self._pool.apply_async(_detection, (frame, regions, mask));
+        self._pending.setdefault(key, deque()).append(result);
+
+
+    def pending(self, key=None):
+        """Number of frames submitted with key whose result was not taken yet."""
+        return len(self._pending.get(key, ()))
+
+
+    def full(self, key=None):
+        """Whether enough frames are in flight with key to take a result."""
+        return self.pending(key) >= self._depth
+
+
+    def get(self, key=None):
+        """Get the result of the oldest frame submitted with key.
+
+            Blocks until that result is ready.
+
+            Args:
+                key: identifies the video source, as given to submit().
+
+            Returns:
+                A tuple (frame, decision, rects), as returned by
+                backends.Backend.detect().
+
+            Raises:
+                KeyError, IndexError: if there are no pending frames.
+
+        """
+
+        return self._pending[key].popleft().get()
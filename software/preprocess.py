@@ -0,0 +1,137 @@
+"""
+Compute per-frame image variants once and share them between detectors.
+"""
+# coding: utf-8
+
+import cv2
+
+class FrameContext(object):
+    """Lazily computed variants of a single frame.
+
+        A FrameContext object holds a BGR frame and computes its
+        grayscale, histogram-equalized and resized versions the first
+        time each one is asked for, so no color conversion happens
+        twice in a frame, whatever the number of detectors. Usage
+        example below:
+
+        >>> import preprocess;
+        >>> buffers = {};
+        >>> context = preprocess.FrameContext(frame, buffers);
+        >>> rects = cascade.detectMultiScale(context.gray);
+
+        Variants are written into the arrays of buffers, a dictionary
+        kept by the caller between frames, so steady-state processing
+        allocates nothing. A variant is only valid until the next
+        context built on the same buffers; copy it to keep it longer.
+
+        With a mask, like the one of a zones.Zones object, every
+        variant is black where the mask is 0, so no detector finds or
+        sees anything there. The frame itself is left untouched.
+
+        Attributes:
+            frame: the BGR frame.
+            mask: a grayscale image of the frame size, 0 where pixels
+                  are hidden from detectors, or None.
+
+    """
+
+    def __init__(self, frame, buffers=None, mask=None):
+        """FrameContext constructor.
+
+            Args:
+                frame: a cv2 image, BGR or already grayscale.
+                buffers: a dictionary of reusable arrays. If None,
+                         variants are allocated for this frame only.
+                mask: a grayscale image of the frame size, 0 where
+                      pixels are hidden from detectors. Default is
+                      to hide nothing.
+
+            Returns:
+                A FrameContext object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.frame = frame;
+        self.mask = mask;
+        self._buffers = {} if buffers is None else buffers;
+        self._ready = {};
+
+
+    def _variant(self, name, compute):
+        """Compute a variant once, into its reusable buffer."""
+        if name not in self._ready:
+            self._ready[name] = compute(self._buffers.get(name));
+            self._buffers[name] = self._ready[name];
+        return self._ready[name]
+
+
+    @property
+    def gray(self):
+        """Grayscale version of the frame."""
+        if len(self.frame.shape) == 2:
+            if self.mask is None:
+                return self.frame
+            return self._variant("gray", lambda dst: cv2.bitwise_and(self.frame, self.mask, dst=self._fit(dst)))
+        if self.mask is None:
+            return self._variant("gray", lambda dst: cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY, dst=self._fit(dst)))
+        return self._variant("gray", lambda dst: cv2.bitwise_and(cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY, dst=self._fit(dst)), self.mask, dst=self._fit(dst)))
+
+
+    @property
+    def masked_frame(self):
+        """The frame, black where the mask hides it."""
+        if self.mask is None:
+            return self.frame
+        return self._variant("masked", lambda dst: cv2.bitwise_and(self.frame, self.frame, dst=dst if dst is not None and dst.shape == self.frame.shape else None, mask=self.mask))
+
+
+    @property
+    def equalized(self):
+        """Histogram-equalized grayscale version of the frame."""
+        return self._variant("equalized", lambda dst: cv2.equalizeHist(self.gray, dst=self._fit(dst)))
+
+
+    def scaled_gray(self, scale):
+        """Grayscale version of the frame resized by scale.
+
+            Args:
+                scale: resize factor, like 0.5.
+
+            Returns:
+                A grayscale cv2 image.
+
+            Raises:
+                No information.
+
+        """
+
+        if scale >= 1:
+            return self.gray
+        return self._variant(("gray", scale), lambda dst: self._resize(self.gray, scale, cv2.INTER_AREA, dst))
+
+
+    def scaled_mask(self, scale):
+        """The mask resized by scale, like scaled_gray(), or None without a mask."""
+        if self.mask is None or scale >= 1:
+            return self.mask
+        return self._variant(("mask", scale), lambda dst: self._resize(self.mask, scale, cv2.INTER_NEAREST, dst))
+
+
+    def _resize(self, image, scale, interpolation, dst):
+        """Resize image by scale, into dst if it has the resulting size."""
+        (h, w) = image.shape[:2];
+        # Same size as cv2.resize() with fx and fy, computed here so dst can be checked
+        size = (int(round(w * scale)), int(round(h * scale)));
+        if dst is None or dst.shape != (size[1], size[0]):
+            dst = None;
+        return cv2.resize(image, size, dst=dst, interpolation=interpolation)
+
+
+    def _fit(self, dst):
+        """Return dst if it can hold a grayscale variant of the frame, else None."""
+        if dst is not None and dst.shape == self.frame.shape[:2]:
+            return dst
+        return None
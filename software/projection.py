@@ -0,0 +1,145 @@
+"""
+Recognize all the faces of a frame at once with eigen and fisher models.
+"""
+# coding: utf-8
+
+import sys
+import numpy
+import gallery
+
+# Distance predict() answers when no sample is under the threshold
+NO_MATCH = sys.float_info.max
+
+
+class SubspaceModel(object):
+    """The projection and nearest neighbour search of eigen and fisher models, in numpy.
+
+        OpenCV eigen and fisher recognizers project a face on a
+        subspace, subtracting the training mean then multiplying by the
+        eigenvectors, and answer the label of the nearest training
+        projection, if closer than the threshold. Their predict()
+        handles one face per call. A SubspaceModel object copies the
+        mean, eigenvectors, projections and labels of a trained
+        recognizer once, then projects every face of a frame with a
+        single matrix product and finds all nearest neighbours at
+        once, in a gallery.GalleryIndex. It answers the same labels as
+        predict(), and the same distances but for floating point
+        rounding.
+        Usage example below:
+
+        >>> import projection;
+        >>> model = projection.SubspaceModel.from_recognizer(recognizer);
+        >>> predictions = model.predict(crops);
+
+        Attributes:
+            mean: the training mean, a row of pixels.
+            eigenvectors: one column per subspace dimension.
+            gallery: a gallery.GalleryIndex of the training
+                     projections and their labels.
+            threshold: distance from which faces are unknown.
+
+    """
+
+    def __init__(self, mean, eigenvectors, projections, labels, threshold=NO_MATCH, index=None):
+        """SubspaceModel constructor.
+
+            Args:
+                mean: the training mean, with as many values as pixels
+                      in a face.
+                eigenvectors: a pixels x dimensions array.
+                projections: a faces x dimensions array.
+                labels: the label of each training face.
+                threshold: distance from which faces are unknown.
+                index: a gallery.GalleryIndex of projections and
+                       labels, like one saved with the model. If
+                       given, projections and labels are not used.
+
+            Returns:
+                A SubspaceModel object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.mean = numpy.asarray(mean, dtype=numpy.float64).reshape(1, -1);
+        self.eigenvectors = numpy.asarray(eigenvectors, dtype=numpy.float64);
+        if index is None:
+            index = gallery.GalleryIndex(numpy.asarray(projections, dtype=numpy.float64).reshape(-1, self.eigenvectors.shape[1]), labels);
+        self.gallery = index;
+        self.threshold = threshold;
+
+
+    @classmethod
+    def from_recognizer(cls, recognizer, index=None):
+        """Copy the model of a trained OpenCV eigen or fisher recognizer.
+
+            Args:
+                recognizer: a trained cv2 eigen or fisher face
+                            recognizer.
+                index: a gallery.GalleryIndex of the recognizer's
+                       projections, to avoid copying them again.
+
+            Returns:
+                A SubspaceModel object, or None if the recognizer
+                doesn't give access to its model, like before OpenCV
+                3.1, or isn't trained.
+
+            Raises:
+                No information.
+
+        """
+
+        if not hasattr(recognizer, "getProjections"):
+            return None
+        if index is not None:
+            return cls(recognizer.getMean(), recognizer.getEigenVectors(), None, None, recognizer.getThreshold(), index)
+        projections = recognizer.getProjections();
+        if len(projections) == 0:
+            return None
+        return cls(recognizer.getMean(), recognizer.getEigenVectors(), numpy.vstack(projections),
+                   recognizer.getLabels(), recognizer.getThreshold())
+
+
+    def project(self, crops):
+        """Project faces on the subspace.
+
+            Args:
+                crops: a list of grayscale face images, of the size
+                       the model was trained with.
+
+            Returns:
+                A faces x dimensions array.
+
+            Raises:
+                No information.
+
+        """
+
+        faces = numpy.array([numpy.asarray(crop).ravel() for crop in crops], dtype=numpy.float64);
+        return numpy.dot(faces - self.mean, self.eigenvectors)
+
+
+    def predict(self, crops):
+        """Label of the nearest training face of each face, like predict().
+
+            Args:
+                crops: a list of grayscale face images, of the size
+                       the model was trained with.
+
+            Returns:
+                A list of (label, distance) tuples. The label is -1
+                and the distance NO_MATCH when no training face is
+                closer than the threshold.
+
+            Raises:
+                No information.
+
+        """
+
+        if len(crops) == 0:
+            return []
+        (nearest, distances) = self.gallery.nearest(self.project(crops));
+        labels = self.gallery.labels;
+        return [(int(labels[j]), float(d)) if d < self.threshold else (-1, NO_MATCH)
+                for j, d in zip(nearest, distances)]
@@ -0,0 +1,119 @@
+"""
+Run the detectors over recorded video files and image directories.
+"""
+# coding: utf-8
+
+import os
+import json
+import time
+from collections import deque
+import cv2
+import imgutils
+
+# Files read when replaying a directory
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def read_frames(path):
+    """Read every frame of a video file or a directory of images.
+
+        Directories are walked recursively, in sorted order, so a
+        detected/ tree can be replayed as it is.
+
+        Args:
+            path: a video file path, or a directory.
+
+        Returns:
+            A generator of (frame_id, frame) tuples. frame_id is the
+            frame index for videos and the image path, relative to
+            the directory, for directories.
+
+        Raises:
+            No information.
+
+    """
+
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if not name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                image_path = os.path.join(root, name)
+                frame = cv2.imread(image_path)
+                if frame is not None:
+                    yield os.path.relpath(image_path, path), frame
+    else:
+        video = cv2.VideoCapture(path)
+        index = 0
+        while True:
+            ret, frame = video.read()
+            if not ret:
+                break
+            yield index, frame
+            index += 1
+        video.release()
+
+
+def write_result(results, frame_id, result):
+    """Write the detection result of a frame as a JSON line.
+
+        Args:
+            results: a file object open for writing.
+            frame_id: frame index or image path.
+            result: a (frame, decision, rects) tuple.
+
+        Returns:
+            Nothing.
+
+        Raises:
+            No information.
+
+    """
+
+    frame, decision, rects = result
+    rects = [[int(v) for v in rect] for rect in rects]
+    results.write(json.dumps({"frame": frame_id, "decision": bool(decision), "rects": rects}) + "\n")
+
+
+def replay(pipe, path, results_path):
+    """Push every recorded frame through a pipeline, as fast as possible.
+
+        Frames are never dropped and there is no pacing, so the time
+        taken measures detection throughput alone.
+
+        Args:
+            pipe: a pipeline.Pipeline object without a source.
+            path: a video file path, or a directory of images.
+            results_path: where to write one JSON line per frame, with
+                          its decision and rectangles.
+
+        Returns:
+            A tuple (frames, seconds): number of frames processed and
+            the time it took.
+
+        Raises:
+            No information.
+
+    """
+
+    frame_ids = deque()
+    count = 0
+    start = time.time()
+
+    with open(results_path, 'w') as results:
+        for frame_id, frame in read_frames(path):
+            if pipe.rotation:
+                frame = imgutils.rotate(frame, pipe.rotation)
+            frame_ids.append(frame_id)
+            result = pipe.detect(frame)
+            # With a worker pool, results come later, in the same order
+            if result is None:
+                continue
+            write_result(results, frame_ids.popleft(), result)
+            count += 1
+        for result in pipe.drain():
+            write_result(results, frame_ids.popleft(), result)
+            count += 1
+
+    return count, time.time() - start
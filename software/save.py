@@ -10,8 +10,29 @@ import sys, time, mimetypes
 import socket
 import cv2
 from collections import deque
+import metrics
 
-def save(img, img_time, uploadqueue=None):
+def image_name(img_time, source=None):
+    """File name of an image saved by save().
+    
+        Args:
+            img_time: the time of capture.
+            source: name of the video source, if there are several.
+        
+        Returns:
+            A string, like "2016-03-14 10:21:05.png" or
+            "2016-03-14 10:21:05 cam1.png".
+        
+        Raises:
+    
+    """
+    
+    if source:
+        return str(img_time)[:19] + " " + source + ".png"
+    return str(img_time)[:19] + ".png"
+
+
+def save(img, img_time, uploadqueue=None, source=None):
     """Save images to disc or a Google Drive account.
     
         Save an image in a hierarchical structure inside the detected/ 
@@ -22,6 +43,7 @@ def save(img, img_time, uploadqueue=None):
             img: a cv2 image.
             img_time: the time of capture.
             google: a Drive object.
+            source: name of the video source, if there are several.
         
         Returns:
             
@@ -29,30 +51,36 @@ def save(img, img_time, uploadqueue=None):
     
     """
 
+    with metrics.timed("save"):
+        _save(img, img_time, source)
+    
+    if uploadqueue:
+        uploadqueue.append(img_time, source);
+
+
+def _save(img, img_time, source=None):
+    """Write an image to the detected/ tree, creating folders as needed."""
 
     if os.path.exists("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day)))):
-        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), img);
+        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), img);
     elif os.path.exists("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B')))):
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day))))
-        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), img);
+        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), img);
     elif os.path.exists("/".join(("detected", str(img_time.year)))):
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'))))
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day))))
-        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), img);
+        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), img);
     elif os.path.exists("detected"):
         os.mkdir("/".join(("detected", str(img_time.year))))
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'))))
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day))))
-        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), img);
+        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), img);
     else:
         os.mkdir("detected")
         os.mkdir("/".join(("detected", str(img_time.year))))
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'))))
         os.mkdir("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day))))
-        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), img);
-    
-    if uploadqueue:
-        uploadqueue.append(img_time);
+        cv2.imwrite("/".join(("detected", str(img_time.year), str(img_time.month) + ". " + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), img);
 
 class UploadQueue(object):
     """Implements a queue of images for upload.
@@ -73,18 +101,20 @@ class UploadQueue(object):
         self.drive = drive;
         self.running = True;
 
-    def append(self, img_time):
+    def append(self, img_time, source=None):
         """Append a new image for upload.
         
             Args:
                 img_time: a datetime object representing the time the frame was taken.
+                source: name of the video source, if there are several.
             
             Returns:
             
             Raises:
             
         """
-        self.uploadqueue.append(img_time);
+        self.uploadqueue.append((img_time, source));
+        metrics.counter("turret_uploads_queued_total", "Images queued for upload to Google Drive.").inc();
 
     def uploadloop(self):
         """UploadQueue main method. Continuously uploads the first element of the queue.
@@ -98,7 +128,7 @@ class UploadQueue(object):
         """
         while self.running and self.drive:
             if self.drive and len(self.uploadqueue) > 0:
-                img_time = self.uploadqueue[0];
+                img_time, source = self.uploadqueue[0];
                 self.uploadqueue.popleft();
                 upload_path = None;
                 while not upload_path:
@@ -106,7 +136,7 @@ class UploadQueue(object):
                     time.sleep(1);
                 if self.drive:
                     self.drive.save_img("/".join(("detected", str(img_time.year), str(img_time.month) + ". " 
-                                         + img_time.strftime('%B'), str(img_time.day), str(img_time)[:19] + ".png")), upload_path);
+                                         + img_time.strftime('%B'), str(img_time.day), image_name(img_time, source))), upload_path);
                                          
     def quit(self):
         self.drive = None;
@@ -0,0 +1,164 @@
+"""
+Adapt detection settings to keep frame processing within a time budget.
+"""
+# coding: utf-8
+
+# Detection settings, from the most accurate to the cheapest. scale
+# multiplies the configured upperbody search scale; stride runs the
+# detectors on one frame out of stride, reusing their result in between.
+LEVELS = [
+    {"scale_factor": 1.2, "min_upperbody": (60, 60), "scale": 1.0, "stride": 1},
+    {"scale_factor": 1.3, "min_upperbody": (60, 60), "scale": 1.0, "stride": 1},
+    {"scale_factor": 1.3, "min_upperbody": (80, 80), "scale": 0.75, "stride": 1},
+    {"scale_factor": 1.4, "min_upperbody": (80, 80), "scale": 0.5, "stride": 1},
+    {"scale_factor": 1.4, "min_upperbody": (100, 100), "scale": 0.5, "stride": 2},
+    {"scale_factor": 1.5, "min_upperbody": (100, 100), "scale": 0.5, "stride": 3},
+    {"scale_factor": 1.5, "min_upperbody": (120, 120), "scale": 0.4, "stride": 4},
+]
+
+
+class BudgetScheduler(object):
+    """Pick the most accurate detection settings a time budget allows.
+
+        A BudgetScheduler object is told how long each detection took,
+        keeps a moving average of the time spent per frame, and moves
+        between LEVELS: to a cheaper level when the average goes over
+        the budget, back to a more accurate one when it stays well
+        under. After each move, it waits a few frames for the average
+        to follow. It also remembers what the levels it left cost, and
+        for a while won't go back to one that was over budget, so
+        levels don't flap. Every move is logged. Usage example below:
+
+        >>> import schedule;
+        >>> scheduler = schedule.BudgetScheduler(0.05);
+        >>> if scheduler.due():
+        ...     start = time.time();
+        ...     frame, decision = detect.old_detection(frame, upperbody, face, **scheduler.detection_settings(1.0));
+        ...     scheduler.observe(time.time() - start);
+
+        Attributes:
+            target: time budget per frame, in seconds.
+            level: index of the current settings in LEVELS.
+            average: moving average of the time per frame, in seconds.
+
+    """
+
+    def __init__(self, target, name="", levels=LEVELS, smoothing=0.1, settle=10, headroom=0.6, memory=300):
+        """BudgetScheduler constructor.
+
+            Args:
+                target: time budget per frame, in seconds.
+                name: a short name for the video source, for the log.
+                levels: detection settings, from the most accurate to
+                        the cheapest.
+                smoothing: weight of each new observation in the
+                           moving average.
+                settle: number of analyzed frames to wait after a move.
+                headroom: fraction of the budget the average must stay
+                          under before moving to a more accurate level.
+                memory: number of frames the cost of a level left is
+                        remembered for.
+
+            Returns:
+                A BudgetScheduler object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.target = target;
+        self.level = 0;
+        self.average = None;
+        self._name = name;
+        self._levels = levels;
+        self._smoothing = smoothing;
+        self._settle = settle;
+        self._headroom = headroom;
+        self._memory = memory;
+        self._wait = settle;
+        self._frame = 0;
+        self._costs = {};       # level -> (time per frame, frame it was measured at)
+
+
+    @property
+    def settings(self):
+        """Detection settings of the current level."""
+        return self._levels[self.level]
+
+
+    def detection_settings(self, scale):
+        """Keyword arguments of detect.old_detection() for the current level.
+
+            Args:
+                scale: the configured upperbody search scale.
+
+            Returns:
+                A dictionary with scale, scale_factor and
+                min_upperbody.
+
+            Raises:
+                No information.
+
+        """
+
+        settings = self.settings;
+        return {"scale": scale * settings["scale"],
+                "scale_factor": settings["scale_factor"],
+                "min_upperbody": settings["min_upperbody"]}
+
+
+    def due(self):
+        """Count a frame and tell whether detection should run on it."""
+        due = self._frame % self.settings["stride"] == 0;
+        self._frame += 1;
+        return due
+
+
+    def observe(self, seconds):
+        """Record the duration of a detection and adjust the level.
+
+            Args:
+                seconds: time the detection took.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        # With a stride, the cost of a detection is spread over the frames it covers
+        per_frame = seconds / self.settings["stride"];
+        if self.average is None:
+            self.average = per_frame;
+        else:
+            self.average += self._smoothing * (per_frame - self.average);
+
+        if self._wait > 0:
+            self._wait -= 1;
+            return
+
+        if self.average > self.target and self.level < len(self._levels) - 1:
+            self._move(self.level + 1);
+        elif self.average < self.target * self._headroom and self.level > 0 and self._affordable(self.level - 1):
+            self._move(self.level - 1);
+
+
+    def _affordable(self, level):
+        """Whether a level is not known to be over budget lately."""
+        if level not in self._costs:
+            return True
+        cost, frame = self._costs[level];
+        return cost <= self.target or self._frame - frame > self._memory
+
+
+    def _move(self, level):
+        """Switch to another level and log it."""
+        print "Scheduler {}: {:.1f} ms per frame for a {:.1f} ms budget, level {} -> {}: {}".format(
+            self._name, self.average * 1000, self.target * 1000, self.level, level,
+            ", ".join("{}={}".format(k, v) for k, v in sorted(self._levels[level].items())));
+        self._costs[self.level] = (self.average, self._frame);
+        self.level = level;
+        self._wait = self._settle;
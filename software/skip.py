@@ -0,0 +1,118 @@
+"""
+Skip detection on frames that barely differ from the last analyzed one.
+"""
+# coding: utf-8
+
+import cv2
+import imgutils
+
+# Size of the thumbnails compared, width and height
+THUMBNAIL_SIZE = (32, 24)
+
+
+class FrameSkipper(object):
+    """Reuse the last detection result while the scene doesn't change.
+
+        A FrameSkipper object keeps a tiny grayscale thumbnail of the
+        last frame that went through detection. Each new frame gets a
+        change score, the mean absolute difference between its own
+        thumbnail and that one, in gray levels. Below the threshold,
+        the frame differs by little more than sensor noise, and the
+        previous decision and rectangles are reused instead of running
+        the detectors again. Usage example below:
+
+        >>> import skip;
+        >>> skipper = skip.FrameSkipper(2.0);
+        >>> result = skipper.reuse(frame, context);
+        >>> if result is None:
+        ...     result = detect.old_detection(frame, upperbody, face, True, context=context);
+        ...     skipper.remember(result);
+
+        Attributes:
+            threshold: change score below which a frame is skipped.
+            skipped: number of frames skipped.
+            analyzed: number of frames that went through detection.
+            score: change score of the last frame.
+
+    """
+
+    def __init__(self, threshold):
+        """FrameSkipper constructor.
+
+            Args:
+                threshold: change score below which a frame is
+                           skipped, in gray levels. 0 never skips.
+
+            Returns:
+                A FrameSkipper object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.threshold = threshold;
+        self.skipped = 0;
+        self.analyzed = 0;
+        self.score = None;
+        self._thumbnail = None;
+        self._candidate = None;
+        self._result = None;
+
+
+    def reuse(self, frame, context):
+        """Score a frame and reuse the last result if it barely changed.
+
+            Args:
+                frame: a cv2 image. Reused rectangles are drawn on it.
+                context: a preprocess.FrameContext of the frame.
+
+            Returns:
+                A tuple (frame, decision, rects), or None if the frame
+                must go through detection. In that case, remember()
+                should be called with its result.
+
+            Raises:
+                No information.
+
+        """
+
+        thumbnail = cv2.resize(context.gray, THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA);
+        if self._thumbnail is None or self._result is None:
+            self.score = None;
+        else:
+            self.score = cv2.absdiff(thumbnail, self._thumbnail).mean();
+            if self.score < self.threshold:
+                self.skipped += 1;
+                decision, rects = self._result;
+                return imgutils.box(rects, frame, (0, 0, 255)), decision, rects
+        self._candidate = thumbnail;
+        return None
+
+
+    def remember(self, result):
+        """Keep the detection result of the last frame given to reuse().
+
+            Args:
+                result: a tuple (frame, decision, rects).
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        frame, decision, rects = result;
+        self.analyzed += 1;
+        self._thumbnail = self._candidate;
+        self._result = (decision, rects);
+
+
+    def skip_rate(self):
+        """Fraction of frames skipped so far, or None before any frame."""
+        total = self.skipped + self.analyzed;
+        if not total:
+            return None
+        return float(self.skipped) / total
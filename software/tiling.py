@@ -0,0 +1,260 @@
+"""
+Search large frames for patterns tile by tile, on several threads.
+"""
+# coding: utf-8
+
+import math
+import threading
+from multiprocessing.pool import ThreadPool
+import cv2
+import numpy
+import imgutils
+
+
+def window_size(cascade_path):
+    """Width and height of the detection window of a cascade file.
+
+        CascadeClassifier.getOriginalWindowSize() crashes on old format
+        cascades with some OpenCV versions, so the file is read.
+
+        Args:
+            cascade_path: path to the cascade file.
+
+        Returns:
+            A (width, height) tuple.
+
+        Raises:
+            IOError: if the file isn't a cascade.
+
+    """
+
+    storage = cv2.FileStorage(cascade_path, cv2.FILE_STORAGE_READ);
+    node = storage.getFirstTopLevelNode();
+    if node is None or node.empty():
+        raise IOError("Not a cascade file: " + cascade_path);
+    if not node.getNode("width").empty():
+        size = (int(node.getNode("width").real()), int(node.getNode("height").real()));
+    elif not node.getNode("size").empty():
+        # Old format cascades give the size as a "width height" sequence
+        size = (int(node.getNode("size").at(0).real()), int(node.getNode("size").at(1).real()));
+    else:
+        raise IOError("No window size in cascade file: " + cascade_path);
+    storage.release();
+    return size
+
+
+class TiledSearch(object):
+    """Split a cascade search into jobs that run on a pool of threads.
+
+        A single detectMultiScale() call uses one core. A TiledSearch
+        object splits the search of an image in two kinds of jobs:
+
+        - the small windows, up to a size called the tile margin, are
+          searched on a grid of tiles. Each tile extends over its
+          neighbours by half the margin on every side, so every window
+          of that size centered in a tile fits entirely in it.
+        - the larger windows are searched on the whole image at once,
+          which is cheap, since the cascade shrinks the image before
+          trying large windows.
+
+        Cascade windows are rarely square, so the jobs are split by
+        scale level: the window sizes detectMultiScale() tries are
+        computed from the cascade's window and the scale factor, tiles
+        search the levels whose window fits in the margin, and the
+        whole image job the following ones. Every level is searched,
+        by exactly one kind of job.
+
+        OpenCV releases the GIL while searching, so the jobs run in
+        parallel on a thread pool. A CascadeClassifier can't be used by
+        two threads at once, so each thread loads its own copy of the
+        cascade file.
+
+        The jobs return every window the cascade accepted, not grouped
+        yet; tiles keep the ones centered on them, so windows seen by
+        two tiles count once. All windows are then grouped together,
+        with the same minimum of 3 neighbours as detectMultiScale(), so
+        a person seen at sizes searched by different jobs still gets
+        all its votes, and the result matches a single search of the
+        whole image. Groups that still overlap are merged with
+        non-maximum suppression. Usage example below:
+
+        >>> import tiling;
+        >>> tiler = tiling.TiledSearch(4, "haarcascades/haarcascade_mcs_upperbody.xml");
+        >>> rects, img = imgutils.detect_pattern(gray, cascade, (60,60), tiler=tiler);
+
+        Attributes:
+            threads: number of threads.
+            grid: number of tile columns and rows.
+
+    """
+
+    def __init__(self, threads, cascade_path, grid=None, overlap=0.5):
+        """TiledSearch constructor.
+
+            Args:
+                threads: number of threads.
+                cascade_path: path to the cascade file searched with.
+                grid: a (columns, rows) tuple. Default is the most
+                      square grid with one tile per thread.
+                overlap: maximum intersection over union of two
+                         rectangles kept after merging.
+
+            Returns:
+                A TiledSearch object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.threads = threads;
+        if grid is None:
+            rows = int(math.sqrt(threads));
+            while threads % rows:
+                rows -= 1;
+            grid = (threads / rows, rows);
+        self.grid = grid;
+        self._overlap = overlap;
+        self._cascade = cv2.CascadeClassifier(cascade_path);
+        self._window = window_size(cascade_path);
+        self._local = threading.local();
+        self._pool = ThreadPool(threads, self._load, (cascade_path,));
+
+
+    def _load(self, cascade_path):
+        """Load the cascade of a pool thread."""
+        self._local.cascade = cv2.CascadeClassifier(cascade_path);
+
+
+    def quit(self):
+        """Stop the threads."""
+        self._pool.terminate();
+        self._pool.join();
+
+
+    def levels(self, shape, scale_factor=1.2):
+        """Window sizes detectMultiScale() tries on an image, smaller first.
+
+            Args:
+                shape: the image shape, height first.
+                scale_factor: window growth between two passes.
+
+            Returns:
+                A list of (width, height) tuples.
+
+            Raises:
+                No information.
+
+        """
+
+        (h, w) = shape[:2];
+        (win_w, win_h) = self._window;
+        sizes = [];
+        # Same computation as detectMultiScale(), rounding included, so the levels are the same
+        factor = 1.0;
+        while True:
+            size = (int(numpy.rint(win_w * factor)), int(numpy.rint(win_h * factor)));
+            if size[0] > w or size[1] > h:
+                return sizes
+            sizes.append(size);
+            factor *= scale_factor;
+
+
+    def jobs(self, shape, min_rectangle, scale_factor=1.2):
+        """Split the search of an image of a given shape.
+
+            Args:
+                shape: the image shape, height first.
+                min_rectangle: width and height of the smaller search
+                               window.
+                scale_factor: window growth between two passes.
+
+            Returns:
+                A list of (x1, y1, x2, y2, core, min_size, max_size)
+                tuples: the searched part of the image, the part of it
+                the tile owns as a (x1, y1, x2, y2) tuple, and the range
+                of window sizes searched there. core and max_size are
+                None for the whole image job. An empty list if tiles
+                would be too small to split the search.
+
+            Raises:
+                No information.
+
+        """
+
+        (h, w) = shape[:2];
+        (cols, rows) = self.grid;
+        tile_w = int(math.ceil(float(w) / cols));
+        tile_h = int(math.ceil(float(h) / rows));
+        # Windows up to half a tile are searched in tiles, larger ones on the whole image
+        size = min(tile_w, tile_h) / 2;
+        if size <= max(min_rectangle) or (cols, rows) == (1, 1):
+            return []
+        sizes = self.levels(shape, scale_factor);
+        small = [s for s in sizes if max(s) <= size];
+        large = [s for s in sizes if max(s) > size];
+        if not small:
+            return []
+        # The largest tile level and the smallest whole image level bound both searches, in width and height
+        max_size = small[-1];
+        margin = size / 2 + 1;
+        jobs = [];
+        for row in range(rows):
+            for col in range(cols):
+                core = (col * tile_w, row * tile_h, min((col + 1) * tile_w, w), min((row + 1) * tile_h, h));
+                jobs.append((max(core[0] - margin, 0), max(core[1] - margin, 0),
+                             min(core[2] + margin, w), min(core[3] + margin, h),
+                             core, min_rectangle, max_size));
+        if large:
+            jobs.append((0, 0, w, h, None, (max(large[0][0], min_rectangle[0]), max(large[0][1], min_rectangle[1])), None));
+        return jobs
+
+
+    def detect(self, img, min_rectangle, scale_factor=1.2):
+        """Search an image with the cascade, tile by tile.
+
+            Args:
+                img: a cv2 image, preferably grayscale.
+                min_rectangle: width and height of the smaller search
+                               window.
+                scale_factor: window growth between two passes, as in
+                              imgutils.detect_pattern().
+
+            Returns:
+                An array of [x1, y1, x2, y2] rectangles, or an empty
+                list, like imgutils.detect_pattern().
+
+            Raises:
+                No information.
+
+        """
+
+        jobs = self.jobs(img.shape, min_rectangle, scale_factor);
+        if not jobs:
+            return imgutils.detect_pattern(img, self._cascade, min_rectangle, scale_factor)[0]
+
+        def search(job):
+            (x1, y1, x2, y2, core, min_size, max_size) = job;
+            cascade = self._local.cascade;
+            # No minimum of neighbours: windows are grouped once all jobs are done
+            if max_size is None:
+                rects = cascade.detectMultiScale(img[y1:y2, x1:x2], scale_factor, 0, 0, min_size);
+            else:
+                rects = cascade.detectMultiScale(img[y1:y2, x1:x2], scale_factor, 0, 0, min_size, max_size);
+            if len(rects) == 0:
+                return []
+            rects[:, 0] += x1;
+            rects[:, 1] += y1;
+            if core is not None:
+                cx = rects[:, 0] + rects[:, 2] / 2;
+                cy = rects[:, 1] + rects[:, 3] / 2;
+                rects = rects[(cx >= core[0]) & (cx < core[2]) & (cy >= core[1]) & (cy < core[3])];
+            return rects.tolist()
+
+        found = [rect for rects in self._pool.map(search, jobs) for rect in rects];
+        (rects, weights) = cv2.groupRectangles(found, 3, 0.2);
+        if len(rects) == 0:
+            return []
+        rects = numpy.array(rects);
+        rects[:, 2:] += rects[:, :2];
+        return imgutils.non_max_suppression(rects, self._overlap)
@@ -0,0 +1,203 @@
+"""
+Follow detected people between frames, so full detections run less often.
+"""
+# coding: utf-8
+
+import cv2
+import numpy
+import imgutils
+
+class TrackingDetector(object):
+    """Run a full detection on keyframes and track its results in between.
+
+        A TrackingDetector object wraps a detection function. When a
+        detection confirms people, it starts tracking corner features
+        inside each confirmed rectangle with pyramidal Lucas-Kanade
+        optical flow. Following frames only move the rectangles along
+        with their features, which costs a small fraction of a cascade
+        scan. A full detection runs again every keyframe_interval
+        frames, when a track is lost, or when nothing is tracked.
+
+        Features locked on the background would keep a track alive
+        after its person left, so features are only taken in the
+        center of each rectangle, and a track is lost when its
+        features fail the forward-backward check (tracked back to the
+        previous frame, they must land where they started), when less
+        than half of them are left, when they stop moving together, or
+        when the center of its rectangle no longer looks like it did
+        on the keyframe: a full detection then confirms whether
+        someone is still there. Someone standing still keeps the same
+        appearance, so the track lasts until the next keyframe.
+        Usage example below:
+
+        >>> import track;
+        >>> tracker = track.TrackingDetector(lambda frame, context:
+        ...     detect.old_detection(frame, upperbody, face, return_rects=True, context=context), 10);
+        >>> frame, decision, rects = tracker.detect(frame, context);
+
+        Attributes:
+            keyframe_interval: maximum number of frames between two
+                               full detections.
+            keyframes: number of full detections run.
+            tracked: number of frames handled by tracking alone.
+
+    """
+
+    def __init__(self, detect, keyframe_interval=10, min_points=4, max_error=1.0, min_similarity=0.5):
+        """TrackingDetector constructor.
+
+            Args:
+                detect: a function taking a frame and a
+                        preprocess.FrameContext, returning a tuple
+                        (frame, decision, rects).
+                keyframe_interval: maximum number of frames between
+                                   two full detections.
+                min_points: a track with fewer features left is lost.
+                max_error: maximum forward-backward error of a
+                           feature, in pixels.
+                min_similarity: a track whose center correlates
+                                less than this with its keyframe
+                                crop is lost.
+
+            Returns:
+                A TrackingDetector object.
+
+            Raises:
+                No information.
+
+        """
+
+        self.keyframe_interval = keyframe_interval;
+        self.keyframes = 0;
+        self.tracked = 0;
+        self._detect = detect;
+        self._min_points = min_points;
+        self._max_error = max_error;
+        self._min_similarity = min_similarity;
+        self._tracks = [];          # A list of [rect, points, initial number of points, keyframe crop]
+        self._prev_gray = None;
+        self._since_keyframe = 0;
+
+
+    def detect(self, frame, context):
+        """Detect or track people in a frame.
+
+            Args:
+                frame: a cv2 image. It is drawn on.
+                context: a preprocess.FrameContext of the frame.
+
+            Returns:
+                A tuple (frame, decision, rects), like the wrapped
+                detection function.
+
+            Raises:
+                No information.
+
+        """
+
+        gray = context.gray;
+
+        # The keyframe counts as one of the keyframe_interval frames
+        if self._tracks and self._since_keyframe + 1 < self.keyframe_interval and self._follow(gray):
+            self._since_keyframe += 1;
+            self.tracked += 1;
+            self._prev_gray = gray.copy();
+            rects = [[int(round(v)) for v in track[0]] for track in self._tracks];
+            frame = imgutils.box(rects, frame, (0, 0, 255));
+            return frame, True, rects
+
+        # Keyframe: full detection, then start new tracks from its results
+        frame, decision, rects = self._detect(frame, context);
+        self.keyframes += 1;
+        self._since_keyframe = 0;
+        self._prev_gray = gray.copy();
+        self._tracks = [];
+        if decision:
+            self._start(gray, rects);
+        return frame, decision, rects
+
+
+    def _start(self, gray, rects):
+        """Start a track on the corner features of each rectangle.
+
+            Rectangles without enough features are not tracked, so the
+            next frame runs a full detection again.
+
+            Args:
+                gray: grayscale frame.
+                rects: a list of [x1, y1, x2, y2] rectangles.
+
+            Returns:
+                Nothing.
+
+            Raises:
+                No information.
+
+        """
+
+        for x1, y1, x2, y2 in rects:
+            # Corners of the rectangle are often background, which doesn't leave with the person
+            (dx, dy) = ((x2 - x1) / 5, (y2 - y1) / 5);
+            mask = numpy.zeros(gray.shape, numpy.uint8);
+            mask[y1 + dy:y2 - dy, x1 + dx:x2 - dx] = 255;
+            points = cv2.goodFeaturesToTrack(gray, 30, 0.01, 3, mask=mask);
+            if points is None or len(points) < self._min_points:
+                self._tracks = [];
+                return
+            rect = numpy.array([x1, y1, x2, y2], numpy.float32);
+            self._tracks.append([rect, points, len(points), self._center(gray, rect)]);
+
+
+    def _follow(self, gray):
+        """Move every track to the current frame.
+
+            Args:
+                gray: grayscale frame.
+
+            Returns:
+                True if every track was followed, False if one was
+                lost.
+
+            Raises:
+                No information.
+
+        """
+
+        (h, w) = gray.shape[:2];
+        for track in self._tracks:
+            (rect, points, initial, crop) = track;
+            moved, status, error = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, points, None);
+            back, back_status, back_error = cv2.calcOpticalFlowPyrLK(gray, self._prev_gray, moved, None);
+            # Features that don't track back to where they started were lost or slid onto something else
+            error = numpy.sqrt(((back - points) ** 2).reshape(-1, 2).sum(axis=1));
+            good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < self._max_error);
+            if good.sum() < max(self._min_points, initial / 2):
+                return False
+            # Rectangles follow the median motion of their features, robust to a few bad ones
+            motion = (moved[good] - points[good]).reshape(-1, 2);
+            shift = numpy.median(motion, axis=0);
+            # A person moves as a whole: most features must agree with the median motion
+            if (numpy.abs(motion - shift).max(axis=1) < 2.0).sum() < good.sum() / 2.0:
+                return False
+            rect += [shift[0], shift[1], shift[0], shift[1]];
+            if rect[2] <= 0 or rect[3] <= 0 or rect[0] >= w or rect[1] >= h:
+                return False
+            # Features stuck on the background stay put once the person left: what they follow must still look the same
+            center = self._center(gray, rect);
+            if center is None or crop is None or center.shape != crop.shape:
+                return False
+            similarity = cv2.matchTemplate(center, crop, cv2.TM_CCOEFF_NORMED)[0, 0];
+            if not numpy.isfinite(similarity) or similarity < self._min_similarity:
+                return False
+            track[1] = moved[good].reshape(-1, 1, 2);
+        return True
+
+
+    def _center(self, gray, rect):
+        """Copy of the center of a rectangle, where features are taken, or None if it leaves the frame."""
+        (x1, y1, x2, y2) = [int(round(v)) for v in rect];
+        (dx, dy) = ((x2 - x1) / 5, (y2 - y1) / 5);
+        (h, w) = gray.shape[:2];
+        if x1 + dx < 0 or y1 + dy < 0 or x2 - dx > w or y2 - dy > h or x2 - x1 - 2 * dx <= 0 or y2 - y1 - 2 * dy <= 0:
+            return None
+        return gray[y1 + dy:y2 - dy, x1 + dx:x2 - dx].copy()
@@ -20,17 +20,43 @@ parser = argparse.ArgumentParser(description="People detection turret. Detects p
 parser.add_argument("-s", "--silent", help="Shut down the turret's sound modules.", action="store_true");
 parser.add_argument("-g", "--googledrive", help="Save a copy of detections in a folder inside your Google Drive account.", action="store_true");
 parser.add_argument("-n", "--nogui", help="Doesn't show a graphical user interface.", action="store_true");
-parser.add_argument("-r", "--rotate", type=int, help="Rotate camera input counterclockwise.")
+parser.add_argument("-c", "--camera", type=str, action="append", help="Video source, a camera device index or a video file or stream URL. Repeat to watch several sources. Standard is 0.")
+parser.add_argument("-r", "--rotate", type=int, action="append", help="Rotate camera input counterclockwise. Repeat to rotate each source, in --camera order; the last value applies to the remaining sources.")
 parser.add_argument("-f", "--facerecognition", type=str, help="Enable face recognition. Possible options are eigen, fisher or lbph. Standard is fisher.")
+parser.add_argument("--reverify", type=int, help="With -f, remember who each face followed from frame to frame is, and recognize it again every N frames only, or sooner when unsure.")
 parser.add_argument("-t", "--train", help="Train a new model for face recognition before startup, using /faces database.", action="store_true");
 parser.add_argument("-a", "--addface", type=str, help="Add a new face to /faces database. Argument is the face name.")
+parser.add_argument("--refresh-faces", type=float, help="With -f, check the /faces database every N seconds and update the model with faces added meanwhile, like with -a from another terminal, without restarting.")
 parser.add_argument("-b", "--bananas", help="Recognize bananas! Experiment only, will probably not work.", action="store_true")
+parser.add_argument("--face-cascade", type=str, default="haar", choices=sorted(facerec.FACE_CASCADES), help="Face cascade used to confirm upperbodies and to find faces to recognize. lbp cascades are several times faster. Standard is haar.")
 parser.add_argument("-m", "--motiondetection", help="Motion detection function based on background subtraction.", action="store_true")
+parser.add_argument("-w", "--workers", type=int, help="Run detection on a pool of N worker processes. Not used with face recognition.")
+parser.add_argument("--scale", type=float, default=1.0, help="Search upperbodies on a grayscale copy of each frame resized by this factor, like 0.5. Faces are still verified at full resolution. Standard is 1.")
+parser.add_argument("--track", type=int, help="Run the detector every N frames only, and track what it found with optical flow in between. A lost track triggers a new search. Not used with -m, -f or -w.")
+parser.add_argument("--gate", help="Run the detector only where motion was detected, and skip it when nothing moved.", action="store_true")
+parser.add_argument("--background", type=str, default="average", choices=["average", "mog2"], help="Background model of motion detection: a running average, or a mixture of gaussians that copes with flickering backgrounds. Standard is average.")
+parser.add_argument("--learning-rate", type=float, default=0.002, help="Weight of each new frame in the background model; 0 freezes the first frame as background. Standard is 0.002.")
+parser.add_argument("--skip", type=float, help="Reuse the last decision for frames whose 32x24 thumbnail differs from the last analyzed one by less than this mean number of gray levels, like 2. Not used with -w.")
+parser.add_argument("--budget", type=float, help="Target detection time per frame and camera, in milliseconds. Cascade settings and the share of frames searched adapt to stay within it, and every change is logged. Not used with -m alone, -f or -w.")
+parser.add_argument("--zones", type=str, help="JSON file of the zones of each camera where people are searched, or never searched, like monitors or posters, by pipeline name (cam0, cam1... or replay) or by source. See zones.py.")
+parser.add_argument("--tiles", type=int, help="Split the upperbody search of each frame into overlapping tiles searched on N threads. Lowers the latency of large frames on multicore hosts.")
+parser.add_argument("--detector", type=str, default="haar", choices=["haar", "hog", "dnn"], help="People detector: haar (upperbody and face cascades), hog (OpenCV's HOG people detector) or dnn (an SSD network run on the CPU, see --dnn-model). Standard is haar.")
+parser.add_argument("--dnn-model", type=str, help="Caffe weights of the dnn detector, like models/MobileNetSSD_deploy.caffemodel.")
+parser.add_argument("--dnn-config", type=str, help="Caffe network description of the dnn detector, like models/MobileNetSSD_deploy.prototxt.")
+parser.add_argument("--dnn-confidence", type=float, default=0.5, help="Minimum confidence of a dnn detection. Standard is 0.5.")
+parser.add_argument("--replay", type=str, help="Run the detectors over a video file or a directory of images as fast as possible, then quit. Implies --nogui and --silent.")
+parser.add_argument("--results", type=str, default="results.jsonl", help="Where --replay writes the decision and rectangles of each frame. Standard is results.jsonl.")
+parser.add_argument("--metrics", type=int, help="Serve stage latencies and counters in Prometheus text format on this local port.")
+parser.add_argument("--fps", type=float, help="Target frames per second when running with --nogui. Standard is as fast as possible.")
 
 args = parser.parse_args();
 
+if args.replay:
+    args.nogui = True
+    args.silent = True
+
 if args.addface:
-	mrfaces = facerec.FaceRecognizer('', 100)
+	mrfaces = facerec.FaceRecognizer('', 100, facerec.FACE_CASCADES[args.face_cascade])
 	mrfaces.add(args.addface, 300)
 	sys.exit()
 
@@ -41,33 +67,47 @@ import time
 import datetime
 import os
 import thread
+import threading
 import signal
-import soundcat
-import save
 import multiprocessing
 import getpass
 import numpy
-import gtk
-import glib
 import imgutils
 import fps
 import utils
-import gobject
 import detect
+import pipeline
+import engine
+import replay
+import metrics
+import zones
+
+# GTK is only needed, and only imported, when the GUI is enabled
+if not args.nogui:
+    import gtk
+    import glib
+    import gobject
+
+# Sounds (pygame) and saving detections (pydrive) are only needed live, not when replaying on a build machine
+if not args.replay:
+    import soundcat
+    import save
 
 # Soundcat object creation
 # This object is responsible for categorizing sounds stored in sounds/, according to the situation
-sound = soundcat.Soundcat();
-sound.add_category("init", os.getcwd() + "/sounds/init");
-sound.add_category("detection", os.getcwd() + "/sounds/detection");
-sound.add_category("close", os.getcwd() + "/sounds/close");
+# Replays never play sounds, and may run on hosts without audio devices
+if not args.replay:
+    sound = soundcat.Soundcat();
+    sound.add_category("init", os.getcwd() + "/sounds/init");
+    sound.add_category("detection", os.getcwd() + "/sounds/detection");
+    sound.add_category("close", os.getcwd() + "/sounds/close");
 
 UPLOAD = None
 UPLOAD_QUEUE = None
 SAVE_TO_DRIVE = False
 
 # Drive class object creation
-if args.googledrive:
+if args.googledrive and not args.replay:
 
     print "Activating..."
     UPLOAD = save.Drive();
@@ -78,29 +118,29 @@ if args.googledrive:
     thread.start_new_thread( UPLOADQUEUE.uploadloop, () )
     thread.start_new_thread( UPLOADQUEUE.uploadloop, () )
 
+# Video sources our turret will watch
+if args.camera: SOURCES = args.camera;
+else: SOURCES = ["0"];
+
 # Width and height of the frames our turret will process
 WIDTH  = 320;
 HEIGHT = 240;
-CV_CAP_PROP_FRAME_WIDTH  = 3;
-CV_CAP_PROP_FRAME_HEIGHT = 4;
 
-# Rotation of the frames our turret will process
-if args.rotate: ROTATION = args.rotate;
-else: ROTATION = None;
+# Rotation of the frames of each source
+if args.rotate: ROTATIONS = args.rotate;
+else: ROTATIONS = [None];
 
 if args.silent: SILENT = True;
 else: SILENT = False;
 
-# Load Haar Cascade Classifiers for upperbody and face
+# Load Cascade Classifiers for upperbody and face
 # We use classifiers commonly found in opencv packages
-cascade_upperbody = cv2.CascadeClassifier("haarcascades/haarcascade_mcs_upperbody.xml")
-cascade_face = cv2.CascadeClassifier("haarcascades/haarcascade_frontalface_alt.xml")
+UPPERBODY_CASCADE = "haarcascades/haarcascade_mcs_upperbody.xml"
+FACE_CASCADE = facerec.FACE_CASCADES[args.face_cascade]
 
-if(args.bananas): cascade_upperbody = cv2.CascadeClassifier("haarcascades/banana_classifier")
+if(args.bananas): UPPERBODY_CASCADE = "haarcascades/banana_classifier"
 
-# Frame counters, used to control our turret's talk timing and image saving speed
-counter = 0     # Store total number of frames since start of execution
-dcounter = 0    # Stores number of the last frame where a detection was made
+# Frame counters of each source are used to control our turret's talk timing and image saving speed
 LIMIT = 50      # Indicate limit of frames after the last detection in which we permit our turret to talk and save an image
 last_sec_frames = 0;
 
@@ -112,31 +152,97 @@ net_status = "OFF"
 
 # Face recognition
 if args.facerecognition:
-	mrfaces = facerec.FaceRecognizer(args.facerecognition, 500)
+	mrfaces = facerec.FaceRecognizer(args.facerecognition, 500, FACE_CASCADE)
 	if args.train:
 		mrfaces.train_model('faces/', 'models/');
 	else: 
 		mrfaces.load_model('models/')
-
-# Motion detection
-FIRST_FRAME = None
+else:
+	mrfaces = None
+
+# Zones of each camera; cameras without zones are searched entirely
+if args.zones: ZONES = zones.load(args.zones);
+else: ZONES = {};
+
+# Detector and detection worker pool, loaded once and shared by every source
+detector_options = {}
+if args.detector == "dnn":
+    detector_options = {"model": args.dnn_model, "config": args.dnn_config, "confidence": args.dnn_confidence}
+detectors = pipeline.Detectors(UPPERBODY_CASCADE, FACE_CASCADE, args.motiondetection, mrfaces, args.workers, args.scale, args.track, args.gate, args.background, args.learning_rate, args.skip, args.budget / 1000.0 if args.budget else None, args.detector, detector_options, args.tiles, args.reverify)
+
+# One pipeline per video source, created when the turret starts
+pipelines = []
+# Set by the capture thread of any source when it gets a new frame
+new_frame = threading.Event()
+
+# Metrics kept elsewhere are read when scraped
+metrics.counter("turret_frames_captured_total", "Frames captured from all sources.", function=lambda: sum(p.grabber.grabbed for p in pipelines if p.grabber))
+metrics.counter("turret_frames_dropped_total", "Captured frames replaced by a newer one before being processed.", function=lambda: sum(p.grabber.dropped for p in pipelines if p.grabber))
+metrics.counter("turret_keyframes_total", "Frames searched with the detector while tracking.", function=lambda: sum(p.tracker.keyframes for p in pipelines if p.tracker))
+metrics.counter("turret_tracked_frames_total", "Frames handled by tracking alone.", function=lambda: sum(p.tracker.tracked for p in pipelines if p.tracker))
+metrics.counter("turret_frames_skipped_total", "Frames whose last result was reused because they barely changed.", function=lambda: sum(p.skipper.skipped for p in pipelines if p.skipper))
+metrics.counter("turret_frames_analyzed_total", "Frames that went through detection while skipping is enabled.", function=lambda: sum(p.skipper.analyzed for p in pipelines if p.skipper))
+metrics.counter("turret_faces_predicted_total", "Faces given to the face recognizer while identities are cached.", function=lambda: sum(p.identities.predicted for p in pipelines if p.identities))
+metrics.counter("turret_faces_reused_total", "Faces identified from their track, without the face recognizer.", function=lambda: sum(p.identities.reused for p in pipelines if p.identities))
+metrics.gauge("turret_fps", "Frames processed during the last second.", function=lambda: fps_counter.current_fps)
+metrics.gauge("turret_internet_up", "Whether the internet connection is up.", function=lambda: net_status == "ON")
+metrics_server = None
+
+# Replay recorded frames through the same detectors, report throughput and quit
+if args.replay:
+    pipe = pipeline.Pipeline("replay", None, detectors, rotation=ROTATIONS[0], zones=ZONES.get("replay", ZONES.get(args.replay)))
+    frames, seconds = replay.replay(pipe, args.replay, args.results)
+    detectors.quit()
+    fps_counter.quit()
+    print "Replayed", frames, "frames in", "{:.2f}".format(seconds), "seconds,", "{:.2f}".format(frames / max(seconds, 1e-6)), "frames per second."
+    if pipe.skipper:
+        print "Skipped", pipe.skipper.skipped, "frames,", "{:.1%}".format(pipe.skipper.skip_rate() or 0), "of all."
+    if pipe.identities:
+        print "Recognized", pipe.identities.predicted, "faces, reused", pipe.identities.reused, "identities."
+    if pipe.tracker:
+        print "Searched", pipe.tracker.keyframes, "keyframes, tracked", pipe.tracker.tracked, "frames."
+    print "Results written to", args.results
+    sys.exit()
 
 # Some functions to handle OS signals and GUI events
 
-def sigint_handler(signum, instant):
-    """Capture SIGINT signal and quit safely.
-        
-        Close all cameras, windows, say goodbye!
-    """
+def shutdown():
+    """Release all resources and say goodbye!"""
     global SILENT;
-    camera.release();
+    if metrics_server:
+        metrics_server.quit();
+    for pipe in pipelines:
+        pipe.quit();
     fps_counter.quit();
+    detectors.quit();
     if not SILENT:
         sound.play("close")
         time.sleep(3)
     sound.quit()
+
+def sigint_handler(signum, instant):
+    """Capture SIGINT signal and quit safely.
+        
+        Close all cameras, windows, say goodbye!
+    """
+    shutdown()
     sys.exit()
 
+# Bring faces enrolled while the turret runs into the face recognition model
+def refresh_faces(interval):
+    last = None
+    while True:
+        # add() and update() write the names file last, once all pictures are saved
+        if os.path.exists('faces/names'):
+            changed = os.path.getmtime('faces/names')
+            if last is not None and changed != last:
+                try:
+                    mrfaces.update_model('faces/', 'models/')
+                except Exception as error:
+                    print "ERROR: Could not update the face recognition model:", error
+            last = changed
+        time.sleep(interval)
+
 # Update net connection status
 def update_net_status():
     global net_status
@@ -147,137 +253,207 @@ def update_net_status():
             net_status = "OFF"
 
 
+def process_frame(pipe, timeout=1.0):
+    """Read a new frame from a source, process it, search for humans.
+
+        Returns:
+            The annotated frame, or None if no frame is ready yet.
+    """
+    
+    global LIMIT, SILENT, SAVE_TO_DRIVE
+    
+    # Capture, rotate and extract data from frame
+    result = pipe.process(timeout)
+    if result is None:
+        return None
+    frame, decision, rects = result
+    if decision:
+        metrics.counter("turret_decisions_total", "Frames where something was detected.").inc()
+    
+    # Verify if it is time for our turret to speak and save a frame
+    if pipe.action_due(decision, LIMIT):
+        metrics.counter("turret_saves_total", "Detections saved to disk.").inc()
+        # Tell apart images from different sources, if there are several
+        if len(pipelines) > 1: name = pipe.name
+        else: name = None
+        if not SILENT:
+            sound.play("detection")     # i see you, there you are
+        now = datetime.datetime.now()
+        if SAVE_TO_DRIVE:
+            thread.start_new_thread( save.save, (frame.copy(), now, UPLOAD_QUEUE, name) )   # another thread
+            #multiprocessing.Process( target=imgutils.save, args=(frame, now, uploadqueue)).start() # another process
+        else:
+            thread.start_new_thread( save.save, (frame.copy(), now, None, name) )   # another thread
+            #multiprocessing.Process( target=imgutils.save, args=(frame, now)).start() # another process
+    
+    # Get current time and date, writes it to image.
+    annotate_start = time.time()
+    (height, width) = frame.shape[:2]
+    now = datetime.datetime.now()
+    if (width,height) == (320, 240) or (width,height) == (640, 480):
+        cv2.putText(frame, str(now)[:19], (10,height-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
+    elif (width,height) == (160, 120):
+        cv2.putText(frame, str(now)[:19], (5,height-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
+    
+    # Write current FPS on screen
+    if (width,height) == (320, 240) or (width,height) == (640, 480):
+        cv2.putText(frame, "FPS: {!s}".format(fps_counter.current_fps), (width-60,height-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
+    elif (width,height) == (160, 120):
+        cv2.putText(frame, "FPS: {!s}".format(fps_counter.current_fps), (width-55, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
+    metrics.stage("annotate").observe(time.time() - annotate_start)
+    
+    # Inform our FPS counter that a frame has been processed
+    fps_counter.update_frame_counter();
+    
+    return frame
+
+
+def process_sources():
+    """Process a new frame of every source, without letting a stalled source hold the others.
+
+        Returns:
+            The annotated frame of each source, or None for sources
+            without a new frame.
+    """
+    
+    if len(pipelines) == 1:
+        return [process_frame(pipelines[0])]
+    # Wait until any camera has a new frame, then take whatever every source has, without waiting
+    new_frame.wait(1.0)
+    new_frame.clear()
+    return [process_frame(pipe, 0) for pipe in pipelines]
+
+
 class MainGUI:
     
     def __init__(self):
-        if not args.nogui:
-            # Create a GTK window, set icon, title, connect some functions to GUI elements
-            self.MainWindow = gtk.Window()
-            self.MainWindow.set_icon_from_file('icons/ic_camera_48px-128.png')
-            self.MainWindow.set_title("Turret")
-            self.MainWindow.set_resizable(False)
-            self.MainWindow.set_position(gtk.WIN_POS_CENTER)
-            self.MainWindow.connect("delete_event", self.delete_event)
-            self.MainWindow.connect("destroy", gtk.main_quit)
-            
-            # Create a Box to contain all widgets
-            self.MainBox = gtk.HBox(False, 0);
-            self.MainWindow.add(self.MainBox)
-            
-            # Generate an initial black image and display it
-            self.FrameArea = gtk.Image()
-            pixbuf = gtk.gdk.pixbuf_new_from_array(numpy.zeros((HEIGHT,WIDTH,3), numpy.uint8), gtk.gdk.COLORSPACE_RGB, 8);
-            pixbuf = pixbuf.scale_simple(WIDTH, HEIGHT, gtk.gdk.INTERP_BILINEAR);
-            self.FrameArea.set_from_pixbuf(pixbuf)
-            self.MainBox.pack_start(self.FrameArea, True, True, 0)
-            
-            separator = gtk.VSeparator()
-            self.MainBox.pack_start(separator, False, True, 5)
-            
-            # Create a Box to contain the options panel
-            self.PanelBox = gtk.VBox(False, 0)
-            self.MainBox.pack_start(self.PanelBox, True, True, 0);
-            
-            separator = gtk.HSeparator()
-            self.PanelBox.pack_start(separator, False, True, 5)
-            
-            # Frame size panel options
-            self.FrameSizePanel = gtk.VBox(False, 0)
-            self.PanelBox.pack_start(self.FrameSizePanel, False, True, 0);
-            
-            label = gtk.Label('Frame size')
-            label.set_justify(gtk.JUSTIFY_LEFT)
-            lalign = gtk.Alignment(0, 0.1, 0, 0.1)
-            lalign.add(label)
-            self.FrameSizePanel.pack_start(lalign, True, False, 0)
-            
-            self.FrameSizeOptions = gtk.HBox(False, 0)
-            self.FrameSizePanel.pack_start(self.FrameSizeOptions, True, True, 0)
-            
-            button = gtk.RadioButton(None, "160x120")
-            button.connect("toggled", self.on_framesizeoption_toggled, (160,120))
-            self.FrameSizeOptions.pack_start(button, True, True, 0)
-
-            button = gtk.RadioButton(button, "320x240")
-            button.connect("toggled", self.on_framesizeoption_toggled, (320,240))
-            button.set_active(True)
-            self.FrameSizeOptions.pack_start(button, True, True, 0)
-
-            button = gtk.RadioButton(button, "640x480")
-            button.connect("toggled", self.on_framesizeoption_toggled, (640,480))
-            self.FrameSizeOptions.pack_start(button, True, True, 0)
-            
-            separator = gtk.HSeparator()
-            self.PanelBox.pack_start(separator, False, True, 5)
-            
-            
-            # Frame rotation panel options
-            self.FrameRotationPanel = gtk.VBox(False, 0)
-            self.PanelBox.pack_start(self.FrameRotationPanel, False, True, 0);
-            
-            label = gtk.Label('Frame rotation')
-            label.set_justify(gtk.JUSTIFY_LEFT)
-            lalign = gtk.Alignment(0, 0.1, 0, 0.1)
-            lalign.add(label)
-            self.FrameRotationPanel.pack_start(lalign, True, False, 0)
-            
-            self.FrameRotationOptions = gtk.HBox(False, 0)
-            self.FrameRotationPanel.pack_start(self.FrameRotationOptions, True, True, 0)
-            
-            button = gtk.RadioButton(None, "0")
-            button.connect("toggled", self.on_framerotationoption_toggled, None)
-            button.set_active(True)
-            self.FrameRotationOptions.pack_start(button, True, True, 0)
-
-            button = gtk.RadioButton(button, "90")
-            button.connect("toggled", self.on_framerotationoption_toggled, 90)
-            self.FrameRotationOptions.pack_start(button, True, True, 0)
-
-            button = gtk.RadioButton(button, "180")
-            button.connect("toggled", self.on_framerotationoption_toggled, 180)
-            self.FrameRotationOptions.pack_start(button, True, True, 0)
-            
-            button = gtk.RadioButton(button, "270")
-            button.connect("toggled", self.on_framerotationoption_toggled, 270)
-            self.FrameRotationOptions.pack_start(button, True, True, 0)
-            
-            separator = gtk.HSeparator()
-            self.PanelBox.pack_start(separator, False, True, 5)
-            
-            
-            # More options panel
-            self.MoreOptionsPanel = gtk.VBox(False, 0)
-            self.PanelBox.pack_start(self.MoreOptionsPanel, False, True, 0);
-            
-            label = gtk.Label('More options')
-            label.set_justify(gtk.JUSTIFY_LEFT)
-            lalign = gtk.Alignment(0, 0.1, 0, 0.1)
-            lalign.add(label)
-            self.MoreOptionsPanel.pack_start(lalign, True, False, 0)
-            
-            self.MoreOptions = gtk.HBox(False, 0)
-            self.MoreOptionsPanel.pack_start(self.MoreOptions, True, True, 0)
-            
-            button = gtk.CheckButton("Silent")
-            button.connect("toggled", self.on_sound_option_toggled)
-            button.set_active(SILENT)
-            self.MoreOptions.pack_start(button, True, True, 0)
-
-            self.save_to_drive_button = gtk.CheckButton("Save to Drive")
-            self.save_to_drive_button.connect("toggled", self.on_save_to_drive_toggled)
-            self.save_to_drive_button.set_active(args.googledrive)
-            self.MoreOptions.pack_start(self.save_to_drive_button, True, True, 0)
-            
-            separator = gtk.HSeparator()
-            self.PanelBox.pack_start(separator, False, True, 5)
+        # Create a GTK window, set icon, title, connect some functions to GUI elements
+        self.MainWindow = gtk.Window()
+        self.MainWindow.set_icon_from_file('icons/ic_camera_48px-128.png')
+        self.MainWindow.set_title("Turret")
+        self.MainWindow.set_resizable(False)
+        self.MainWindow.set_position(gtk.WIN_POS_CENTER)
+        self.MainWindow.connect("delete_event", self.delete_event)
+        self.MainWindow.connect("destroy", gtk.main_quit)
+        
+        # Create a Box to contain all widgets
+        self.MainBox = gtk.HBox(False, 0);
+        self.MainWindow.add(self.MainBox)
+        
+        # Generate an initial black image and display it
+        self.FrameArea = gtk.Image()
+        pixbuf = gtk.gdk.pixbuf_new_from_array(numpy.zeros((HEIGHT,WIDTH,3), numpy.uint8), gtk.gdk.COLORSPACE_RGB, 8);
+        pixbuf = pixbuf.scale_simple(WIDTH, HEIGHT, gtk.gdk.INTERP_BILINEAR);
+        self.FrameArea.set_from_pixbuf(pixbuf)
+        self.MainBox.pack_start(self.FrameArea, True, True, 0)
+        
+        separator = gtk.VSeparator()
+        self.MainBox.pack_start(separator, False, True, 5)
+        
+        # Create a Box to contain the options panel
+        self.PanelBox = gtk.VBox(False, 0)
+        self.MainBox.pack_start(self.PanelBox, True, True, 0);
+        
+        separator = gtk.HSeparator()
+        self.PanelBox.pack_start(separator, False, True, 5)
+        
+        # Frame size panel options
+        self.FrameSizePanel = gtk.VBox(False, 0)
+        self.PanelBox.pack_start(self.FrameSizePanel, False, True, 0);
+        
+        label = gtk.Label('Frame size')
+        label.set_justify(gtk.JUSTIFY_LEFT)
+        lalign = gtk.Alignment(0, 0.1, 0, 0.1)
+        lalign.add(label)
+        self.FrameSizePanel.pack_start(lalign, True, False, 0)
+        
+        self.FrameSizeOptions = gtk.HBox(False, 0)
+        self.FrameSizePanel.pack_start(self.FrameSizeOptions, True, True, 0)
+        
+        button = gtk.RadioButton(None, "160x120")
+        button.connect("toggled", self.on_framesizeoption_toggled, (160,120))
+        self.FrameSizeOptions.pack_start(button, True, True, 0)
+
+        button = gtk.RadioButton(button, "320x240")
+        button.connect("toggled", self.on_framesizeoption_toggled, (320,240))
+        button.set_active(True)
+        self.FrameSizeOptions.pack_start(button, True, True, 0)
+
+        button = gtk.RadioButton(button, "640x480")
+        button.connect("toggled", self.on_framesizeoption_toggled, (640,480))
+        self.FrameSizeOptions.pack_start(button, True, True, 0)
+        
+        separator = gtk.HSeparator()
+        self.PanelBox.pack_start(separator, False, True, 5)
+        
+        
+        # Frame rotation panel options
+        self.FrameRotationPanel = gtk.VBox(False, 0)
+        self.PanelBox.pack_start(self.FrameRotationPanel, False, True, 0);
+        
+        label = gtk.Label('Frame rotation')
+        label.set_justify(gtk.JUSTIFY_LEFT)
+        lalign = gtk.Alignment(0, 0.1, 0, 0.1)
+        lalign.add(label)
+        self.FrameRotationPanel.pack_start(lalign, True, False, 0)
+        
+        self.FrameRotationOptions = gtk.HBox(False, 0)
+        self.FrameRotationPanel.pack_start(self.FrameRotationOptions, True, True, 0)
+        
+        button = gtk.RadioButton(None, "0")
+        button.connect("toggled", self.on_framerotationoption_toggled, None)
+        button.set_active(True)
+        self.FrameRotationOptions.pack_start(button, True, True, 0)
+
+        button = gtk.RadioButton(button, "90")
+        button.connect("toggled", self.on_framerotationoption_toggled, 90)
+        self.FrameRotationOptions.pack_start(button, True, True, 0)
+
+        button = gtk.RadioButton(button, "180")
+        button.connect("toggled", self.on_framerotationoption_toggled, 180)
+        self.FrameRotationOptions.pack_start(button, True, True, 0)
+        
+        button = gtk.RadioButton(button, "270")
+        button.connect("toggled", self.on_framerotationoption_toggled, 270)
+        self.FrameRotationOptions.pack_start(button, True, True, 0)
+        
+        separator = gtk.HSeparator()
+        self.PanelBox.pack_start(separator, False, True, 5)
+        
+        
+        # More options panel
+        self.MoreOptionsPanel = gtk.VBox(False, 0)
+        self.PanelBox.pack_start(self.MoreOptionsPanel, False, True, 0);
+        
+        label = gtk.Label('More options')
+        label.set_justify(gtk.JUSTIFY_LEFT)
+        lalign = gtk.Alignment(0, 0.1, 0, 0.1)
+        lalign.add(label)
+        self.MoreOptionsPanel.pack_start(lalign, True, False, 0)
+        
+        self.MoreOptions = gtk.HBox(False, 0)
+        self.MoreOptionsPanel.pack_start(self.MoreOptions, True, True, 0)
+        
+        button = gtk.CheckButton("Silent")
+        button.connect("toggled", self.on_sound_option_toggled)
+        button.set_active(SILENT)
+        self.MoreOptions.pack_start(button, True, True, 0)
+
+        self.save_to_drive_button = gtk.CheckButton("Save to Drive")
+        self.save_to_drive_button.connect("toggled", self.on_save_to_drive_toggled)
+        self.save_to_drive_button.set_active(args.googledrive)
+        self.MoreOptions.pack_start(self.save_to_drive_button, True, True, 0)
+        
+        separator = gtk.HSeparator()
+        self.PanelBox.pack_start(separator, False, True, 5)
 
-            
-            separator = gtk.VSeparator()
-            self.MainBox.pack_start(separator, False, True, 5)
-            
-            # Show window
-            self.MainWindow.show_all()
         
+        separator = gtk.VSeparator()
+        self.MainBox.pack_start(separator, False, True, 5)
+        
+        # Show window
+        self.MainWindow.show_all()
+    
         # Make our frame capturing and detection function execute whenever there are no higher priority events in main GTK loop
         glib.idle_add(self.set_frame);
     
@@ -285,12 +461,12 @@ class MainGUI:
     def on_framesizeoption_toggled(self, button, data):
         global WIDTH, HEIGHT
         WIDTH, HEIGHT = data;
-        camera.set(CV_CAP_PROP_FRAME_WIDTH, WIDTH);
-        camera.set(CV_CAP_PROP_FRAME_HEIGHT, HEIGHT);
+        for pipe in pipelines:
+            pipe.set_size(WIDTH, HEIGHT);
         
     def on_framerotationoption_toggled(self, button, data):
-        global ROTATION
-        ROTATION = data;
+        for pipe in pipelines:
+            pipe.rotation = data;
     
     def on_sound_option_toggled(self, button):
         global SILENT
@@ -322,84 +498,25 @@ class MainGUI:
             
             Close all cameras, windows, say goodbye!
         """
-        global SILENT
-        camera.release();
-        fps_counter.quit();
-        if not SILENT:
-            sound.play("close")
-            time.sleep(3)
-        sound.quit()
+        shutdown()
         return False
     
     
     # Detection and screen update function
 
     def set_frame(self):
-        """Read a new frame from camera, process it, search for humans."""
+        """Process a new frame of every source and show the first source on screen."""
         
-        global counter, dcounter, LIMIT, last_sec_frames, WIDTH, HEIGHT, ROTATION, SILENT, SAVE_TO_DRIVE
-        global FIRST_FRAME
+        frames = process_sources()
+        frame = frames[0]
         
-        # Here, frames will be continuously captured and processed
-        # Capture and apply some operations to captured frame before pattern detection
-        ret ,frame = camera.read()                          # Capture a frame
-        #frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)    # Apply a grayscale filter
-        
-        # Rotate image if required
-        if ROTATION:
-            frame = imgutils.rotate(frame, ROTATION);        
-
-        # Extract data from frame and decide if it should be saved
-        if args.facerecognition:
-        	frame, faces, found, confs, decision = mrfaces.recognize(frame);
-        elif args.motiondetection:
-            if FIRST_FRAME == None:
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                gray = cv2.GaussianBlur(gray, (21, 21), 0)
-                FIRST_FRAME = gray
-            frame, decision = detect.motion_detection(frame, FIRST_FRAME);
-        else:
-        	frame, decision = detect.old_detection(frame, cascade_upperbody, cascade_face);
-        
-        # Verify if it is time for our turret to speak and save a frame
-        if decision and counter - dcounter > LIMIT:
-            dcounter = counter
-            if not SILENT:
-                sound.play("detection")     # i see you, there you are
-            now = datetime.datetime.now()
-            if SAVE_TO_DRIVE:
-                thread.start_new_thread( save.save, (frame, now, UPLOAD_QUEUE) )   # another thread
-                #multiprocessing.Process( target=imgutils.save, args=(frame, now, uploadqueue)).start() # another process
-            else:
-                thread.start_new_thread( save.save, (frame, now) )   # another thread
-                #multiprocessing.Process( target=imgutils.save, args=(frame, now)).start() # another process
-        
-        counter+=1;
-        
-        # Get current time and date, writes it to image.
-        now = datetime.datetime.now()
-        if (WIDTH,HEIGHT) == (320, 240) or (WIDTH,HEIGHT) == (640, 480):
-            cv2.putText(frame, str(now)[:19], (10,HEIGHT-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
-        elif (WIDTH,HEIGHT) == (160, 120):
-            cv2.putText(frame, str(now)[:19], (5,HEIGHT-5), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
-        
-        # Write current FPS on screen
-        if (WIDTH,HEIGHT) == (320, 240) or (WIDTH,HEIGHT) == (640, 480):
-            cv2.putText(frame, "FPS: {!s}".format(fps_counter.current_fps), (WIDTH-60,HEIGHT-10), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
-        elif (WIDTH,HEIGHT) == (160, 120):
-            cv2.putText(frame, "FPS: {!s}".format(fps_counter.current_fps), (WIDTH-55, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255,255,255))
-        
-        # If GUI is enabled, change image color model from BGR to RGB, convert to GTK compatible image, update frame.
-        if not args.nogui:
-            b, g, r = cv2.split(frame)
-            frame_rgb = cv2.merge([r,g,b])
-            pixbuf = gtk.gdk.pixbuf_new_from_array(frame_rgb, gtk.gdk.COLORSPACE_RGB, 8);
-            self.FrameArea.set_from_pixbuf(pixbuf)
-        
-        # Inform our FPS counter that a frame has been processed
-        fps_counter.update_frame_counter();
-        print "\rFPS: {!s}".format(fps_counter.current_fps), "  INTERNET " + net_status + " ",
-        sys.stdout.flush()
+        # Change image color model from BGR to RGB, convert to GTK compatible image, update frame.
+        if frame is not None:
+            with metrics.timed("display"):
+                b, g, r = cv2.split(frame)
+                frame_rgb = cv2.merge([r,g,b])
+                pixbuf = gtk.gdk.pixbuf_new_from_array(frame_rgb, gtk.gdk.COLORSPACE_RGB, 8);
+                self.FrameArea.set_from_pixbuf(pixbuf)
         
         return True;
 
@@ -412,23 +529,39 @@ if __name__ == '__main__':
     if not SILENT:
         sound.play("init")
     
-    # Activate capture of SIGINT (Ctrl-C)
-    signal.signal(signal.SIGINT, sigint_handler)
-    
-    # Start a video capture from the first camera device found
-    camera = cv2.VideoCapture(0)
-    camera.set(CV_CAP_PROP_FRAME_WIDTH, WIDTH);
-    camera.set(CV_CAP_PROP_FRAME_HEIGHT, HEIGHT);
-
-    if not(camera == None):
-        print "\nCamera is ready"
+    # Start a video capture, in a separate thread, from every source
+    for i, source in enumerate(SOURCES):
+        name = "cam" + str(i)
+        pipe = pipeline.Pipeline(name, source, detectors, WIDTH, HEIGHT, ROTATIONS[min(i, len(ROTATIONS)-1)], ZONES.get(name, ZONES.get(source)), new_frame)
+        pipelines.append(pipe)
+        if pipe.camera.isOpened():
+            print "\nCamera", pipe.name, "(" + source + ") is ready"
+        else:
+            print "\nERROR: Camera", pipe.name, "(" + source + ") could not be opened"
     print('Press Ctrl+C to finish')
     
     # Start the connection verification thread
     thread.start_new_thread( update_net_status, () )
+    if mrfaces and args.refresh_faces:
+        thread.start_new_thread( refresh_faces, (args.refresh_faces,) )
+    
+    # Serve metrics to local scrapers
+    if args.metrics:
+        metrics_server = metrics.MetricsServer(args.metrics)
+        print "Metrics served at http://127.0.0.1:{!s}/metrics".format(args.metrics)
     
-    mg = MainGUI();
-    gobject.threads_init()
-    # Start GTK main loop
-    gtk.main()
+    if args.nogui:
+        # Run the headless loop until SIGINT (Ctrl-C) or SIGTERM, then quit safely
+        turret_engine = engine.Engine(process_sources, args.fps)
+        signal.signal(signal.SIGINT, turret_engine.stop)
+        signal.signal(signal.SIGTERM, turret_engine.stop)
+        turret_engine.run()
+        shutdown()
+    else:
+        # Activate capture of SIGINT (Ctrl-C)
+        signal.signal(signal.SIGINT, sigint_handler)
+        mg = MainGUI();
+        gobject.threads_init()
+        # Start GTK main loop
+        gtk.main()
     
@@ -0,0 +1,164 @@
+"""
+Zones of each camera where people are searched, or never searched.
+"""
+# coding: utf-8
+
+import json
+import cv2
+import numpy
+import imgutils
+
+
+def load(path):
+    """Read the zones of every camera from a JSON file.
+
+        The file maps a camera, by pipeline name like "cam0" or by
+        source like "0" or a stream URL, to its include and exclude
+        zones. Each zone is a polygon, a list of [x, y] points, or a
+        rectangle, a list of four numbers x1, y1, x2, y2. Coordinates
+        are fractions of the frame width and height, so zones hold
+        whatever the frame size. Example:
+
+            {"cam0": {"include": [[0, 0.2, 1, 1]],
+                      "exclude": [[[0.7, 0.2], [1, 0.2], [1, 0.6]]]}}
+
+        Args:
+            path: path to the JSON file.
+
+        Returns:
+            A dictionary of Zones objects, by camera.
+
+        Raises:
+            IOError: if the file can't be read.
+            ValueError: if the file is not valid JSON, or a zone is
+                        neither a polygon nor a rectangle.
+
+    """
+
+    with open(path) as f:
+        config = json.load(f);
+    return dict((str(camera), Zones(zones.get("include"), zones.get("exclude")))
+                for camera, zones in config.items())
+
+
+def _polygon(zone):
+    """A zone as an array of [x, y] points, in fractions of the frame size."""
+    points = numpy.array(zone, dtype=numpy.float64);
+    if points.shape == (4,):
+        (x1, y1, x2, y2) = points;
+        points = numpy.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]]);
+    if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+        raise ValueError("A zone must be a list of [x, y] points or a rectangle [x1, y1, x2, y2]: " + str(zone));
+    return points
+
+
+class Zones(object):
+    """Parts of a camera's frames where people are searched.
+
+        Include zones restrict every detector to the pixels inside
+        them; without include zones the whole frame is searched.
+        Exclude zones, like monitors, posters with faces or windows
+        onto the street, are never searched, even inside an include
+        zone. A Zones object turns them into a mask, given to
+        preprocess.FrameContext so every grayscale variant is black
+        outside the zones, and into the bounding rectangles of the
+        included parts, the only regions cascades need to scan. Both
+        are computed once per frame size. Usage example below:
+
+        >>> import zones;
+        >>> camera_zones = zones.Zones(include=[[0, 0.2, 1, 1]], exclude=[[0.7, 0.2, 1, 0.6]]);
+        >>> mask = camera_zones.mask(320, 240);
+        >>> regions = camera_zones.regions(320, 240);
+
+        Attributes:
+            include: polygons searched, in fractions of the frame size.
+            exclude: polygons never searched.
+
+    """
+
+    def __init__(self, include=None, exclude=None):
+        """Zones constructor.
+
+            Args:
+                include: a list of zones, polygons or rectangles in
+                         fractions of the frame size, as in load().
+                         Default is the whole frame.
+                exclude: a list of zones never searched.
+
+            Returns:
+                A Zones object.
+
+            Raises:
+                ValueError: if a zone is neither a polygon nor a
+                            rectangle.
+
+        """
+
+        self.include = [_polygon(zone) for zone in include or []];
+        self.exclude = [_polygon(zone) for zone in exclude or []];
+        self._masks = {};       # (width, height) -> (mask, regions)
+
+
+    def mask(self, width, height):
+        """Mask of the searched pixels of a frame.
+
+            Args:
+                width: frame width.
+                height: frame height.
+
+            Returns:
+                A grayscale cv2 image, 255 where people are searched
+                and 0 elsewhere.
+
+            Raises:
+                No information.
+
+        """
+
+        return self._build(width, height)[0]
+
+
+    def regions(self, width, height):
+        """Bounding rectangles of the searched parts of a frame.
+
+            Args:
+                width: frame width.
+                height: frame height.
+
+            Returns:
+                A list of [x1, y1, x2, y2] rectangles that don't
+                overlap, empty if everything is excluded. None without
+                include zones, meaning the whole frame.
+
+            Raises:
+                No information.
+
+        """
+
+        return self._build(width, height)[1]
+
+
+    def _build(self, width, height):
+        """Compute the mask and regions of a frame size, once."""
+        if (width, height) in self._masks:
+            return self._masks[(width, height)]
+
+        size = numpy.array([width, height], dtype=numpy.float64);
+        to_pixels = lambda polygons: [(polygon * size).round().astype(numpy.int32) for polygon in polygons];
+        if self.include:
+            mask = numpy.zeros((height, width), numpy.uint8);
+            cv2.fillPoly(mask, to_pixels(self.include), 255);
+        else:
+            mask = numpy.full((height, width), 255, numpy.uint8);
+        if self.exclude:
+            cv2.fillPoly(mask, to_pixels(self.exclude), 0);
+
+        regions = None;
+        if self.include:
+            # Bounding rectangles of what is left of the include zones once exclusions are cut out
+            (contours, _) = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE);
+            rects = [cv2.boundingRect(c) for c in contours];
+            regions = imgutils.merge_rects([[x, y, x + w, y + h] for x, y, w, h in rects]);
+
+        self._masks[(width, height)] = (mask, regions);
+        return mask, regions